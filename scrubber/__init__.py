@@ -9,12 +9,166 @@ See LICENSE for license details.
 __author__ = "Samuel Stauffer <samuel@lefora.com>"
 __version__ = "1.6.1"
 __license__ = "BSD"
-__all__ = ['Scrubber', 'SelectiveScriptScrubber', 'ScrubberWarning', 'UnapprovedJavascript', 'urlize']
+__all__ = ['LimitExceeded', 'LimitReached', 'Limits', 'Policy', 'ScrubObserver', 'ScrubResult', 'Scrubber', 'SelectiveScriptScrubber', 'ScrubberWarning', 'UnapprovedJavascript', 'Urlizer', 'scrub_many', 'urlize']
 
-import re, string
-from urlparse import urljoin
+import re, string, hashlib, marshal, threading, time, weakref
 from itertools import chain
-from BeautifulSoup import BeautifulSoup, Comment
+from collections import namedtuple
+from BeautifulSoup import BeautifulSoup, Comment, NavigableString, DEFAULT_OUTPUT_ENCODING
+from scrubber.limits import Budget, LimitExceeded, LimitedSoup, Limits
+from scrubber.attributes import get_style_sanitizer, is_safe_value, _suspicious_re as _suspicious_value_re
+from scrubber.urls import get_url_normalizer
+from scrubber.whitelists import PrefixSet, RegexSet
+
+LEADING_PUNCTUATION  = ['(', '<', '&lt;']
+TRAILING_PUNCTUATION = ['.', ',', ')', '>', '\n', '&gt;']
+
+word_split_re = re.compile(r'([\s\xa0]+|&nbsp;)') # a0 == NBSP
+punctuation_re = re.compile('^(?P<lead>(?:%s)*)(?P<middle>.*?)(?P<trail>(?:%s)*)$' % \
+    ('|'.join([re.escape(x) for x in LEADING_PUNCTUATION]),
+    '|'.join([re.escape(x) for x in TRAILING_PUNCTUATION])))
+simple_email_re = re.compile(r'^\S+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9._-]+$')
+
+def _escape(html):
+    return html.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
+
+# Same as BeautifulSoup's BARE_AMPERSAND_OR_BRACKET for the ampersands
+_bare_ampersand_re = re.compile(r'&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;)')
+
+def _escape_markup(text):
+    """Escape the text of html, leaving character references alone."""
+    if '&' in text:
+        text = _bare_ampersand_re.sub('&amp;', text)
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+class Urlizer(object):
+    """Converts any URLs in text into clickable links.
+
+    All regular expressions are compiled once when the Urlizer is created so
+    a single instance can be called on any number of strings.
+
+    If trim_url_limit is not None, the URLs in link text longer than this limit
+    will truncated to trim_url_limit-3 characters and appended with an elipsis.
+
+    If nofollow is True, the URLs in link text will get a rel="nofollow"
+    attribute.
+
+    If autoescape is True, the link text and URLs will get autoescaped.
+
+    If markup is True the text is taken from html, with its character
+    references, and when links are made the '&' (that don't start a
+    reference), '<' and '>' in the rest of it are escaped so the result can
+    be written out as it is. Text without anything to link is returned
+    unchanged. The hrefs of links are always escaped.
+
+    Bare domains (no scheme or "www.") are only linked when they end with
+    one of tlds.
+
+    When called with max_links only the first max_links urls are linked,
+    the rest is left as text.
+    """
+    tlds = ('.org', '.net', '.com')
+    url_safe = '%/&=:;#?+*'
+    url_schemes = frozenset(('http', 'https'))
+
+    def __init__(self, trim_url_limit=None, nofollow=False, autoescape=False, tlds=None, markup=False):
+        self.trim_url_limit = trim_url_limit
+        self.nofollow = nofollow
+        self.autoescape = autoescape
+        self.markup = markup
+        if tlds is not None:
+            self.tlds = tuple(tlds)
+        self.domain_chars = string.ascii_letters + string.digits
+        self.normalize_url = get_url_normalizer(self.url_schemes)
+        # Matches if the text contains anything that could become a link.
+        # Text without a match is returned untouched (unless autoescaping).
+        self.candidate_re = re.compile('|'.join(re.escape(x)
+            for x in ('http://', 'https://', 'www.', '@') + self.tlds))
+
+    def trim_url(self, url):
+        limit = self.trim_url_limit
+        if limit is not None and len(url) > limit:
+            return '%s...' % url[:max(0, limit - 3)]
+        return url
+
+    def __call__(self, text, max_links=None):
+        autoescape = self.autoescape
+        if not autoescape and not self.candidate_re.search(text):
+            return text
+
+        escape = None
+        if autoescape:
+            escape = _escape
+        elif self.markup:
+            escape = _escape_markup
+        words = word_split_re.split(text)
+        nofollow_attr = self.nofollow and ' rel="nofollow"' or ''
+        links = 0
+        for i, word in enumerate(words):
+            match = None
+            if ('.' in word or '@' in word or ':' in word) and links != max_links:
+                match = punctuation_re.match(word.replace(u'\u2019', "'"))
+            if match:
+                lead, middle, trail = match.groups()
+                middle = middle.encode('utf-8')
+                # Make URL we want to point to.
+                url = None
+                if middle.startswith(('http://', 'https://')):
+                    url = self.normalize_url(middle, safe=self.url_safe)
+                elif middle.startswith('www.') or ('@' not in middle and \
+                        middle and middle[0] in self.domain_chars and \
+                        middle.endswith(self.tlds)):
+                    url = self.normalize_url('http://' + middle, safe=self.url_safe)
+                elif '@' in middle and not ':' in middle and simple_email_re.match(middle):
+                    url = 'mailto:%s' % middle
+                    nofollow_attr = ''
+                # Make link.
+                if url:
+                    trimmed = self.trim_url(middle)
+                    if escape is not None:
+                        lead, trail, trimmed = escape(lead), escape(trail), escape(trimmed)
+                    if autoescape:
+                        url = _escape(url)
+                    else:
+                        url = _escape_markup(url).replace('"', '&quot;')
+                    middle = '<a href="%s"%s>%s</a>' % (url, nofollow_attr, trimmed)
+                    words[i] = '%s%s%s' % (lead, middle.decode('utf-8'), trail)
+                    links += 1
+                elif escape is not None:
+                    words[i] = escape(word)
+            elif escape is not None:
+                words[i] = escape(word)
+        return u''.join(words)
+
+_urlizers = {}
+
+def get_urlizer(trim_url_limit=None, nofollow=False, autoescape=False, markup=False):
+    """Return a shared Urlizer for the given settings."""
+    key = (trim_url_limit, bool(nofollow), bool(autoescape), bool(markup))
+    try:
+        return _urlizers[key]
+    except KeyError:
+        urlizer = _urlizers[key] = Urlizer(trim_url_limit, nofollow, autoescape, markup=markup)
+        return urlizer
+
+def _autolink(urlizer, text, budget):
+    """Return text autolinked by urlizer with as many links as budget
+    allows, or None if it is left as it is."""
+    text2 = urlizer(text)
+    if text2 == text:
+        return None
+    if budget is not None:
+        count = text2.count('<a href=')
+        allowed = budget.take_autolinks(count)
+        if not allowed and count:
+            return None
+        if allowed < count:
+            text2 = urlizer(text, allowed)
+    return text2
 
 def urlize(text, trim_url_limit=None, nofollow=False, autoescape=False):
     """Converts any URLs in text into clickable links.
@@ -29,59 +183,262 @@ def urlize(text, trim_url_limit=None, nofollow=False, autoescape=False):
 
     *Modified from Django*
     """
-    from urllib import quote as urlquote
-    
-    LEADING_PUNCTUATION  = ['(', '<', '&lt;']
-    TRAILING_PUNCTUATION = ['.', ',', ')', '>', '\n', '&gt;']
-    
-    word_split_re = re.compile(r'([\s\xa0]+|&nbsp;)') # a0 == NBSP
-    punctuation_re = re.compile('^(?P<lead>(?:%s)*)(?P<middle>.*?)(?P<trail>(?:%s)*)$' % \
-        ('|'.join([re.escape(x) for x in LEADING_PUNCTUATION]),
-        '|'.join([re.escape(x) for x in TRAILING_PUNCTUATION])))
-    simple_email_re = re.compile(r'^\S+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9._-]+$')
-    del x # Temporary variable
-
-    def escape(html):
-        return html.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
-
-    trim_url = lambda x, limit=trim_url_limit: limit is not None and (len(x) > limit and ('%s...' % x[:max(0, limit - 3)])) or x
-    words = word_split_re.split(text)
-    nofollow_attr = nofollow and ' rel="nofollow"' or ''
-    for i, word in enumerate(words):
-        match = None
-        if '.' in word or '@' in word or ':' in word:
-            match = punctuation_re.match(word.replace(u'\u2019', "'"))
-        if match:
-            lead, middle, trail = match.groups()
-            middle = middle.encode('utf-8')
-            # Make URL we want to point to.
-            url = None
-            if middle.startswith('http://') or middle.startswith('https://'):
-                url = urlquote(middle, safe='%/&=:;#?+*')
-            elif middle.startswith('www.') or ('@' not in middle and \
-                    middle and middle[0] in string.ascii_letters + string.digits and \
-                    (middle.endswith('.org') or middle.endswith('.net') or middle.endswith('.com'))):
-                url = urlquote('http://%s' % middle, safe='%/&=:;#?+*')
-            elif '@' in middle and not ':' in middle and simple_email_re.match(middle):
-                url = 'mailto:%s' % middle
-                nofollow_attr = ''
-            # Make link.
-            if url:
-                trimmed = trim_url(middle)
-                if autoescape:
-                    lead, trail = escape(lead), escape(trail)
-                    url, trimmed = escape(url), escape(trimmed)
-                middle = '<a href="%s"%s>%s</a>' % (url, nofollow_attr, trimmed)
-                words[i] = '%s%s%s' % (lead, middle.decode('utf-8'), trail)
-            elif autoescape:
-                words[i] = escape(word)
-        elif autoescape:
-            words[i] = escape(word)
-    return u''.join(words)
-    
+    return get_urlizer(trim_url_limit, nofollow, autoescape)(text)
+
+def scrub_many(documents, scrubber_class=None, scrubber_kwargs=None, workers=None, chunksize=64, ordered=True, maxtasksperchild=None):
+    """Scrub an iterable of documents using a pool of worker processes.
+
+    Generates a scrubber.batch.BatchResult (index, html, warnings, error)
+    per document. See scrubber.batch.scrub_many for details.
+    """
+    from scrubber import batch
+    return batch.scrub_many(documents, scrubber_class or Scrubber, scrubber_kwargs,
+        workers, chunksize, ordered, maxtasksperchild)
+
+class AutolinkedString(NavigableString):
+    """Text containing the markup for links created by the autolinker.
+
+    Newer versions of BeautifulSoup escape '<' and '>' when rendering text,
+    so this is always rendered as-is.
+    """
+    def __str__(self, encoding=DEFAULT_OUTPUT_ENCODING):
+        if encoding:
+            return self.encode(encoding)
+        return self
+
 class ScrubberWarning(object):
     pass
 
+class LimitReached(ScrubberWarning):
+    """Part of the input was left out because the scrub reached one of
+    its Limits."""
+    def __init__(self, limit, value):
+        self.limit = limit
+        self.value = value
+
+def _code_hash(func):
+    """Return a hash of the code of a function or method."""
+    func = getattr(func, 'im_func', func)
+    return hashlib.sha1(marshal.dumps(func.func_code)).hexdigest()
+
+def _describe(value):
+    """Return a stable, comparable description of a policy value."""
+    if hasattr(value, 'pattern') and hasattr(value, 'flags'):
+        return ('re', value.pattern, value.flags)
+    if isinstance(value, (set, frozenset)):
+        return ('set', sorted(_describe(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return ('seq', [_describe(v) for v in value])
+    if isinstance(value, dict):
+        return ('map', sorted((k, _describe(v)) for k, v in value.items()))
+    if callable(value) and hasattr(value, 'func_code'):
+        return ('code', _code_hash(value))
+    return value
+
+class FrozenDict(dict):
+    """A dict that can't be changed."""
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("FrozenDict objects are immutable")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.items())))
+
+class Policy(object):
+    """A compiled, immutable scrubbing policy.
+
+    Holds the whitelists as frozensets (attribute and CSS property names
+    lowercased), the tag normalizations, the _scrub_tag_<name> functions
+    keyed by tag name and any extra precompiled settings a Scrubber subclass
+    needs. Policies
+    compare and hash by their fingerprint, so they can be shared freely
+    between scrubbers and threads. Use replace() to derive a new one.
+    """
+    __slots__ = ('allowed_tags', 'disallowed_tags_save_content', 'allowed_attributes',
+        'allowed_css_properties', 'allowed_url_schemes', 'normalized_tag_replacements', 'tag_hooks',
+        'extras', 'fingerprint')
+
+    def __init__(self, allowed_tags=(), disallowed_tags_save_content=(), allowed_attributes=(),
+            normalized_tag_replacements=None, tag_hooks=None, extras=None, allowed_css_properties=(),
+            allowed_url_schemes=()):
+        values = dict(
+            allowed_tags = frozenset(allowed_tags),
+            disallowed_tags_save_content = frozenset(disallowed_tags_save_content),
+            allowed_attributes = frozenset(k.lower() for k in allowed_attributes),
+            allowed_css_properties = frozenset(k.lower() for k in allowed_css_properties),
+            allowed_url_schemes = frozenset(k.lower() for k in allowed_url_schemes),
+            normalized_tag_replacements = FrozenDict(normalized_tag_replacements or {}),
+            tag_hooks = FrozenDict(tag_hooks or {}),
+            extras = FrozenDict(extras or {}),
+        )
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+        description = repr(sorted((name, _describe(value)) for name, value in values.items()))
+        object.__setattr__(self, 'fingerprint', hashlib.sha1(description).hexdigest())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Policy objects are immutable")
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __eq__(self, other):
+        return isinstance(other, Policy) and self.fingerprint == other.fingerprint
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<Policy %s>" % self.fingerprint[:12]
+
+    def replace(self, **changes):
+        """Return a new Policy with the given fields changed."""
+        values = dict((name, getattr(self, name)) for name in self.__slots__ if name != 'fingerprint')
+        values.update(changes)
+        return Policy(**values)
+
+# Compiled policies of Scrubber classes. Weak so classes made at runtime
+# can go away.
+_class_policies = weakref.WeakKeyDictionary()
+
+# class -> {method names: whether the class uses Scrubber's versions of all
+# those methods}
+_class_keeps_methods = weakref.WeakKeyDictionary()
+
+def _keeps_methods(cls, names):
+    """Return True if cls doesn't override any of the Scrubber methods
+    called names. Cached per class."""
+    try:
+        known = _class_keeps_methods[cls]
+    except KeyError:
+        known = _class_keeps_methods[cls] = {}
+    try:
+        return known[names]
+    except KeyError:
+        keeps = known[names] = all(getattr(cls, name).im_func is getattr(Scrubber, name).im_func for name in names)
+        return keeps
+
+class ScrubResult(namedtuple('ScrubResult', 'html warnings stats')):
+    """Result of Scrubber.scrub_ex: the sanitized html, the list of
+    ScrubberWarning objects and a dict of statistics."""
+    __slots__ = ()
+
+class ScrubContext(object):
+    """State of a single call to Scrubber.scrub_ex."""
+    __slots__ = ('warnings', 'stats', 'meter', 'budget', 'truncation')
+
+    def __init__(self):
+        self.warnings = []
+        self.stats = {}
+        self.meter = None
+        self.budget = None
+        # (max_chars, ellipsis) for Scrubber.scrub_truncated
+        self.truncation = None
+
+class ScrubObserver(object):
+    """Receives the measurements of a Scrubber(observer=...) at the end of
+    every scrub. Subclass it to feed them to a metrics system."""
+
+    def phase_finished(self, scrubber, phase, seconds):
+        """Called with the wall time of each phase of the scrub."""
+        pass
+
+    def scrub_finished(self, scrubber, stats):
+        """Called with the stats of the scrub (as returned by scrub_ex)
+        which include the counters and a 'timings' dict."""
+        pass
+
+class _Meter(object):
+    """Collects the timings and counters of one instrumented scrub."""
+    __slots__ = ('stats', 'timings', 'mark')
+
+    phases = ('cache', 'pre', 'fast_path', 'blocks', 'parse', 'strip', 'autolink', 'tag_scrubbers', 'remove', 'normalize', 'serialize', 'post')
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.timings = stats['timings'] = {}
+        self.mark = time.time()
+
+    def lap(self, phase):
+        """Add the time since the previous lap to phase."""
+        now = time.time()
+        self.add(phase, now - self.mark)
+        self.mark = now
+
+    def add(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def timed(self, phase, func):
+        """Return func wrapped to add the time spent in it to phase."""
+        def _timed(*args):
+            start = time.time()
+            try:
+                return func(*args)
+            finally:
+                self.add(phase, time.time() - start)
+        return _timed
+
+    def instrument_walk(self, urlizer, tag_hooks, strip_attributes):
+        """Return versions of the callables used by the single pass walk
+        that record their time and counters."""
+        stats = self.stats
+        stats['text_autolinked'] = stats['attributes_dropped'] = 0
+        timed_urlizer = self.timed('autolink', urlizer)
+        def _urlizer(text, max_links=None):
+            result = timed_urlizer(text, max_links)
+            if result != text:
+                stats['text_autolinked'] += 1
+            return result
+        def _strip_attributes(node):
+            count = len(node.attrs)
+            strip_attributes(node)
+            stats['attributes_dropped'] += count - len(node.attrs)
+        tag_hooks = dict((name, self.timed('tag_scrubbers', hook)) for name, hook in tag_hooks.items())
+        return _urlizer, tag_hooks, _strip_attributes
+
+    def walked(self, visited, removed):
+        """Record the end of the single pass walk."""
+        self.lap('strip')
+        self.timings['strip'] -= self.timings.get('autolink', 0.0) + self.timings.get('tag_scrubbers', 0.0)
+        self.stats['nodes_visited'] = self.stats.get('nodes_visited', 0) + visited
+        self.stats['nodes_removed'] = self.stats.get('nodes_removed', 0) + removed
+
+    def report(self, scrubber, observer):
+        for phase in self.phases:
+            if phase in self.timings:
+                observer.phase_finished(scrubber, phase, self.timings[phase])
+        observer.scrub_finished(scrubber, self.stats)
+
+# Tokens of the markup the fast path accepts: lowercase tags with double
+# quoted attributes that need no escaping, text and entity references
+# BeautifulSoup passes through unchanged.
+_fast_token_re = re.compile(r'<(/?)([a-z][a-z0-9]*)((?:\s+[a-z]+="[^"<>&]*")*)\s*(/?)>|[^<>&]+|&(?:[a-zA-Z][a-zA-Z0-9]*|#[0-9]+);')
+_fast_attr_re = re.compile(r'([a-z]+)="([^"]*)"')
+
+# Whitespace collapsed by Scrubber(minify=True) in text outside of these tags
+_whitespace_re = re.compile(r'[\t\n\f\r ]+')
+_preserve_whitespace_tags = frozenset(BeautifulSoup.PRESERVE_WHITESPACE_TAGS) | frozenset(BeautifulSoup.QUOTE_TAGS)
+
+def _collapse_whitespace(text):
+    # Most text has nothing to collapse, checking is much cheaper than sub()
+    if '  ' in text or '\n' in text or '\t' in text or '\r' in text or '\f' in text:
+        return _whitespace_re.sub(u' ', text)
+    return text
+
+def _implicitly_closes(stack, name):
+    """Return True if BeautifulSoup would close any of the open tags in
+    stack on seeing a start tag name (see BeautifulSoup._smartPop)."""
+    triggers = BeautifulSoup.NESTABLE_TAGS.get(name)
+    reset_nesting = name in BeautifulSoup.RESET_NESTING_TAGS
+    for i in range(len(stack)-1, -1, -1):
+        p = stack[i]
+        if p == name and triggers is None:
+            return True
+        if (triggers is not None and p in triggers) \
+                or (triggers is None and reset_nesting and p in BeautifulSoup.RESET_NESTING_TAGS):
+            return i != len(stack)-1
+    return False
+
 class Scrubber(object):
     allowed_tags = set((
             'a', 'abbr', 'acronym', 'b', 'bdo', 'big', 'blockquote', 'br',
@@ -105,41 +462,204 @@ class Scrubber(object):
             'name', 'value', 'quality', 'data', 'scale', # for flash embed param tags, could limit to just param if this is harmful
             'salign', 'align', 'wmode',
         )) # Bad attributes: 'allowscriptaccess', 'xmlns', 'target'
+    allowed_css_properties = set((
+            'background', 'background-color', 'border', 'border-bottom',
+            'border-collapse', 'border-color', 'border-left', 'border-right',
+            'border-spacing', 'border-style', 'border-top', 'border-width',
+            'clear', 'color', 'direction', 'display', 'float',
+            'font', 'font-family', 'font-size', 'font-style', 'font-variant', 'font-weight',
+            'height', 'letter-spacing', 'line-height', 'list-style', 'list-style-type',
+            'margin', 'margin-bottom', 'margin-left', 'margin-right', 'margin-top',
+            'padding', 'padding-bottom', 'padding-left', 'padding-right', 'padding-top',
+            'text-align', 'text-decoration', 'text-indent', 'text-transform',
+            'vertical-align', 'white-space', 'width', 'word-spacing',
+        )) # Left out: 'position', 'z-index' and friends that allow overlaying the page
+    allowed_url_schemes = set(('http', 'https', 'ftp', 'mailto')) # For absolute a href and img src urls
     normalized_tag_replacements = {'b': 'strong', 'i': 'em'}
+    stream_buffered_tags = set() # Tags scrub_stream collects whole for their _scrub_tag_ method
+    parser = 'beautifulsoup' # See scrubber.parsers for the available backends
+    limits = None # Limits for each scrub (see scrubber.limits)
 
-    def __init__(self, base_url=None, autolink=True, nofollow=True, remove_comments=True, ignore_empty_attr=True):
+    def __init__(self, base_url=None, autolink=True, nofollow=True, remove_comments=True, ignore_empty_attr=True, single_pass=True, parser=None, cache=None, policy=None, observer=None, fast_path=True, limits=None, minify=False, compact_tree=False, block_cache=None, prune=True):
         self.base_url = base_url
         self.autolink = autolink and bool(urlize)
         self.nofollow = nofollow
         self.ignore_empty_attr = ignore_empty_attr
         self.remove_comments = remove_comments
-        self.allowed_tags = self.__class__.allowed_tags.copy()
-        self.disallowed_tags_save_content = self.__class__.disallowed_tags_save_content.copy()
-        self.allowed_attributes = self.__class__.allowed_attributes.copy()
-        self.normalized_tag_replacements = self.__class__.normalized_tag_replacements.copy()
-        self.warnings = []
+        self.single_pass = single_pass
+        self.minify = minify
+        if parser is not None:
+            self.parser = parser
+        if self.parser != 'beautifulsoup':
+            # Fail early for unknown or uninstalled parsers
+            from scrubber.parsers import get_parser_backend
+            get_parser_backend(self.parser)
+        self.cache = cache
+        self.block_cache = block_cache
+        self.observer = observer
+        if limits is not None:
+            self.limits = limits
+        self.fast_path = fast_path and self._fast_path_safe()
+        self.prune = prune and self._prune_safe()
+        if policy is None:
+            policy = self.get_policy()
+        self.policy = policy
+        self.allowed_tags = policy.allowed_tags
+        self.disallowed_tags_save_content = policy.disallowed_tags_save_content
+        self.allowed_attributes = policy.allowed_attributes
+        self.allowed_css_properties = policy.allowed_css_properties
+        self.allowed_url_schemes = policy.allowed_url_schemes
+        self.normalized_tag_replacements = policy.normalized_tag_replacements
+        self.compact_tree = compact_tree and self._compact_tree_safe()
+        # (state, fingerprint) of the last policy_fingerprint() call
+        self._fingerprint = None
+        # Per thread stack of ScrubContexts for the calls in progress
+        self._local = threading.local()
+        self._warnings = []
+        # Scrubs the fast path was taken and skipped for, see fast_path_stats()
+        self._fast_path_lock = threading.Lock()
+        self._fast_path_taken = self._fast_path_skipped = 0
 
+    @classmethod
+    def compile_policy(cls, **overrides):
+        """Return a new Policy built from the class attributes and the
+        _scrub_tag_<name> methods of this class. Keyword arguments replace
+        fields of the policy."""
         # Find all _scrub_tab_<name> methods
-        self.tag_scrubbers = {}
-        for k in chain(*[cls.__dict__ for cls in self.__class__.__mro__]):
+        tag_hooks = {}
+        for k in chain(*[c.__dict__ for c in reversed(cls.__mro__)]):
             if k.startswith('_scrub_tag_'):
-                self.tag_scrubbers[k[11:]] = [getattr(self, k)]
+                tag_hooks[k[11:]] = getattr(cls, k).im_func
+        values = dict(
+            allowed_tags = cls.allowed_tags,
+            disallowed_tags_save_content = cls.disallowed_tags_save_content,
+            allowed_attributes = cls.allowed_attributes,
+            allowed_css_properties = cls.allowed_css_properties,
+            allowed_url_schemes = cls.allowed_url_schemes,
+            normalized_tag_replacements = cls.normalized_tag_replacements,
+            tag_hooks = tag_hooks,
+            extras = cls._policy_extras(),
+        )
+        values.update(overrides)
+        return Policy(**values)
+
+    @classmethod
+    def _policy_extras(cls):
+        """Return a dict of extra (precompiled) settings for the policy."""
+        return {}
+
+    @classmethod
+    def get_policy(cls):
+        """Return the Policy for this class, compiling it on first use.
+
+        The policy is shared by all instances created without an explicit
+        policy, so changes to the class attributes after that are ignored.
+        """
+        try:
+            return _class_policies[cls]
+        except KeyError:
+            policy = _class_policies[cls] = cls.compile_policy()
+            return policy
+
+    # Methods the fast path stands in for. It is disabled for subclasses
+    # overriding any of them.
+    _fast_path_methods = ('_parse', '_scrub_soup', '_scrub_soup_single_pass', '_scrub_soup_multi_pass',
+        'strip_disallowed', 'autolink_soup', 'normalize_html', '_strip_attributes', '_remove_nodes', '_serialize')
+
+    def _fast_path_safe(self):
+        return self.parser == 'beautifulsoup' and _keeps_methods(self.__class__, self._fast_path_methods)
+
+    def _incremental_safe(self):
+        return (self.limits is None and self._fast_path_safe()
+            and _keeps_methods(self.__class__, ('_scrub_html_pre', '_scrub_html_post')))
+
+    def _fragments_safe(self):
+        return (self.parser == 'beautifulsoup' and self.limits is None and self.observer is None
+            and _keeps_methods(self.__class__, ('_parse',)))
+
+    def _prune_safe(self):
+        # The observer counts the nodes that are removed
+        return self.observer is None and self._fast_path_safe()
+
+    def _compact_tree_safe(self):
+        # Elements can't mark a meta tag for encoding substitution and
+        # decide whether they are self-closing by their current name
+        self_closing = BeautifulSoup.SELF_CLOSING_TAGS
+        return (self.limits is None and self.observer is None and self._fast_path_safe()
+            and 'meta' not in self.allowed_tags
+            and all((k in self_closing) == (v in self_closing) for k, v in self.normalized_tag_replacements.items()))
+
+    def _contexts(self):
+        try:
+            return self._local.contexts
+        except AttributeError:
+            contexts = self._local.contexts = []
+            return contexts
+
+    def _meter(self):
+        """Return the _Meter of the scrub in progress or None if it isn't
+        instrumented."""
+        contexts = self._contexts()
+        if contexts:
+            return contexts[-1].meter
+        return None
+
+    def _count_fast_path(self, taken):
+        with self._fast_path_lock:
+            if taken:
+                self._fast_path_taken += 1
+            else:
+                self._fast_path_skipped += 1
+
+    def fast_path_stats(self):
+        """Return a dict with the number of scrubs the fast path was taken
+        and skipped for since the scrubber was created."""
+        with self._fast_path_lock:
+            return dict(taken=self._fast_path_taken, skipped=self._fast_path_skipped)
+
+    def _budget(self):
+        """Return the Budget of the scrub in progress or None if there are
+        no limits."""
+        contexts = self._contexts()
+        if contexts:
+            return contexts[-1].budget
+        return None
+
+    def _get_warnings(self):
+        contexts = self._contexts()
+        if contexts:
+            return contexts[-1].warnings
+        return self._warnings
+
+    def _set_warnings(self, warnings):
+        self._warnings = warnings
+
+    warnings = property(_get_warnings, _set_warnings, doc="""
+        The warnings of the scrub in progress on this thread, otherwise the
+        warnings of the last call to scrub().""")
+
+    def warn(self, warning):
+        """Record a ScrubberWarning for the scrub in progress."""
+        self.warnings.append(warning)
+
+    @property
+    def tag_scrubbers(self):
+        """Map of tag name to a list holding the bound _scrub_tag_<name> method."""
+        return dict((name, [hook.__get__(self, self.__class__)]) for name, hook in self.policy.tag_hooks.items())
 
     def autolink_soup(self, soup):
         """Autolink urls in text nodes that aren't already linked (inside anchor tags)."""
-        def _autolink(node):
+        urlizer = get_urlizer(nofollow=self.nofollow, markup=True)
+        budget = self._budget()
+        stack = [soup]
+        while stack:
+            node = stack.pop()
             if isinstance(node, basestring):
-                text = node
-                text2 = urlize(text, nofollow=self.nofollow)
-                if text != text2:
-                    node.replaceWith(text2)
-            else:
-                if node.name == "a":
-                    return
-
-                for child in node.contents:
-                    _autolink(child)
-        _autolink(soup)
+                text = _autolink(urlizer, node, budget)
+                if text is not None:
+                    node.replaceWith(AutolinkedString(text))
+            elif node.name != "a":
+                stack.extend(reversed(node.contents))
 
     def strip_disallowed(self, soup):
         """Remove nodes and attributes from the soup that aren't specifically allowed."""
@@ -157,24 +677,39 @@ class Scrubber(object):
                 toremove.append((node.name in self.disallowed_tags_save_content, node))
                 continue
 
-            # Remove disallowed attributes
-            attrs = []
-            for k, v in node.attrs:
-                if not v and self.ignore_empty_attr:
-                    continue
+            self._strip_attributes(node)
 
-                if k.lower() not in self.allowed_attributes:
-                    continue
+        self._remove_nodes(toremove)
 
-                # TODO: This probably needs to be more robust
-                v2 = v.lower()
-                if any(x in v2 for x in ('javascript:', 'vbscript:', 'expression(')):
+    def _strip_attributes(self, node):
+        """Remove disallowed attributes from a tag."""
+        node.attrs = self._filter_attributes(node.attrs)
+
+    def _filter_attributes(self, node_attrs):
+        """Return the allowed (name, value) pairs from node_attrs."""
+        allowed_attributes = self.allowed_attributes
+        ignore_empty_attr = self.ignore_empty_attr
+        suspicious = _suspicious_value_re.search
+        attrs = []
+        for k, v in node_attrs:
+            if not v and ignore_empty_attr:
+                continue
+
+            name = k
+            if name not in allowed_attributes:
+                name = k.lower()
+                if name not in allowed_attributes:
                     continue
 
-                attrs.append((k,v))
-            node.attrs = attrs
+            if name == 'style':
+                v = get_style_sanitizer(self.allowed_css_properties)(v)
+                if not v:
+                    continue
+            elif suspicious(v) and not is_safe_value(v):
+                continue
 
-        self._remove_nodes(toremove)
+            attrs.append((k,v))
+        return attrs
 
     def normalize_html(self, soup):
         """Convert tags to a standard set. (e.g. convert 'b' tags to 'strong')"""
@@ -184,21 +719,88 @@ class Scrubber(object):
         #     node.extract()
 
     def _remove_nodes(self, nodes):
-        """Remove a list of nodes from the soup."""
-        for keep_contentes, node in nodes:
-            if keep_contentes and node.contents:
-                idx = node.parent.contents.index(node)
-                for n in reversed(list(node.contents)): # Copy the contents list to avoid modifying while traversing
-                    node.parent.insert(idx, n)
-            node.extract()
+        """Remove a list of (keep_contents, node) pairs from the soup.
+
+        The contents of every parent that loses children is rebuilt once,
+        with the kept contents of removed nodes (and of removed nodes inside
+        those) lifted into it, and the tree is relinked in a single walk. So
+        the cost is linear in the size of the tree however many nodes are
+        removed.
+        """
+        removed = {}
+        for keep_contents, node in nodes:
+            removed[id(node)] = keep_contents
+
+        # The surviving parents of removed nodes
+        parents = {}
+        for keep_contents, node in nodes:
+            parent = node.parent
+            if parent is not None and id(parent) not in removed:
+                parents[id(parent)] = parent
+
+        for parent in parents.itervalues():
+            contents = []
+            stack = list(reversed(parent.contents))
+            while stack:
+                node = stack.pop()
+                keep_contents = removed.get(id(node))
+                if keep_contents is None:
+                    node.parent = parent
+                    contents.append(node)
+                    continue
+                if keep_contents:
+                    stack.extend(reversed(node.contents))
+                    node.contents = []
+                    node.next = None
+                elif not isinstance(node, basestring):
+                    # Detach the subtree as extract() does
+                    node._lastRecursiveChild().next = None
+                node.parent = node.previous = node.previousSibling = node.nextSibling = None
+            parent.contents = contents
+            previous = None
+            for node in contents:
+                node.previousSibling = previous
+                if previous is not None:
+                    previous.nextSibling = node
+                previous = node
+            if previous is not None:
+                previous.nextSibling = None
+
+        # Fix the document order links of the trees that changed
+        roots = {}
+        seen = set()
+        for parent in parents.itervalues():
+            while parent.parent is not None and id(parent) not in seen:
+                seen.add(id(parent))
+                parent = parent.parent
+            if parent.parent is None:
+                roots[id(parent)] = parent
+        for root in roots.itervalues():
+            previous = root
+            stack = list(reversed(root.contents))
+            while stack:
+                node = stack.pop()
+                previous.next = node
+                node.previous = previous
+                previous = node
+                if not isinstance(node, basestring):
+                    stack.extend(reversed(node.contents))
+            previous.next = None
+
+    @property
+    def url_normalizer(self):
+        """The UrlNormalizer for allowed_url_schemes. Its stats() tell how
+        well its cache is doing."""
+        return get_url_normalizer(self.allowed_url_schemes)
 
     def _clean_path(self, node, attrname):
         url = node.get(attrname)
-        if url and '://' not in url and not url.startswith('mailto:'):
-            if url[0] not in ('/', '.'):
-                node['href'] = "http://" + url
-            elif self.base_url:
-                node['href'] = urljoin(self.base_url, url)
+        if url:
+            clean = self.url_normalizer(url, self.base_url)
+            if clean is None:
+                del node[attrname]
+            elif clean != url:
+                node[attrname] = clean
 
     def _scrub_tag_a(self, a):
         if self.nofollow:
@@ -220,6 +822,9 @@ class Scrubber(object):
         img['alt'] = img.get('alt', '')
 
         self._clean_path(img, 'src')
+        if not img.get('src'):
+            # The url had a scheme that isn't allowed
+            return True
 
     def _scrub_tag_font(self, node):
         attrs = []
@@ -242,11 +847,254 @@ class Scrubber(object):
         """Process the html after sanitization"""
         return html
 
+    def _scrub_fast(self, html):
+        """Return the scrubbed html without building a tree or None if html
+        needs the full treatment.
+
+        Only plain text and markup that BeautifulSoup would leave exactly as
+        it is, using allowed tags without _scrub_tag_<name> methods and
+        attributes that all pass _filter_attributes, is handled. The output
+        is the same as from the full path.
+        """
+        if not isinstance(html, unicode):
+            try:
+                html = html.decode('ascii')
+            except UnicodeError:
+                # Leave the guessing of the encoding to BeautifulSoup
+                return None
+        urlizer = self.autolink and get_urlizer(nofollow=self.nofollow, markup=True)
+        budget = self._budget()
+        if '<' not in html and '>' not in html and '&' not in html:
+            # Plain text
+            if not html.translate(BeautifulSoup.STRIP_ASCII_SPACES):
+                return None
+            result = urlizer(html) if urlizer else html
+            if self.minify:
+                result = _collapse_whitespace(result)
+            if budget is not None and not budget.fits(1, result.count('<a href=')):
+                return None
+            return result
+
+        allowed_tags = self.allowed_tags
+        tag_hooks = self.policy.tag_hooks
+        replacements = self.normalized_tag_replacements
+        minify = self.minify
+        out = []
+        text = []
+        stack = []
+        nodes = checked = 0
+        max_depth = budget and budget.limits.max_depth
+        match = _fast_token_re.match
+        pos, end = 0, len(html)
+        while True:
+            m = match(html, pos) if pos < end else None
+            if m is None or m.group(2):
+                if text:
+                    data = u''.join(text)
+                    text = []
+                    if not data.translate(BeautifulSoup.STRIP_ASCII_SPACES) \
+                            and not BeautifulSoup.PRESERVE_WHITESPACE_TAGS.intersection(stack):
+                        data = '\n' in data and u'\n' or u' '
+                    elif urlizer and 'a' not in stack:
+                        data = urlizer(data)
+                    if minify and not _preserve_whitespace_tags.intersection(stack):
+                        data = _collapse_whitespace(data)
+                    out.append(data)
+                    nodes += 1
+                if m is None:
+                    break
+            else:
+                text.append(m.group(0))
+                pos = m.end()
+                continue
+            pos = m.end()
+
+            closing, name, attrs, self_closing = m.groups()
+            if name not in allowed_tags or name in tag_hooks or name in BeautifulSoup.QUOTE_TAGS:
+                return None
+            if closing:
+                if attrs or self_closing or not stack or stack[-1] != name:
+                    return None
+                stack.pop()
+                out.append(u'</%s>' % replacements.get(name, name))
+                continue
+
+            attrs = _fast_attr_re.findall(attrs)
+            if self._filter_attributes(attrs) != attrs:
+                return None
+            tag = replacements.get(name, name)
+            if attrs:
+                tag += u' ' + u' '.join(u'%s="%s"' % attr for attr in attrs)
+            nodes += 1
+            if budget is not None and nodes - checked >= Budget.check_interval:
+                checked = nodes
+                if budget.out_of_time():
+                    # Let the full path stop at the deadline
+                    return None
+            if max_depth is not None and len(stack) >= max_depth:
+                return None
+            if name in BeautifulSoup.SELF_CLOSING_TAGS:
+                out.append(u'<%s />' % tag)
+            elif self_closing or _implicitly_closes(stack, name):
+                return None
+            else:
+                stack.append(name)
+                out.append(u'<%s>' % tag)
+        if pos < end:
+            return None
+        for name in reversed(stack):
+            out.append(u'</%s>' % replacements.get(name, name))
+        result = u''.join(out)
+        # Anything over the limits is left to the full path. The only links
+        # in the result are the ones made by the autolinker.
+        if budget is not None and not budget.fits(nodes, result.count('<a href=')):
+            return None
+        return result
+
+    def _serialize(self, soup):
+        """Return the scrubbed tree as unicode."""
+        from scrubber.serialize import serialize
+
+        return serialize(soup, minify=self.minify)
+
+    def _parse(self, html):
+        """Return a BeautifulSoup tree for html using the selected parser."""
+        if self.parser == 'beautifulsoup':
+            budget = self._budget()
+            contexts = self._contexts()
+            if contexts and contexts[-1].truncation is not None:
+                from scrubber.truncate import TruncatingSoup
+
+                return TruncatingSoup(html, budget or Budget(Limits()), self.allowed_tags,
+                    self.disallowed_tags_save_content, *contexts[-1].truncation)
+            if budget is not None:
+                return LimitedSoup(html, budget, self.allowed_tags, self.disallowed_tags_save_content)
+            return BeautifulSoup(html)
+        from scrubber.parsers import get_parser_backend
+        backend = get_parser_backend(self.parser)
+        budget = self._budget()
+        if budget is not None:
+            allowed_tags, kept_tags = self.allowed_tags, self.disallowed_tags_save_content
+            return backend.parse(html, lambda markup: LimitedSoup(markup, budget, allowed_tags, kept_tags))
+        return backend.parse(html)
+
+    def _scrub_tree(self, html):
+        """Parse, scrub and serialize html."""
+        if self.compact_tree:
+            from scrubber.tree import scrub_compact
+
+            return scrub_compact(self, html)
+        meter = self._meter()
+        if self.prune and self._budget() is None:
+            from scrubber.prune import PruningSoup
+
+            soup = PruningSoup(html, self)
+        else:
+            soup = self._parse(html)
+        if meter is not None:
+            meter.lap('parse')
+        self._scrub_soup(soup)
+        result = self._serialize(soup)
+        if meter is not None:
+            meter.lap('serialize')
+        return result
+
     def _scrub_soup(self, soup):
+        if self.single_pass:
+            self._scrub_soup_single_pass(soup)
+        else:
+            self._scrub_soup_multi_pass(soup)
+
+    def _scrub_soup_single_pass(self, soup):
+        """Strip, autolink, run the tag scrubbers and normalize in a single
+        walk of the tree.
+
+        Attributes are filtered and text autolinked on the way down, the
+        _scrub_tag_<name> methods and tag normalization run on the way back
+        up (once the children are done, as the multi-pass version sees them)
+        and all removals are applied together at the end. Subtrees of
+        disallowed tags that don't keep their contents are never visited.
+        """
+        urlizer = get_urlizer(nofollow=self.nofollow, markup=True)
+        tag_hooks = self.policy.tag_hooks
+        strip_attributes = self._strip_attributes
+        meter = self._meter()
+        if meter is not None:
+            urlizer, tag_hooks, strip_attributes = meter.instrument_walk(urlizer, tag_hooks, strip_attributes)
+        budget = self._budget()
+        max_depth = budget and budget.limits.max_depth
+        truncating = False
+        visited = depth = 0
+        toremove = []
+        # Stack entries are (node, inside_anchor). A None inside_anchor marks
+        # the point where we leave a tag after visiting its children.
+        stack = [(child, False) for child in reversed(soup.contents)]
+        while stack:
+            node, in_anchor = stack.pop()
+
+            if in_anchor is None:
+                depth -= 1
+                hook = tag_hooks.get(node.name)
+                if hook is not None:
+                    remove = hook(self, node)
+                    if remove:
+                        toremove.append((remove == "keep_contents", node))
+                if node.name in self.normalized_tag_replacements:
+                    node.name = self.normalized_tag_replacements[node.name]
+                continue
+
+            visited += 1
+            if budget is not None and (truncating or not budget.visit(visited)):
+                # Out of nodes or time, leave out the rest
+                truncating = True
+                toremove.append((False, node))
+                continue
+            if isinstance(node, basestring):
+                if self.remove_comments and isinstance(node, Comment):
+                    toremove.append((False, node))
+                elif self.autolink and not in_anchor:
+                    text = _autolink(urlizer, node, budget)
+                    if text is not None:
+                        node.replaceWith(AutolinkedString(text))
+                continue
+
+            if node.name not in self.allowed_tags:
+                keep_contents = node.name in self.disallowed_tags_save_content
+                toremove.append((keep_contents, node))
+                if keep_contents:
+                    stack.extend((child, in_anchor) for child in reversed(node.contents))
+                continue
+
+            if max_depth is not None and depth >= max_depth:
+                budget.exceeded('max_depth')
+                truncating = True
+                toremove.append((False, node))
+                continue
+
+            strip_attributes(node)
+
+            depth += 1
+            stack.append((node, None))
+            in_anchor = in_anchor or node.name == "a"
+            stack.extend((child, in_anchor) for child in reversed(node.contents))
+
+        if meter is not None:
+            meter.walked(visited, len(toremove))
+        self._remove_nodes(toremove)
+        if meter is not None:
+            meter.lap('remove')
+
+    def _scrub_soup_multi_pass(self, soup):
+        """Run each scrubbing step as a separate pass over the tree."""
+        meter = self._meter()
         self.strip_disallowed(soup)
+        if meter is not None:
+            meter.lap('strip')
 
         if self.autolink:
             self.autolink_soup(soup)
+            if meter is not None:
+                meter.lap('autolink')
 
         toremove = []
         for tag_name, scrubbers in self.tag_scrubbers.items():
@@ -257,21 +1105,265 @@ class Scrubber(object):
                         # Remove the node from the tree
                         toremove.append((remove == "keep_contents", node))
                         break
+        if meter is not None:
+            meter.lap('tag_scrubbers')
 
         self._remove_nodes(toremove)
+        if meter is not None:
+            meter.lap('remove')
 
         self.normalize_html(soup)
+        if meter is not None:
+            meter.lap('normalize')
 
-    def scrub(self, html):
-        """Return a sanitized version of the given html."""
+    def _fingerprint_state(self):
+        """Return the whitelists and settings the fingerprint is made from.
+        It is only made again when one of them is replaced. Subclasses with
+        extra settings that can change should extend this."""
+        return (self.policy, self.allowed_tags, self.disallowed_tags_save_content, self.allowed_attributes,
+            self.allowed_css_properties, self.allowed_url_schemes, self.normalized_tag_replacements,
+            self.base_url, self.autolink, self.nofollow, self.remove_comments, self.ignore_empty_attr,
+            self.parser, self.limits, self.minify)
 
-        self.warnings = []
+    def _fingerprint_parts(self):
+        """Return everything that affects the output of scrub() as a list of
+        strings. Subclasses with extra settings should extend this."""
+        policy = self.policy
+        if (self.allowed_tags is not policy.allowed_tags
+                or self.disallowed_tags_save_content is not policy.disallowed_tags_save_content
+                or self.allowed_attributes is not policy.allowed_attributes
+                or self.allowed_css_properties is not policy.allowed_css_properties
+                or self.allowed_url_schemes is not policy.allowed_url_schemes
+                or self.normalized_tag_replacements is not policy.normalized_tag_replacements):
+            # The whitelists were replaced on the instance
+            policy = policy.replace(
+                allowed_tags = self.allowed_tags,
+                disallowed_tags_save_content = self.disallowed_tags_save_content,
+                allowed_attributes = self.allowed_attributes,
+                allowed_css_properties = self.allowed_css_properties,
+                allowed_url_schemes = self.allowed_url_schemes,
+                normalized_tag_replacements = self.normalized_tag_replacements)
+        parts = [
+            __version__, self.__class__.__module__, self.__class__.__name__,
+            policy.fingerprint,
+            repr((self.base_url, self.autolink, self.nofollow, self.remove_comments,
+                self.ignore_empty_attr, self.parser, self.limits, self.minify)),
+        ]
+        # Include the code of the hooks so a changed subclass or upgrade
+        # doesn't get stale results from a persistent cache. The code of
+        # the tag hooks is part of the policy fingerprint.
+        for name in ('_scrub_html_pre', '_scrub_html_post', '_clean_path', '_filter_attributes'):
+            parts.append(name + ':' + _code_hash(getattr(self.__class__, name)))
+        return parts
 
-        html = self._scrub_html_pre(html)
-        soup = BeautifulSoup(html)
-        self._scrub_soup(soup)
-        html = unicode(soup)
-        return self._scrub_html_post(html)
+    def policy_fingerprint(self):
+        """Return a hash of the settings, whitelists and hooks of this
+        scrubber. Used in the keys of the result cache."""
+        state = self._fingerprint_state()
+        cached = self._fingerprint
+        if cached is None or cached[0] != state:
+            cached = self._fingerprint = (state, hashlib.sha1('\0'.join(self._fingerprint_parts())).hexdigest())
+        return cached[1]
+
+    def scrub(self, html, encoding=None):
+        """Return a sanitized version of the given html. If encoding is
+        given the result is a byte string in that encoding."""
+
+        result = self.scrub_ex(html, encoding)
+        self.warnings = result.warnings
+        return result.html
+
+    def scrub_ex(self, html, encoding=None):
+        """Return a ScrubResult (html, warnings, stats) for the given html.
+
+        Unlike scrub() this doesn't change the scrubber so a single
+        instance can be used by any number of threads at once. If encoding
+        is given the returned html is a byte string in that encoding, with
+        character references for any characters it can't represent.
+        """
+        context = ScrubContext()
+        contexts = self._contexts()
+        contexts.append(context)
+        try:
+            result = self._scrub(html, context)
+        finally:
+            contexts.pop()
+        if encoding:
+            result = result.encode(encoding, 'xmlcharrefreplace')
+        return ScrubResult(result, context.warnings, context.stats)
+
+    def scrub_async(self, html, executor):
+        """Run scrub_ex(html) in a concurrent.futures style executor and
+        return the future. With asyncio use
+        loop.run_in_executor(executor, scrubber.scrub_ex, html) instead."""
+        return executor.submit(self.scrub_ex, html)
+
+    def _scrub(self, html, context):
+        stats = context.stats
+        stats['bytes_in'] = len(html)
+        meter = None
+        if self.observer is not None:
+            meter = context.meter = _Meter(stats)
+        budget = None
+        if self.limits is not None:
+            budget = context.budget = Budget(self.limits)
+
+        # Truncated scrubs stop early, caching them isn't worth it
+        cache = self.cache
+        if context.truncation is not None:
+            cache = None
+        if cache is not None:
+            key = cache.make_key(html, self.policy_fingerprint())
+            cached = cache.get(key)
+            stats['cached'] = cached is not None
+            if meter is not None:
+                meter.lap('cache')
+            if cached is not None:
+                result, context.warnings = cached
+                stats['bytes_out'] = len(result)
+                if meter is not None:
+                    meter.report(self, self.observer)
+                return result
+
+        try:
+            result = html
+            if budget is not None:
+                result = budget.truncate_input(result)
+            result = self._scrub_html_pre(result)
+            if meter is not None:
+                meter.lap('pre')
+            fast = None
+            if context.truncation is not None:
+                from scrubber.truncate import scrub_truncated
+
+                fast, stats['truncated'] = scrub_truncated(self, result, *context.truncation)
+                if meter is not None:
+                    meter.lap('serialize')
+            elif self.fast_path:
+                fast = self._scrub_fast(result)
+                stats['fast_path'] = fast is not None
+                self._count_fast_path(fast is not None)
+                if meter is not None:
+                    meter.lap('fast_path')
+            if fast is None and self.block_cache is not None:
+                from scrubber.blocks import scrub_blocks
+
+                fast = scrub_blocks(self, result)
+                if meter is not None:
+                    meter.lap('blocks')
+            if fast is not None:
+                result = fast
+            else:
+                result = self._scrub_tree(result)
+        except LimitExceeded, e:
+            if self.limits.actions[e.limit] != 'escape':
+                raise
+            budget.reached.append(e.limit)
+            result = budget.escape_input(html)
+        result = self._scrub_html_post(result)
+        if meter is not None:
+            meter.lap('post')
+        if budget is not None and budget.reached:
+            stats['limits_reached'] = list(budget.reached)
+            for limit in budget.reached:
+                self.warn(LimitReached(limit, getattr(self.limits, limit)))
+
+        # Results cut short by the clock could come out differently next time
+        if cache is not None and not (budget is not None and budget.timed_out):
+            cache.set(key, result, context.warnings)
+            if meter is not None:
+                meter.lap('cache')
+        stats['bytes_out'] = len(result)
+        if meter is not None:
+            meter.report(self, self.observer)
+        return result
+
+    def audit(self, html):
+        """Return an AuditResult (safe, findings, warnings) listing what
+        scrubbing html would remove, without changing or serializing
+        anything.
+
+        The findings are AuditFinding tuples for the comments, tags and
+        attributes the whitelists and _scrub_tag_<name> methods would
+        remove. Rewrites every document gets, like autolinking, rel and
+        class on links, absolute urls and tag normalization, aren't
+        findings. Limits aren't applied.
+        """
+        from scrubber.audit import audit
+
+        return audit(self, html)
+
+    def is_safe(self, html):
+        """Return True if scrubbing html wouldn't remove anything (see
+        audit()). Stops at the first thing that would be removed."""
+        from scrubber.audit import audit
+
+        return audit(self, html, first_only=True).safe
+
+    def scrub_truncated(self, html, max_chars, ellipsis=u'...'):
+        """Return a ScrubResult (html, warnings, stats) for the start of html
+        that shows at most max_chars characters of text, for previews and
+        feed excerpts.
+
+        Parsing stops once the text doesn't fit, so the rest of the
+        document isn't parsed, scrubbed or autolinked. The last text is cut
+        at a word boundary when it has one and followed by ellipsis, which
+        is text but may use character references like &hellip;. Tags left
+        open are closed.
+        stats['truncated'] is True if anything was left out. Other parsers
+        and subclasses with their own _parse method scrub the whole
+        document and cut the result. The cache isn't used.
+        """
+        context = ScrubContext()
+        context.truncation = (max_chars, ellipsis)
+        contexts = self._contexts()
+        contexts.append(context)
+        try:
+            result = self._scrub(html, context)
+        finally:
+            contexts.pop()
+        return ScrubResult(result, context.warnings, context.stats)
+
+    def scrub_incremental(self, html, state=None):
+        """Scrub a new version of a document, only scrubbing the top-level
+        blocks that changed since the scrub that returned state.
+
+        Returns an IncrementalResult (html, warnings, stats, state). Pass its
+        state with the next version of the document. The html is the same
+        as from scrub(). Documents that can't be split into blocks safely
+        (and subclasses overriding the parsing, scrubbing, _scrub_html_pre or
+        _scrub_html_post methods) are scrubbed whole. Like scrub_ex() this
+        doesn't change the scrubber.
+        """
+        from scrubber.incremental import scrub_incremental
+
+        return scrub_incremental(self, html, state)
+
+    def scrub_fragments(self, fragments):
+        """Scrub a list of small html fragments, such as the comments on a
+        page, and return a list of ScrubResults in the same order.
+
+        Each result is the same as from scrub_ex(fragment) but the fragments
+        that need parsing are parsed together by a single parser, in
+        containers that markup from one fragment can't close or leak out
+        of. Scrubbers with limits, an observer, another parser or their own
+        _parse method scrub the fragments one by one.
+        """
+        from scrubber.fragments import scrub_fragments
+
+        return scrub_fragments(self, fragments)
+
+    def scrub_stream(self, chunks, encoding='utf-8'):
+        """Sanitize an iterable of html chunks without building a tree.
+
+        Returns a generator of sanitized unicode chunks which are produced as
+        the input is consumed. Byte string chunks are decoded using encoding.
+        The _scrub_html_pre and _scrub_html_post methods are not called.
+        """
+        from scrubber.stream import StreamScrubber
+
+        self.warnings = []
+        return StreamScrubber(self, encoding).scrub(chunks)
 
 class UnapprovedJavascript(ScrubberWarning):
     def __init__(self, src):
@@ -281,48 +1373,86 @@ class UnapprovedJavascript(ScrubberWarning):
 class SelectiveScriptScrubber(Scrubber):
     allowed_tags = Scrubber.allowed_tags | set(('script', 'noscript', 'iframe'))
     allowed_attributes = Scrubber.allowed_attributes | set(('scrolling', 'frameborder'))
+    stream_buffered_tags = set(('script',))
 
-    def __init__(self):
-        super(SelectiveScriptScrubber, self).__init__()
-
-        self.allowed_script_srcs = set((
-            'http://www.statcounter.com/counter/counter_xhtml.js',
-            # 'http://www.google-analytics.com/urchin.js',
-            'http://pub.mybloglog.com/',
-            'http://rpc.bloglines.com/blogroll',
-            'http://widget.blogrush.com/show.js',
-            'http://re.adroll.com/',
-            'http://widgetserver.com/',
-            'http://pagead2.googlesyndication.com/pagead/show_ads.js', # are there pageadX for all kinds of numbers?
-        ))
+    allowed_script_srcs = set((
+        'http://www.statcounter.com/counter/counter_xhtml.js',
+        # 'http://www.google-analytics.com/urchin.js',
+        'http://pub.mybloglog.com/',
+        'http://rpc.bloglines.com/blogroll',
+        'http://widget.blogrush.com/show.js',
+        'http://re.adroll.com/',
+        'http://widgetserver.com/',
+        'http://pagead2.googlesyndication.com/pagead/show_ads.js', # are there pageadX for all kinds of numbers?
+    ))
+    allowed_script_line_res = set(re.compile(text) for text in (
+         r"^(var )?sc_project\=\d+;$",
+         r"^(var )?sc_invisible\=\d;$",
+         r"^(var )?sc_partition\=\d+;$",
+         r'^(var )?sc_security\="[A-Za-z0-9]+";$',
+         # """^_uacct \= "[^"]+";$""",
+         # """^urchinTracker\(\);$""",
+         r'^blogrush_feed = "[^"]+";$',
+         # """^!--$""",
+         # """^//-->$""",
+    ))
+    allowed_iframe_srcs = set(re.compile(text) for text in (
+        r'^http://www\.google\.com/calendar/embed\?[\w&;=\%]+$', # Google Calendar
+    ))
 
-        self.allowed_script_line_res = set(re.compile(text) for text in (
-             r"^(var )?sc_project\=\d+;$",
-             r"^(var )?sc_invisible\=\d;$",
-             r"^(var )?sc_partition\=\d+;$",
-             r'^(var )?sc_security\="[A-Za-z0-9]+";$',
-             # """^_uacct \= "[^"]+";$""",
-             # """^urchinTracker\(\);$""",
-             r'^blogrush_feed = "[^"]+";$',
-             # """^!--$""",
-             # """^//-->$""",
-        ))
+    def __init__(self, *args, **kwargs):
+        super(SelectiveScriptScrubber, self).__init__(*args, **kwargs)
 
-        self.allowed_iframe_srcs = set(re.compile(text) for text in (
-            r'^http://www\.google\.com/calendar/embed\?[\w&;=\%]+$', # Google Calendar
-        ))
+        self._set_whitelists(self.policy.extras)
+
+    def _set_whitelists(self, extras):
+        # Policies built by hand may hold plain sets
+        def _index(cls, value):
+            return value if isinstance(value, cls) else cls(value)
+        self.allowed_script_srcs = _index(PrefixSet, extras['allowed_script_srcs'])
+        self.allowed_script_line_res = _index(RegexSet, extras['allowed_script_line_res'])
+        self.allowed_iframe_srcs = _index(RegexSet, extras['allowed_iframe_srcs'])
+
+    @classmethod
+    def _policy_extras(cls):
+        extras = super(SelectiveScriptScrubber, cls)._policy_extras()
+        extras.update(
+            allowed_script_srcs = PrefixSet(cls.allowed_script_srcs),
+            allowed_script_line_res = RegexSet(cls.allowed_script_line_res),
+            allowed_iframe_srcs = RegexSet(cls.allowed_iframe_srcs),
+        )
+        return extras
+
+    def update_whitelists(self, add=None, remove=None):
+        """Change the script and iframe whitelists of this scrubber.
+
+        add and remove are dicts with any of the keys allowed_script_srcs,
+        allowed_script_line_res (patterns or compiled regexes) and
+        allowed_iframe_srcs. Only the changed parts of the indexes are
+        rebuilt. The scrubber gets a new policy, other scrubbers sharing the
+        old one aren't affected.
+        """
+        extras = dict(self.policy.extras)
+        for name in ('allowed_script_srcs', 'allowed_script_line_res', 'allowed_iframe_srcs'):
+            value = getattr(self, name)
+            if add and name in add:
+                value = value.union(add[name])
+            if remove and name in remove:
+                value = value.difference(remove[name])
+            extras[name] = value
+        self.policy = self.policy.replace(extras=extras)
+        self._set_whitelists(self.policy.extras)
+        self._fingerprint = None
 
     def _scrub_tag_script(self, script):
         src = script.get('src', None)
         if src:
-            for asrc in self.allowed_script_srcs:
-                # TODO: It could be dangerous to only check "start" of string
-                #       as there could be browser bugs using crafted urls
-                if src.startswith(asrc):
-                    script.contents = []
-                    break
+            # TODO: It could be dangerous to only check "start" of string
+            #       as there could be browser bugs using crafted urls
+            if self.allowed_script_srcs.match(src) is not None:
+                script.contents = []
             else:
-                self.warnings.append(UnapprovedJavascript(src))
+                self.warn(UnapprovedJavascript(src))
                 script.extract()
         elif script.get('type', '') != 'text/javascript':
             script.extract()
@@ -332,13 +1462,11 @@ class SelectiveScriptScrubber(Scrubber):
                 if not line:
                     continue
 
-                line_match = any(line_re.match(line) for line_re in self.allowed_script_line_res)
-
-                if not line_match:
+                if not self.allowed_script_line_res.match(line):
                     script.extract()
                     break
 
     def _scrub_tag_iframe(self, iframe):
         src = iframe.get('src', None)
-        if not src or not any(asrc.match(src) for asrc in self.allowed_iframe_srcs):
+        if not src or not self.allowed_iframe_srcs.match(src):
             iframe.extract()
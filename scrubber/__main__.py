@@ -0,0 +1,13 @@
+"""
+Run the command line tool with "python -m scrubber".
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import sys
+
+from scrubber.cli import main
+
+sys.exit(main())
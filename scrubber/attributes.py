@@ -0,0 +1,162 @@
+"""
+Checks for attribute values.
+
+is_safe_value() looks for script urls and CSS expressions in any attribute
+after decoding entity references the way a browser would. StyleSanitizer
+parses inline CSS and keeps only whitelisted properties with safe values.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import re
+from htmlentitydefs import name2codepoint
+
+# Named references from HTML5 that are useful for hiding a url scheme
+EXTRA_ENTITIES = {
+    'colon': 58, 'Tab': 9, 'NewLine': 10, 'lpar': 40, 'rpar': 41, 'sol': 47,
+    'bsol': 92, 'semi': 59, 'apos': 39, 'period': 46, 'comma': 44, 'excl': 33,
+}
+
+_entity_re = re.compile(r'&(#[xX][0-9a-fA-F]+|#[0-9]+|[a-zA-Z][a-zA-Z0-9]*);?')
+
+# Characters browsers skip when reading a url scheme or CSS keyword
+_ignored_chars = frozenset(map(unichr, range(0x21) + [0x7f, 0xa0, 0x1680, 0x2028, 0x2029, 0x3000, 0xfeff] + range(0x2000, 0x200e)))
+_ignored_re = re.compile(u'[%s]+' % u''.join(sorted(_ignored_chars)).replace(u'\\', u'\\\\').replace(u']', u'\\]'))
+
+# Values without any of these can't hold a scheme, a CSS function or an
+# encoded version of either.
+_suspicious_re = re.compile(r'[:(&\\]')
+_unsafe_re = re.compile(r'(?:java|vb|live)script:|expression\(')
+
+# A ':' or '(' after the last letter of one of the keywords or after an
+# ignored character that could be hiding one
+_keyword_end_re = re.compile(u'[tn%s][:(]' % _ignored_re.pattern[1:-2])
+
+def _decode_entity(match):
+    ref = match.group(1)
+    try:
+        if ref[:2] in ('#x', '#X'):
+            return unichr(int(ref[2:], 16))
+        if ref[0] == '#':
+            return unichr(int(ref[1:]))
+    except (ValueError, OverflowError):
+        return u'\ufffd'
+    codepoint = name2codepoint.get(ref) or EXTRA_ENTITIES.get(ref)
+    if codepoint is None:
+        return match.group(0)
+    return unichr(codepoint)
+
+def decode_entities(value):
+    """Return value with numeric and named character references decoded."""
+    if '&' not in value:
+        return value
+    return _entity_re.sub(_decode_entity, value)
+
+def is_safe_value(value):
+    """Return False if the attribute value could run script."""
+    if not _suspicious_re.search(value):
+        return True
+    value = decode_entities(value).lower()
+    if not _keyword_end_re.search(value):
+        return True
+    return not _unsafe_re.search(_ignored_re.sub(u'', value))
+
+_css_escape_re = re.compile(r'\\(?:([0-9a-fA-F]{1,6})[ \t\r\n\f]?|\r\n|([^0-9a-fA-F]))')
+_css_comment_re = re.compile(r'/\*.*?(?:\*/|$)', re.S)
+_css_declaration_re = re.compile(r'''\s*([-a-zA-Z]+)\s*:\s*((?:[^;'"()]|'[^']*'|"[^"]*"|\((?:[^()'"]|'[^']*'|"[^"]*")*\))*)(?:;|$)''')
+_css_separator_re = re.compile(r'[\s;]*')
+_css_unsafe_re = re.compile(r'expression|(?:java|vb|live)script:|behaviou?r|-moz-binding|@import|[<>\\]')
+_css_url_re = re.compile(r'''url\(["']?([^"')]*)''')
+
+def _decode_css_escape(match):
+    if match.group(1):
+        try:
+            return unichr(int(match.group(1), 16))
+        except (ValueError, OverflowError):
+            return u'\ufffd'
+    return match.group(2) or u''
+
+def decode_css(text):
+    """Return text with CSS escapes decoded and comments removed."""
+    if '\\' in text:
+        text = _css_escape_re.sub(_decode_css_escape, text)
+    if '/*' in text:
+        text = _css_comment_re.sub(u' ', text)
+    return text
+
+class StyleSanitizer(object):
+    """Sanitizes the value of style attributes.
+
+    The value is decoded (entity references, CSS escapes and comments) and
+    split into declarations. Declarations of properties not in
+    allowed_properties or with values that could run script or load
+    anything but http(s) urls are dropped. An unchanged value is returned
+    as it was, otherwise the remaining declarations are joined again. An
+    empty string means nothing was left.
+
+    Results are memoized as the same styles tend to repeat many times.
+    """
+
+    max_cache_entries = 4096
+
+    def __init__(self, allowed_properties):
+        self.allowed_properties = frozenset(p.lower() for p in allowed_properties)
+        self.cache = {}
+
+    def __call__(self, style):
+        try:
+            return self.cache[style]
+        except KeyError:
+            pass
+        result = self.sanitize(style)
+        if len(self.cache) >= self.max_cache_entries:
+            self.cache.clear()
+        self.cache[style] = result
+        return result
+
+    def is_safe_declaration(self, name, value):
+        if name not in self.allowed_properties:
+            return False
+        value = _ignored_re.sub(u'', value).lower()
+        if _css_unsafe_re.search(value):
+            return False
+        for url in _css_url_re.findall(value):
+            if ':' in url and not url.startswith(('http:', 'https:')):
+                return False
+        return True
+
+    def sanitize(self, style):
+        text = decode_css(decode_entities(style))
+        declarations = []
+        changed = text != style
+        pos, end = 0, len(text)
+        while True:
+            pos = _css_separator_re.match(text, pos).end()
+            if pos >= end:
+                break
+            m = _css_declaration_re.match(text, pos)
+            if m is None or m.end() == pos:
+                # Can't parse the rest so it's dropped
+                changed = True
+                break
+            pos = m.end()
+            name, value = m.group(1).lower(), m.group(2).strip()
+            if self.is_safe_declaration(name, value):
+                declarations.append((name, value))
+            else:
+                changed = True
+        if not changed:
+            return style
+        return u'; '.join(u'%s: %s' % d for d in declarations)
+
+_style_sanitizers = {}
+
+def get_style_sanitizer(allowed_properties):
+    """Return a shared StyleSanitizer for a frozenset of property names."""
+    try:
+        return _style_sanitizers[allowed_properties]
+    except KeyError:
+        sanitizer = _style_sanitizers[allowed_properties] = StyleSanitizer(allowed_properties)
+        return sanitizer
@@ -0,0 +1,126 @@
+"""
+Auditing html against a scrubber's rules without scrubbing it.
+
+The tree is walked like a single pass scrub but nothing is removed or
+rewritten and no output is built. Each comment, tag and attribute the
+scrub would remove becomes an AuditFinding. The _scrub_tag_<name> hooks
+get a detached copy of their tag, so they can change it or extract() it as
+usual while the tree stays as it was parsed.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+from collections import namedtuple
+from BeautifulSoup import Comment, Tag
+
+from scrubber import ScrubContext
+
+class AuditFinding(namedtuple('AuditFinding', 'rule tag attribute value')):
+    """Something scrubbing would remove.
+
+    rule is 'comment', 'tag' (a tag that isn't allowed), 'attribute' (an
+    attribute that isn't allowed or whose value is unsafe, or a style that
+    would be rewritten) or 'hook' (a tag, or an attribute of one, removed
+    by a _scrub_tag_<name> method). tag and attribute are the names
+    involved, value is the attribute value or the text of the comment.
+    """
+    __slots__ = ()
+
+class AuditResult(namedtuple('AuditResult', 'safe findings warnings')):
+    """Result of Scrubber.audit(). safe is True when there are no
+    findings."""
+    __slots__ = ()
+
+class _DetachedTag(Tag):
+    """Copy of a tag for a _scrub_tag_<name> method. Its extract() leaves
+    the tree it was copied from alone."""
+
+    def _lastRecursiveChild(self):
+        return self
+
+def _copy_tag(node, attrs):
+    copy = _DetachedTag.__new__(_DetachedTag)
+    copy.__dict__.update(node.__dict__)
+    copy.__dict__.pop('attrMap', None)
+    copy.attrs = list(attrs)
+    copy.contents = list(node.contents)
+    copy.previous = copy.next = copy.previousSibling = copy.nextSibling = None
+    return copy
+
+def _attribute_findings(node, attrs):
+    """Return findings for the attributes of node that aren't in attrs
+    (dropped) or have another value there (rewritten). attrs keeps the
+    order of node.attrs."""
+    findings = []
+    kept = iter(attrs)
+    next_kept = next(kept, None)
+    for k, v in node.attrs:
+        if next_kept is not None and next_kept[0] == k:
+            if next_kept[1] != v:
+                findings.append(AuditFinding('attribute', node.name, k, v))
+            next_kept = next(kept, None)
+        else:
+            findings.append(AuditFinding('attribute', node.name, k, v))
+    return findings
+
+def audit(scrubber, html, first_only=False):
+    """Return an AuditResult for html. See Scrubber.audit(). With
+    first_only the audit stops at the first finding."""
+    context = ScrubContext()
+    contexts = scrubber._contexts()
+    contexts.append(context)
+    try:
+        findings = _audit(scrubber, scrubber._scrub_html_pre(html), first_only)
+    finally:
+        contexts.pop()
+    return AuditResult(not findings, findings, context.warnings)
+
+def _audit(scrubber, html, first_only):
+    if '<' not in html:
+        # No tags or comments
+        return []
+    soup = scrubber._parse(html)
+    allowed_tags = scrubber.allowed_tags
+    save_content = scrubber.disallowed_tags_save_content
+    remove_comments = scrubber.remove_comments
+    filter_attributes = scrubber._filter_attributes
+    tag_hooks = scrubber.policy.tag_hooks
+    findings = []
+    # Stack entries are (node, attrs). attrs is None on the way down and the
+    # filtered attributes when leaving a tag with a hook.
+    stack = [(child, None) for child in reversed(soup.contents)]
+    while stack:
+        if first_only and findings:
+            break
+        node, attrs = stack.pop()
+
+        if attrs is not None:
+            copy = _copy_tag(node, attrs)
+            remove = tag_hooks[node.name](scrubber, copy)
+            if remove or copy.parent is None:
+                findings.append(AuditFinding('hook', node.name, None, None))
+            else:
+                names = set(k for k, v in copy.attrs)
+                findings.extend(AuditFinding('hook', node.name, k, v) for k, v in attrs if k not in names)
+            continue
+
+        if isinstance(node, basestring):
+            if remove_comments and isinstance(node, Comment):
+                findings.append(AuditFinding('comment', None, None, u'' + node))
+            continue
+
+        if node.name not in allowed_tags:
+            findings.append(AuditFinding('tag', node.name, None, None))
+            if node.name in save_content:
+                stack.extend((child, None) for child in reversed(node.contents))
+            continue
+
+        attrs = filter_attributes(node.attrs)
+        if attrs != node.attrs:
+            findings.extend(_attribute_findings(node, attrs))
+        if node.name in tag_hooks:
+            stack.append((node, attrs))
+        stack.extend((child, None) for child in reversed(node.contents))
+    return findings
@@ -0,0 +1,117 @@
+"""
+Scrubbing large numbers of documents using a pool of worker processes.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import functools
+import multiprocessing
+import traceback
+from collections import namedtuple
+
+from scrubber import Scrubber
+
+class BatchResult(namedtuple('BatchResult', 'index html warnings error')):
+    """Result of scrubbing one document with scrub_many.
+
+    index is the position of the document in the input. If scrubbing failed
+    html is None and error holds the formatted traceback.
+    """
+    __slots__ = ()
+
+class DocumentScrubber(object):
+    """Scrubs the (index, html) items of scrub_many into BatchResults."""
+
+    def __init__(self, scrubber_class, scrubber_kwargs):
+        self.scrubber = scrubber_class(**scrubber_kwargs)
+
+    def scrub(self, item):
+        index, html = item
+        scrubber = self.scrubber
+        try:
+            html = scrubber.scrub(html)
+        except Exception:
+            return BatchResult(index, None, [], traceback.format_exc())
+        return BatchResult(index, html, scrubber.warnings, None)
+
+# The worker object of a worker process, created once by _init_worker
+_worker = None
+
+def _init_worker(worker_class, args):
+    global _worker
+    _worker = worker_class(*args)
+
+def _call_worker(method, item):
+    return getattr(_worker, method)(item)
+
+def _blocks(items, size):
+    block = []
+    for item in items:
+        block.append(item)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def map_workers(worker_class, args, method, items, workers, chunksize=64, ordered=True, maxtasksperchild=None):
+    """Generate worker_class(*args).<method>(item) for items.
+
+    With more than one worker the items are handed to a pool of processes,
+    each of which creates a single worker_class(*args) (which must be
+    picklable, like args). They are sent a block at a time, the next block
+    being read while the previous one is worked on, so memory use doesn't
+    grow with the size of the input. Results come in input order unless
+    ordered is False, in which case those of a block come as soon as they
+    are ready. With workers set to 0 or 1 everything happens in the
+    current process.
+    """
+    if workers <= 1:
+        call = getattr(worker_class(*args), method)
+        for item in items:
+            yield call(item)
+        return
+
+    pool = multiprocessing.Pool(workers, _init_worker, (worker_class, args), maxtasksperchild)
+    try:
+        imap = ordered and pool.imap or pool.imap_unordered
+        function = functools.partial(_call_worker, method)
+        pending = None
+        for block in _blocks(items, workers * chunksize * 4):
+            results = imap(function, block, chunksize)
+            if pending is not None:
+                for result in pending:
+                    yield result
+            pending = results
+        if pending is not None:
+            for result in pending:
+                yield result
+        pool.close()
+    finally:
+        # Also reached when the caller stops iterating early
+        pool.terminate()
+        pool.join()
+
+def scrub_many(documents, scrubber_class=Scrubber, scrubber_kwargs=None, workers=None, chunksize=64, ordered=True, maxtasksperchild=None):
+    """Scrub an iterable of html documents, generating a BatchResult for
+    each one.
+
+    The documents are spread over workers processes (by default one per
+    CPU) which each create a single scrubber_class(**scrubber_kwargs).
+    scrubber_class and the values in scrubber_kwargs must be picklable.
+    Documents are sent to the workers chunksize at a time. Results come in
+    input order unless ordered is False, in which case they come as soon
+    as they are ready (use BatchResult.index to match them up).
+
+    With workers set to 0 or 1 everything happens in the current process.
+    A document that raises an exception gets a BatchResult with the error
+    and doesn't stop the batch.
+    """
+    if scrubber_kwargs is None:
+        scrubber_kwargs = {}
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    return map_workers(DocumentScrubber, (scrubber_class, scrubber_kwargs), 'scrub', enumerate(documents),
+        workers, chunksize, ordered, maxtasksperchild)
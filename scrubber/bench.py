@@ -0,0 +1,327 @@
+"""
+Benchmarks for the scrubber.
+
+Run with "python -m scrubber.bench". Corpora are generated from a seeded
+random number generator so runs with the same options scrub the same
+documents. Documents are timed through Scrubber.scrub(). With --phases
+they are scrubbed a second time by a scrubber with an observer to time
+each phase, the observer turns off pruning and the compact tree so those
+numbers come from a slower path than the total. Each corpus runs in a
+fresh child process so the caches warmed up by one don't speed up another
+and its peak resident size is its own. Results can be saved as JSON
+(--json) and compared against an earlier run (--compare).
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import gc
+import json
+import multiprocessing
+import optparse
+import random
+import resource
+import sys
+import time
+
+import scrubber
+from scrubber import ScrubObserver, Scrubber, SelectiveScriptScrubber, _Meter
+
+# In the order they are reported, only 'total' is there without --phases
+PHASES = _Meter.phases + ('total',)
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam "
+    "quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo "
+    "consequat duis aute irure in reprehenderit voluptate velit esse cillum "
+    "eu fugiat nulla pariatur excepteur sint occaecat cupidatat non proident "
+    "sunt culpa qui officia deserunt mollit anim id est laborum").split()
+
+def _sentence(rnd, min_words=4, max_words=16):
+    words = [rnd.choice(WORDS) for i in range(rnd.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+def _url(rnd):
+    return rnd.choice((
+        "http://www.example.com/%s/%d" % (rnd.choice(WORDS), rnd.randint(1, 9999)),
+        "www.%s.com" % rnd.choice(WORDS),
+        "https://%s.example.org/?q=%s&amp;p=%d" % (rnd.choice(WORDS), rnd.choice(WORDS), rnd.randint(1, 99)),
+        "%s@example.net" % rnd.choice(WORDS),
+        "%s.com" % rnd.choice(WORDS),
+    ))
+
+def _inline(rnd):
+    text = _sentence(rnd)
+    kind = rnd.randint(0, 9)
+    if kind == 0:
+        return '<b>%s</b>' % text
+    if kind == 1:
+        return '<i>%s</i>' % text
+    if kind == 2:
+        return '<a href="%s" target="_blank">%s</a>' % (_url(rnd), text)
+    if kind == 3:
+        return '<font face="Arial" size="%s">%s</font>' % (rnd.choice(('2', '+0', '3')), text)
+    if kind == 4:
+        return '<span style="color: #%06x">%s</span>' % (rnd.randint(0, 0xffffff), text)
+    if kind == 5:
+        return '%s %s' % (text, _url(rnd))
+    return text
+
+def short_comment(rnd):
+    parts = [_sentence(rnd, 2, 10) for i in range(rnd.randint(1, 3))]
+    if rnd.random() < 0.3:
+        parts.append(_inline(rnd))
+    if rnd.random() < 0.2:
+        parts.append(_url(rnd))
+    return " ".join(parts)
+
+def blog_post(rnd):
+    out = []
+    for i in range(rnd.randint(10, 40)):
+        kind = rnd.randint(0, 7)
+        if kind == 0:
+            out.append('<h2>%s</h2>' % _sentence(rnd, 2, 6))
+        elif kind == 1:
+            out.append('<ul>%s</ul>' % ''.join('<li>%s</li>' % _inline(rnd) for j in range(rnd.randint(2, 6))))
+        elif kind == 2:
+            out.append('<blockquote><p>%s</p></blockquote>' % _inline(rnd))
+        elif kind == 3:
+            out.append('<p><img src="/images/%d.jpg" onload="track()" width="200"> %s</p>' % (rnd.randint(1, 999), _sentence(rnd)))
+        elif kind == 4:
+            out.append('<!-- %s -->' % _sentence(rnd))
+        else:
+            out.append('<p>%s</p>' % ' '.join(_inline(rnd) for j in range(rnd.randint(2, 8))))
+    return '\n'.join(out)
+
+def nested_tables(rnd):
+    def table(depth):
+        rows = []
+        for r in range(rnd.randint(2, 4)):
+            cells = []
+            for c in range(rnd.randint(2, 4)):
+                if depth and rnd.random() < 0.15:
+                    cells.append('<td>%s</td>' % table(depth - 1))
+                else:
+                    cells.append('<td align="left" bgcolor="#fff">%s</td>' % _inline(rnd))
+            rows.append('<tr>%s</tr>' % ''.join(cells))
+        return '<table border="1" cellpadding="2"><tbody>%s</tbody></table>' % ''.join(rows)
+    return table(rnd.randint(2, 4))
+
+def link_dense(rnd):
+    out = []
+    for i in range(rnd.randint(20, 80)):
+        out.append(_url(rnd))
+        out.append(rnd.choice((',', ' and', '&nbsp;', ' (see %s)' % _url(rnd), '.')))
+        if rnd.random() < 0.3:
+            out.append(_sentence(rnd, 2, 5))
+    return ' '.join(out)
+
+def malformed(rnd):
+    pieces = (
+        '<img src=""http://www.a.com/a.jpg<script type=text/javascript src="http://1.2.3.4:81/xss.js">" /><<img src=""http://www.a.com/a.jpg</script>',
+        '<div notRealAttribute="value\n"onmouseover="\nexecuteMe();\n"foo="bar">\n%s\n</div>' % _sentence(rnd),
+        '<p><b><i>%s</p></b></i>' % _sentence(rnd),
+        '</div></span>%s<td>' % _sentence(rnd),
+        '<a href="javascript:alert(1)">%s' % _sentence(rnd),
+        '<span style="&#x65;&#x78;&#x70;&#x72;&#x65;&#x73;&#x73;&#x69;&#x6f;&#x6e;(alert(1))">x</span>',
+        '<<<>>><font size=+0><font><blink>%s' % _sentence(rnd),
+        '<!-- unclosed %s' % _sentence(rnd),
+    )
+    return ''.join(rnd.choice(pieces) for i in range(rnd.randint(5, 40)))
+
+def script_embeds(rnd):
+    pieces = (
+        '<script type="text/javascript">\nvar sc_project=%d; \nvar sc_invisible=0; \nvar sc_security="ab12"; \n</script>' % rnd.randint(1, 9999),
+        '<script src="http://www.statcounter.com/counter/counter_xhtml.js" type="text/javascript"></script>',
+        '<script src="http://www.example.com/evil%d.js"></script>' % rnd.randint(1, 99),
+        '<script type="text/javascript">document.write("%s");</script>' % _sentence(rnd),
+        '<noscript><div class="statcounter"><a href="http://www.statcounter.com/"><img src="http://c37.statcounter.com/1/0/0/0/" alt="counter"></a></div></noscript>',
+        '<iframe src="http://www.google.com/calendar/embed?title=test&amp;height=300" width="300" frameborder="0"></iframe>',
+        '<iframe src="http://evil.example.com/"></iframe>',
+        '<object width="425" height="344"><param name="movie" value="http://www.youtube.com/v/%d"></param><embed src="http://www.youtube.com/v/%d" type="application/x-shockwave-flash" allowscriptaccess="always" width="425" height="344"></embed></object>' % (rnd.randint(1, 999), rnd.randint(1, 999)),
+        '<p>%s</p>' % _inline(rnd),
+    )
+    return '\n'.join(rnd.choice(pieces) for i in range(rnd.randint(3, 15)))
+
+# name -> (generator, scrubber class, default number of documents)
+CORPORA = {
+    'short_comments': (short_comment, Scrubber, 2000),
+    'blog_posts': (blog_post, Scrubber, 100),
+    'nested_tables': (nested_tables, Scrubber, 100),
+    'link_dense': (link_dense, Scrubber, 200),
+    'malformed': (malformed, Scrubber, 300),
+    'script_embeds': (script_embeds, SelectiveScriptScrubber, 300),
+}
+
+def generate(name, count, seed=0):
+    """Return a list of count documents for the named corpus."""
+    generator = CORPORA[name][0]
+    rnd = random.Random("%s:%s" % (seed, name))
+    return [generator(rnd) for i in range(count)]
+
+class _TimingObserver(ScrubObserver):
+    """Keeps the phase timings of every scrub."""
+
+    def __init__(self):
+        self.timings = []
+
+    def scrub_finished(self, scrubber, stats):
+        self.timings.append(stats['timings'])
+
+def _maxrss():
+    """Return the peak resident size of this process in KB (bytes on Mac
+    OS X)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+def run_corpus(name, count, seed=0, parser=None, repeat=1, phases=False):
+    """Scrub a generated corpus and return a dict of results per phase.
+
+    Without phases only the 'total' time of scrub() is measured, with it
+    the corpus is scrubbed again with an observer timing the phases (see
+    above). The docs/s and MB/s of a phase are for all the documents, also
+    those it didn't run for, the percentiles only for the ones it ran for.
+
+    peak_rss_kb is the peak resident size of the process after the corpus
+    was scrubbed and rss_growth_kb how much scrubbing raised it over what
+    it was with the documents generated. Both include earlier corpora when
+    they run in the same process.
+    """
+    documents = generate(name, count, seed)
+    cls = CORPORA[name][1]
+    kwargs = {}
+    if parser:
+        kwargs['parser'] = parser
+    scrubber = cls(**kwargs)
+    size = sum(len(doc) for doc in documents)
+
+    times = dict(total=[])
+    gc.collect()
+    start_rss = _maxrss()
+    for i in range(repeat):
+        for doc in documents:
+            t0 = time.time()
+            scrubber.scrub(doc)
+            times['total'].append(time.time() - t0)
+    if phases:
+        observer = _TimingObserver()
+        observed = cls(observer=observer, **kwargs)
+        for i in range(repeat):
+            for doc in documents:
+                observed.scrub(doc)
+        for timings in observer.timings:
+            for phase, seconds in timings.items():
+                times.setdefault(phase, []).append(seconds)
+    peak_rss = _maxrss()
+
+    docs = len(documents) * repeat
+    results = dict(docs=docs, bytes=size * repeat, phases={},
+        peak_rss_kb=peak_rss, rss_growth_kb=peak_rss - start_rss)
+    for phase, values in times.items():
+        seconds = sum(values)
+        results['phases'][phase] = dict(
+            seconds = seconds,
+            docs_per_sec = seconds and docs / seconds,
+            mb_per_sec = seconds and size * repeat / seconds / (1024 * 1024),
+            p50_ms = _percentile(values, 50) * 1000,
+            p99_ms = _percentile(values, 99) * 1000,
+        )
+    return results
+
+def _run_corpus_args(args):
+    return run_corpus(*args)
+
+def run(corpora=None, count=None, seed=0, parser=None, repeat=1, fork=True, phases=False):
+    """Run the benchmarks and return the results as a JSON-able dict."""
+    results = {}
+    for name in corpora or sorted(CORPORA):
+        args = (name, count or CORPORA[name][2], seed, parser, repeat, phases)
+        if fork:
+            pool = multiprocessing.Pool(1)
+            try:
+                results[name] = pool.apply(_run_corpus_args, (args,))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results[name] = run_corpus(*args)
+    return dict(
+        version = scrubber.__version__,
+        python = sys.version.split()[0],
+        parser = parser or Scrubber.parser,
+        seed = seed,
+        repeat = repeat,
+        observed_phases = phases,
+        results = results,
+    )
+
+def format_results(report, baseline=None):
+    """Return a text table of report. If baseline is given a column with
+    the speed relative to it is added."""
+    lines = ["scrubber %s, python %s, parser %s" % (report['version'], report['python'], report['parser'])]
+    if report.get('observed_phases'):
+        lines.append("phases other than total timed with an observer, without pruning and the compact tree")
+    header = "%-15s %-13s %9s %8s %9s %9s %10s %10s" % ("corpus", "phase", "docs/s", "MB/s", "p50 ms", "p99 ms",
+        "peak KB", "growth KB")
+    if baseline:
+        header += " %8s" % "vs base"
+    lines.append(header)
+    for name in sorted(report['results']):
+        corpus = report['results'][name]
+        for phase in PHASES:
+            if phase not in corpus['phases']:
+                continue
+            r = corpus['phases'][phase]
+            line = "%-15s %-13s %9.1f %8.3f %9.3f %9.3f" % (name, phase, r['docs_per_sec'],
+                r['mb_per_sec'], r['p50_ms'], r['p99_ms'])
+            if phase == 'total':
+                line += " %10d %10d" % (corpus['peak_rss_kb'], corpus['rss_growth_kb'])
+            else:
+                line += " %10s %10s" % ("-", "-")
+            if baseline:
+                try:
+                    base = baseline['results'][name]['phases'][phase]['docs_per_sec']
+                except KeyError:
+                    line += " %8s" % "-"
+                else:
+                    line += " %7.2fx" % (base and r['docs_per_sec'] / base)
+            lines.append(line)
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]",
+        description="Benchmark the scrubber on generated corpora.")
+    parser.add_option("-c", "--corpus", action="append", dest="corpora", choices=sorted(CORPORA),
+        help="corpus to run (can be repeated, default all: %s)" % ", ".join(sorted(CORPORA)))
+    parser.add_option("-n", "--docs", type="int", dest="count",
+        help="number of documents per corpus (default depends on corpus)")
+    parser.add_option("-r", "--repeat", type="int", default=1, help="times to scrub each corpus")
+    parser.add_option("-s", "--seed", type="int", default=0, help="seed for the corpus generator")
+    parser.add_option("-p", "--parser", help="parser backend to use")
+    parser.add_option("--phases", action="store_true", default=False,
+        help="also time each phase of the scrub, in a second run with an observer "
+            "(which turns off pruning and the compact tree)")
+    parser.add_option("--no-fork", action="store_false", dest="fork", default=True,
+        help="run every corpus in this process")
+    parser.add_option("-j", "--json", dest="json_path", help="save the results as JSON to this file")
+    parser.add_option("--compare", dest="baseline_path", help="JSON results to compare against")
+    options, args = parser.parse_args(argv)
+
+    report = run(options.corpora, options.count, options.seed, options.parser, options.repeat, options.fork, options.phases)
+    baseline = None
+    if options.baseline_path:
+        with open(options.baseline_path) as fp:
+            baseline = json.load(fp)
+    print format_results(report, baseline)
+    if options.json_path:
+        with open(options.json_path, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
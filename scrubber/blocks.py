@@ -0,0 +1,89 @@
+"""
+Memoized scrubbing of the top-level blocks of documents.
+
+Quoted posts, signatures and video embeds repeat across documents whose
+other text differs, so caching whole documents doesn't help with them. With
+Scrubber(block_cache=ScrubCache(...)) a document is split into top-level
+blocks like for scrub_incremental() and the output of every block of at
+least min_block_size characters is cached, keyed by its markup and the
+policy fingerprint. Only the blocks that aren't in the cache are scrubbed,
+runs of smaller blocks together.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+from scrubber import ScrubContext
+from scrubber.incremental import _encoding_hint_re, split_blocks
+
+# Smaller blocks aren't worth a cache lookup
+min_block_size = 64
+
+def _scrub_piece(scrubber, html):
+    """Return (output, warnings) for a run of blocks."""
+    context = ScrubContext()
+    contexts = scrubber._contexts()
+    contexts.append(context)
+    try:
+        output = None
+        if scrubber.fast_path:
+            output = scrubber._scrub_fast(html)
+        if output is None:
+            output = scrubber._scrub_tree(html)
+    finally:
+        contexts.pop()
+    return output, context.warnings
+
+def scrub_blocks(scrubber, html):
+    """Return the scrubbed html, reusing the cached output of its blocks,
+    or None if it can't be split into blocks worth caching. Warnings go to
+    the scrub in progress."""
+    if not scrubber._incremental_safe():
+        return None
+    if not isinstance(html, unicode):
+        if _encoding_hint_re.search(html):
+            return None
+        try:
+            html = html.decode('ascii')
+        except UnicodeError:
+            return None
+    blocks = split_blocks(html)
+    if blocks is None or len(blocks) < 2 or max(len(block) for block in blocks) < min_block_size:
+        return None
+
+    cache = scrubber.block_cache
+    fingerprint = scrubber.policy_fingerprint()
+    warnings = scrubber.warnings
+    output = []
+    # Small blocks waiting to be scrubbed together
+    pending = []
+    reused = 0
+    for block in blocks:
+        if len(block) < min_block_size:
+            pending.append(block)
+            continue
+        if pending:
+            result, block_warnings = _scrub_piece(scrubber, u''.join(pending))
+            output.append(result)
+            warnings.extend(block_warnings)
+            pending = []
+        key = cache.make_key(block, fingerprint)
+        cached = cache.get(key)
+        if cached is None:
+            result, block_warnings = _scrub_piece(scrubber, block)
+            cache.set(key, result, block_warnings)
+        else:
+            result, block_warnings = cached
+            reused += 1
+        output.append(result)
+        warnings.extend(block_warnings)
+    if pending:
+        result, block_warnings = _scrub_piece(scrubber, u''.join(pending))
+        output.append(result)
+        warnings.extend(block_warnings)
+
+    stats = scrubber._contexts()[-1].stats
+    stats['blocks'] = len(blocks)
+    stats['blocks_reused'] = reused
+    return u''.join(output)
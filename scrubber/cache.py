@@ -0,0 +1,172 @@
+"""
+Result cache for Scrubber.scrub.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import cPickle as pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+class CacheBackend(object):
+    """Storage for cache entries. Keys and values are byte strings."""
+
+    def get(self, key):
+        """Return the value for key or None if it isn't stored."""
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def keys(self):
+        """Return the stored keys (used to rebuild the LRU index)."""
+        raise NotImplementedError()
+
+    def clear(self):
+        for key in list(self.keys()):
+            self.delete(key)
+
+class DictBackend(CacheBackend):
+    """Keeps entries in a dict in the local process."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def keys(self):
+        return self.data.keys()
+
+    def clear(self):
+        self.data.clear()
+
+class DBMBackend(CacheBackend):
+    """Keeps entries in a dbm file (using anydbm) so they survive restarts
+    and can be shared by processes on the same machine."""
+
+    def __init__(self, path, flag='c'):
+        import anydbm
+        self.db = anydbm.open(path, flag)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                return self.db[key]
+            except KeyError:
+                return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.db[key] = value
+
+    def delete(self, key):
+        with self.lock:
+            try:
+                del self.db[key]
+            except KeyError:
+                pass
+
+    def keys(self):
+        with self.lock:
+            return self.db.keys()
+
+    def close(self):
+        self.db.close()
+
+class ScrubCache(object):
+    """Bounded LRU cache of scrub results.
+
+    Entries are keyed by a hash of the input html and the scrubber's policy
+    fingerprint, and hold the sanitized html and the warnings list. The
+    cache is limited to max_entries entries and max_bytes bytes of pickled
+    results (either can be None for no limit). The least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64*1024*1024, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend if backend is not None else DictBackend()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+        # key -> entry size, least recently used first
+        self.lru = OrderedDict()
+        for key in self.backend.keys():
+            value = self.backend.get(key)
+            if value is not None:
+                self.lru[key] = len(value)
+                self.bytes += len(value)
+        self._evict()
+
+    @staticmethod
+    def make_key(html, fingerprint):
+        """Return the cache key for html scrubbed by a scrubber with the
+        given policy fingerprint."""
+        if isinstance(html, unicode):
+            html = 'u' + html.encode('utf-8')
+        else:
+            html = 'b' + html
+        return hashlib.sha1(fingerprint + '\0' + html).hexdigest()
+
+    def get(self, key):
+        """Return (html, warnings) for key or None."""
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                self.lru.pop(key, None)
+                return None
+            self.hits += 1
+            size = self.lru.pop(key, None)
+            if size is None:
+                # Stored by another process sharing the backend
+                size = len(value)
+                self.bytes += size
+            self.lru[key] = size
+        return pickle.loads(value)
+
+    def set(self, key, html, warnings):
+        value = pickle.dumps((html, warnings), pickle.HIGHEST_PROTOCOL)
+        size = len(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.backend.set(key, value)
+        with self.lock:
+            self.bytes += size - self.lru.pop(key, 0)
+            self.lru[key] = size
+            self._evict()
+
+    def _evict(self):
+        while self.lru and ((self.max_entries is not None and len(self.lru) > self.max_entries)
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            key, size = self.lru.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            self.backend.delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.backend.clear()
+            self.lru.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return a dict of counters for the cache."""
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                entries=len(self.lru), bytes=self.bytes)
@@ -0,0 +1,237 @@
+"""
+Command line tool for scrubbing html in bulk.
+
+Run with "python -m scrubber" or the scrubber script installed by setup.py.
+Html files (or stdin) are scrubbed whole, JSONL files have a field of each
+record scrubbed. Either way the output is JSONL, written as the input is
+read, so it works for migrations and backfills of any size.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import json
+import mmap
+import multiprocessing
+import optparse
+import sys
+import time
+from collections import OrderedDict
+
+from scrubber.batch import map_workers
+
+# Output is written in chunks of about this many bytes
+write_size = 1 << 20
+
+class RecordScrubber(object):
+    """Scrubs input records into lines of JSON output.
+
+    field is the key of the html in the records, with dots separating the
+    keys of nested records. If warnings is True records that got warnings
+    get a scrubber_warnings list of their class names.
+
+    The scrub methods return (output line or None, error or None, bytes
+    read) for an item.
+    """
+
+    def __init__(self, scrubber_class, scrubber_kwargs, field='html', warnings=False):
+        self.scrubber = scrubber_class(**scrubber_kwargs)
+        self.field = field
+        self.keys = field.split('.')
+        self.warnings = warnings
+
+    def _scrub(self, record, container, key):
+        result = self.scrubber.scrub_ex(container[key])
+        container[key] = result.html
+        if self.warnings and result.warnings:
+            record['scrubber_warnings'] = [w.__class__.__name__ for w in result.warnings]
+        return json.dumps(record, separators=(',', ':')) + '\n'
+
+    def scrub_line(self, item):
+        """Scrub the field of a JSONL record. item is (location, line).
+        Records without the field, or with a null, are passed through."""
+        location, line = item
+        size = len(line)
+        if not line.strip():
+            return None, None, size
+        try:
+            record = container = json.loads(line, object_pairs_hook=OrderedDict)
+            for key in self.keys:
+                if not isinstance(container, dict) or container.get(key) is None:
+                    return line.rstrip('\r\n') + '\n', None, size
+                parent, container = container, container[key]
+            if not isinstance(container, basestring):
+                return None, "%s: %s is not a string" % (location, self.field), size
+            return self._scrub(record, parent, key), None, size
+        except Exception, e:
+            return None, "%s: %s: %s" % (location, e.__class__.__name__, e), size
+
+    def scrub_document(self, item):
+        """Scrub a whole html document. item is (path, html). The output
+        record has the path and the scrubbed html under field."""
+        path, html = item
+        try:
+            record = OrderedDict([('path', path), (self.field, html)])
+            return self._scrub(record, record, self.field), None, len(html)
+        except Exception, e:
+            return None, "%s: %s: %s" % (path, e.__class__.__name__, e), len(html)
+
+def scrub_records(items, method, args, workers=1, chunksize=64):
+    """Generate the results of RecordScrubber(*args).<method>(item) for
+    items, in order, in workers processes (see
+    scrubber.batch.map_workers)."""
+    return map_workers(RecordScrubber, args, method, items, workers, chunksize)
+
+def read_lines(paths, use_mmap=False):
+    """Generate (location, line) for the lines of the files in paths ('-'
+    is stdin). Files are read through a large buffer or, with use_mmap,
+    memory mapped."""
+    for path in paths:
+        if path == '-':
+            for lineno, line in enumerate(sys.stdin, 1):
+                yield "<stdin>:%d" % lineno, line
+            continue
+        with open(path, 'rb', write_size) as fp:
+            mapped = None
+            if use_mmap:
+                try:
+                    mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, mmap.error):
+                    # Empty files and pipes can't be mapped
+                    pass
+            try:
+                lines = mapped is not None and iter(mapped.readline, '') or fp
+                for lineno, line in enumerate(lines, 1):
+                    yield "%s:%d" % (path, lineno), line
+            finally:
+                if mapped is not None:
+                    mapped.close()
+
+def read_documents(paths):
+    """Generate (path, html) for the files in paths ('-' is stdin)."""
+    for path in paths:
+        if path == '-':
+            yield '<stdin>', sys.stdin.read()
+        else:
+            with open(path, 'rb') as fp:
+                yield path, fp.read()
+
+class Progress(object):
+    """Counts records and bytes and reports the throughput to stream."""
+
+    def __init__(self, stream, interval=None):
+        self.stream = stream
+        self.interval = interval
+        self.start = self.last = time.time()
+        self.records = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, size, error, record=True):
+        self.bytes += size
+        if record:
+            self.records += 1
+        if error:
+            self.errors += 1
+        if self.interval is not None:
+            now = time.time()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.report()
+
+    def format(self):
+        seconds = max(time.time() - self.start, 1e-6)
+        return "%d records, %.1f MB, %d errors in %.1fs (%.1f records/s, %.2f MB/s)" % (
+            self.records, self.bytes / 1048576.0, self.errors, seconds,
+            self.records / seconds, self.bytes / 1048576.0 / seconds)
+
+    def report(self):
+        self.stream.write(self.format() + "\n")
+        self.stream.flush()
+
+def import_class(name):
+    """Return the class for a dotted name like scrubber.SelectiveScriptScrubber."""
+    module, _, attr = name.rpartition('.')
+    if not module:
+        raise ValueError("not a dotted class name: %r" % name)
+    return getattr(__import__(module, fromlist=[attr]), attr)
+
+def main(argv=None, stdout=None, stderr=None):
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    parser = optparse.OptionParser(prog="scrubber", usage="%prog [options] [file ...]",
+        description="Scrub html files, or a field of the records of JSONL files, and write JSONL. "
+            "Reads stdin when no files (or -) are given.")
+    parser.add_option("-l", "--jsonl", action="store_true", default=False,
+        help="the input is JSONL records instead of html documents")
+    parser.add_option("-f", "--field", default="html",
+        help="field holding the html, dots separate the keys of nested records (default %default)")
+    parser.add_option("-o", "--output", help="write to this file instead of stdout")
+    parser.add_option("-c", "--class", dest="scrubber_class", default="scrubber.Scrubber",
+        help="dotted name of the scrubber class (default %default)")
+    parser.add_option("-b", "--base-url", help="make relative urls absolute using this url")
+    parser.add_option("--no-autolink", action="store_false", dest="autolink", default=True,
+        help="don't turn urls in text into links")
+    parser.add_option("--no-nofollow", action="store_false", dest="nofollow", default=True,
+        help="don't add rel=nofollow to links")
+    parser.add_option("--compact-tree", action="store_true", default=False,
+        help="scrub on a compact tree instead of BeautifulSoup's, using less memory")
+    parser.add_option("-w", "--warnings", action="store_true", default=False,
+        help="add a scrubber_warnings list to records that got warnings")
+    parser.add_option("-j", "--workers", type="int", default=1,
+        help="number of worker processes, 0 for one per CPU (default %default)")
+    parser.add_option("--chunksize", type="int", default=64,
+        help="records sent to a worker at a time (default %default)")
+    parser.add_option("--mmap", action="store_true", default=False,
+        help="memory map JSONL input files instead of reading them")
+    parser.add_option("-p", "--progress", type="float", metavar="SECONDS",
+        help="report progress every SECONDS")
+    parser.add_option("-q", "--quiet", action="store_true", default=False,
+        help="don't report the totals at the end")
+    options, paths = parser.parse_args(argv)
+
+    try:
+        scrubber_class = import_class(options.scrubber_class)
+    except (ImportError, AttributeError, ValueError), e:
+        parser.error("can't import %s: %s" % (options.scrubber_class, e))
+    scrubber_kwargs = dict(base_url=options.base_url, autolink=options.autolink, nofollow=options.nofollow)
+    if options.compact_tree:
+        scrubber_kwargs['compact_tree'] = True
+    args = (scrubber_class, scrubber_kwargs, options.field, options.warnings)
+    workers = options.workers or multiprocessing.cpu_count()
+
+    paths = paths or ['-']
+    if options.jsonl:
+        items, method = read_lines(paths, options.mmap), 'scrub_line'
+    else:
+        items, method = read_documents(paths), 'scrub_document'
+
+    out = stdout
+    if options.output:
+        out = open(options.output, 'wb')
+    progress = Progress(stderr, options.progress)
+    try:
+        buffered, size = [], 0
+        for line, error, nbytes in scrub_records(items, method, args, workers, options.chunksize):
+            # Blank lines of JSONL input come back with neither
+            progress.add(nbytes, error, bool(line or error))
+            if error:
+                stderr.write("error: %s\n" % error)
+            elif line:
+                buffered.append(line)
+                size += len(line)
+                if size >= write_size:
+                    out.write(''.join(buffered))
+                    buffered, size = [], 0
+        out.write(''.join(buffered))
+        out.flush()
+    finally:
+        if out is not stdout:
+            out.close()
+    if not options.quiet:
+        progress.report()
+    return progress.errors and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
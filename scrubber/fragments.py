@@ -0,0 +1,147 @@
+"""
+Scrubbing many small fragments of html with a single parser.
+
+The fragments are parsed by one FragmentSoup, each into its own container
+tag. The parser is reset and every tag left open is closed at the end of
+each fragment, and end tags can't close a container, so markup can't leak
+from one fragment into another. Each container is then scrubbed and
+serialized like a separate document, which keeps the warnings of every
+fragment apart.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+from sgmllib import SGMLParser
+from BeautifulSoup import BeautifulSoup, Tag
+
+from scrubber import ScrubContext, ScrubResult
+from scrubber.incremental import _encoding_hint_re
+
+class FragmentSoup(BeautifulSoup):
+    """BeautifulSoup that parses a list of unicode fragments into the hidden
+    tags in its containers list, one per fragment.
+
+    The tree of every container is the same as BeautifulSoup(fragment)
+    would build. The containers are detached from the soup once parsed.
+    """
+
+    # Can't be the name of a parsed start tag
+    CONTAINER_NAME = u'[fragment]'
+
+    def __init__(self, fragments):
+        self.containers = []
+        BeautifulSoup.__init__(self)
+        for markup in fragments:
+            self.containers.append(self._feed_fragment(markup))
+        for container in self.containers:
+            container._lastRecursiveChild().next = None
+            container.parent = container.previous = container.previousSibling = container.nextSibling = None
+        self.contents = []
+
+    def _feed_fragment(self, markup):
+        container = Tag(self, self.CONTAINER_NAME, [], self, self.previous)
+        container.hidden = 1
+        if self.previous:
+            self.previous.next = container
+        self.previous = container
+        self.pushTag(container)
+
+        # What BeautifulSoup does for a whole document
+        for fix, m in self.MARKUP_MASSAGE:
+            markup = fix.sub(m, markup)
+        SGMLParser.reset(self)
+        self.quoteStack = []
+        SGMLParser.feed(self, markup)
+        self.endData()
+        while self.currentTag is not container:
+            self.popTag()
+        self.popTag()
+        return container
+
+    def _popToTag(self, name, inclusivePop=True):
+        if name == self.CONTAINER_NAME:
+            return
+        return BeautifulSoup._popToTag(self, name, inclusivePop)
+
+def _batch_markup(html):
+    """Return html as unicode if it parses the same way in a FragmentSoup
+    as on its own, otherwise None."""
+    if _encoding_hint_re.search(html):
+        # Could change how BeautifulSoup decodes it
+        return None
+    if isinstance(html, unicode):
+        return html
+    try:
+        return html.decode('ascii')
+    except UnicodeError:
+        return None
+
+def scrub_fragments(scrubber, fragments):
+    """Return a list of ScrubResults for fragments. See
+    Scrubber.scrub_fragments()."""
+    if not scrubber._fragments_safe():
+        return [scrubber.scrub_ex(html) for html in fragments]
+
+    cache = scrubber.cache
+    fingerprint = cache is not None and scrubber.policy_fingerprint()
+    contexts = scrubber._contexts()
+    results = [None] * len(fragments)
+
+    def finish(i, context, key, result):
+        result = scrubber._scrub_html_post(result)
+        if cache is not None:
+            cache.set(key, result, context.warnings)
+        context.stats['bytes_out'] = len(result)
+        results[i] = ScrubResult(result, context.warnings, context.stats)
+
+    # (index, context, cache key, markup) of the fragments to parse together
+    batch = []
+    for i, html in enumerate(fragments):
+        context = ScrubContext()
+        stats = context.stats
+        stats['bytes_in'] = len(html)
+        key = None
+        if cache is not None:
+            key = cache.make_key(html, fingerprint)
+            cached = cache.get(key)
+            stats['cached'] = cached is not None
+            if cached is not None:
+                result, context.warnings = cached
+                stats['bytes_out'] = len(result)
+                results[i] = ScrubResult(result, context.warnings, stats)
+                continue
+
+        contexts.append(context)
+        try:
+            html = scrubber._scrub_html_pre(html)
+            fast = None
+            if scrubber.fast_path:
+                fast = scrubber._scrub_fast(html)
+                stats['fast_path'] = fast is not None
+                scrubber._count_fast_path(fast is not None)
+            if fast is not None:
+                finish(i, context, key, fast)
+                continue
+            markup = _batch_markup(html)
+            if markup is not None:
+                batch.append((i, context, key, markup))
+                continue
+            soup = scrubber._parse(html)
+            scrubber._scrub_soup(soup)
+            finish(i, context, key, scrubber._serialize(soup))
+        finally:
+            contexts.pop()
+
+    if batch:
+        soup = FragmentSoup([markup for i, context, key, markup in batch])
+        for (i, context, key, markup), container in zip(batch, soup.containers):
+            context.stats['batched'] = True
+            contexts.append(context)
+            try:
+                scrubber._scrub_soup(container)
+                finish(i, context, key, scrubber._serialize(container))
+            finally:
+                contexts.pop()
+    return results
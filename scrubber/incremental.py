@@ -0,0 +1,138 @@
+"""
+Incremental scrubbing of documents that are edited and submitted again.
+
+A document is split into top-level blocks at points where BeautifulSoup's
+parser is back at the root with nothing pending, so scrubbing the blocks
+one by one gives the same output as scrubbing the whole document. The
+state of a scrub remembers the output of each block and the next scrub of
+the edited document only scrubs the blocks it hasn't seen before.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import re
+from collections import namedtuple
+from BeautifulSoup import BeautifulSoup
+
+from scrubber import _implicitly_closes
+
+class ScrubState(namedtuple('ScrubState', 'fingerprint blocks')):
+    """State of an incremental scrub to pass to the next one.
+
+    blocks is a tuple of (source, html, warnings) for the top-level blocks
+    of the document. fingerprint is the policy fingerprint of the scrubber
+    that made it, states of other scrubbers are ignored.
+    """
+    __slots__ = ()
+
+class IncrementalResult(namedtuple('IncrementalResult', 'html warnings stats state')):
+    """Result of Scrubber.scrub_incremental()."""
+    __slots__ = ()
+
+# Markup that is understood well enough to split around it. Anything else
+# (declarations, processing instructions, malformed tags) ends the splitting
+# and the rest of the document is scrubbed as one block.
+_comment_re = re.compile(r'<!--.*?--\s*>', re.S)
+_start_tag_re = re.compile(r'''<([a-zA-Z][a-zA-Z0-9]*)(?:\s+[a-zA-Z_][-:.a-zA-Z_0-9]*(?:\s*=\s*(?:"[^"<>]*"|'[^'<>]*'|[^\s"'<>/=`]+))?)*\s*(/?)>''')
+_end_tag_re = re.compile(r'</([a-zA-Z][a-zA-Z0-9]*)\s*>')
+
+# Tags that change the state of the parser for the rest of the document:
+# the contents of script and textarea isn't markup and meta can make
+# BeautifulSoup decode the document again.
+_stop_tags = frozenset(BeautifulSoup.QUOTE_TAGS) | frozenset(('meta',))
+
+# Byte strings BeautifulSoup could decode as something else than ASCII
+_encoding_hint_re = re.compile(r'\x00|<\?|<\s*meta', re.I)
+
+def split_blocks(html):
+    """Return a list of the top-level blocks of html or None if it can't be
+    split safely.
+
+    Blocks end with a tag or with text without references, as an
+    unfinished reference at the end of a block would be parsed differently
+    than in the whole document.
+    """
+    blocks = []
+    stack = []
+    start = pos = 0
+    while True:
+        i = html.find('<', pos)
+        if i < 0:
+            break
+        m = _start_tag_re.match(html, i)
+        if m is not None:
+            name = m.group(1).lower()
+            if name in _stop_tags:
+                break
+            if not stack and i > start and html.find('&', pos, i) < 0:
+                blocks.append(html[start:i])
+                start = i
+            if name not in BeautifulSoup.SELF_CLOSING_TAGS:
+                if m.group(2) or _implicitly_closes(stack, name):
+                    break
+                stack.append(name)
+        elif html.startswith('</', i):
+            m = _end_tag_re.match(html, i)
+            if m is None or not stack or stack[-1] != m.group(1).lower():
+                break
+            stack.pop()
+        else:
+            m = _comment_re.match(html, i)
+            if m is None:
+                break
+        pos = m.end()
+    rest = html[start:]
+    if blocks and '<>' in rest:
+        # An empty tag repeats the last tag seen by the parser, which may
+        # be in an earlier block
+        return None
+    blocks.append(rest)
+    return blocks
+
+def scrub_incremental(scrubber, html, state=None):
+    """Scrub html reusing the output of the blocks in state. See
+    Scrubber.scrub_incremental()."""
+    fingerprint = scrubber.policy_fingerprint()
+    previous = {}
+    if state is not None and state.fingerprint == fingerprint:
+        for source, output, warnings in state.blocks:
+            previous[source] = (output, warnings)
+
+    blocks = None
+    if scrubber._incremental_safe():
+        if not isinstance(html, unicode):
+            try:
+                text = html.decode('ascii')
+            except UnicodeError:
+                text = None
+            if text is not None and not _encoding_hint_re.search(html):
+                html = text
+        if isinstance(html, unicode):
+            blocks = split_blocks(html)
+    if blocks is None:
+        # Scrub it whole, the state still saves the work when the same
+        # document comes again
+        blocks = [html]
+
+    results = []
+    warnings = []
+    reused = 0
+    for source in blocks:
+        try:
+            output, block_warnings = previous[source]
+        except KeyError:
+            result = scrubber.scrub_ex(source)
+            output, block_warnings = result.html, result.warnings
+        else:
+            reused += 1
+        results.append((source, output, block_warnings))
+        warnings.extend(block_warnings)
+
+    if len(results) == 1:
+        html = results[0][1]
+    else:
+        html = u''.join(output for source, output, block_warnings in results)
+    stats = dict(blocks=len(results), blocks_reused=reused)
+    return IncrementalResult(html, warnings, stats, ScrubState(fingerprint, tuple(results)))
@@ -0,0 +1,225 @@
+"""
+Resource limits for scrubbing untrusted input.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import time
+from BeautifulSoup import BeautifulSoup, NavigableString, StopParsing
+
+ACTIONS = ('raise', 'truncate', 'escape')
+
+class LimitExceeded(Exception):
+    """Raised when a scrub goes over one of its Limits and the action for
+    that limit is 'raise'."""
+
+    def __init__(self, limit, value):
+        Exception.__init__(self, "%s of %r exceeded" % (limit, value))
+        self.limit = limit
+        self.value = value
+
+class Limits(object):
+    """Budgets for a single scrub. None means no limit.
+
+    max_bytes is the length of the input (in characters for unicode),
+    max_nodes the number of tags and text nodes, max_depth the nesting of
+    the tags that are kept, max_autolinks the number of links made by the
+    autolinker and timeout the seconds a scrub may take. The timeout is
+    checked while parsing and walking the tree, so a scrub can go over it by
+    the time it takes to handle a few hundred nodes, to autolink a single
+    text node and to render the result. Use max_bytes to bound those.
+
+    on_exceeded is the action taken when a limit is reached, or a dict of
+    limit name to action (limits left out raise):
+
+    'raise'
+        raise LimitExceeded
+    'truncate'
+        leave out the rest of the input from where the limit was reached
+        (max_autolinks only stops making links) and add a LimitReached
+        warning
+    'escape'
+        return the input escaped as text, cut to max_bytes when that is set
+    """
+    __slots__ = ('max_bytes', 'max_nodes', 'max_depth', 'max_autolinks', 'timeout', 'actions')
+
+    names = ('max_bytes', 'max_nodes', 'max_depth', 'max_autolinks', 'timeout')
+
+    def __init__(self, max_bytes=None, max_nodes=None, max_depth=None, max_autolinks=None, timeout=None, on_exceeded='raise'):
+        self.max_bytes = max_bytes
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_autolinks = max_autolinks
+        self.timeout = timeout
+        if isinstance(on_exceeded, basestring):
+            actions = dict.fromkeys(self.names, on_exceeded)
+        else:
+            actions = dict.fromkeys(self.names, 'raise')
+            for name, action in on_exceeded.items():
+                if name not in actions:
+                    raise ValueError("Unknown limit %r" % name)
+                actions[name] = action
+        for action in actions.values():
+            if action not in ACTIONS:
+                raise ValueError("Unknown action %r" % action)
+        self.actions = actions
+
+    def __repr__(self):
+        return "Limits(%s, on_exceeded=%r)" % (", ".join("%s=%r" % (name, getattr(self, name)) for name in self.names),
+            sorted(self.actions.items()))
+
+class Budget(object):
+    """What is left of the Limits during one scrub."""
+    __slots__ = ('limits', 'deadline', 'nodes', 'autolinks', 'reached', 'timed_out', 'parsed')
+
+    # Nodes handled between checks of the deadline
+    check_interval = 256
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.deadline = None
+        if limits.timeout is not None:
+            self.deadline = time.time() + limits.timeout
+        self.nodes = 0
+        self.autolinks = 0
+        self.reached = []
+        self.timed_out = False
+        # Set when the nodes were counted while parsing
+        self.parsed = False
+
+    def exceeded(self, limit):
+        """Handle going over limit. Returns if the action is 'truncate',
+        otherwise raises LimitExceeded (the scrubber turns it into escaped
+        text for 'escape')."""
+        if limit == 'timeout':
+            self.timed_out = True
+        if self.limits.actions[limit] != 'truncate':
+            raise LimitExceeded(limit, getattr(self.limits, limit))
+        if limit not in self.reached:
+            self.reached.append(limit)
+
+    def truncate_input(self, html):
+        """Return html cut to max_bytes."""
+        max_bytes = self.limits.max_bytes
+        if max_bytes is None or len(html) <= max_bytes:
+            return html
+        self.exceeded('max_bytes')
+        return _cut(html, max_bytes)
+
+    def escape_input(self, html):
+        """Return html escaped as text for the 'escape' action, only the
+        first max_bytes of it when that is set."""
+        from scrubber import _escape
+
+        max_bytes = self.limits.max_bytes
+        if max_bytes is not None and len(html) > max_bytes:
+            html = _cut(html, max_bytes)
+        if not isinstance(html, unicode):
+            html = html.decode('utf-8', 'replace')
+        return _escape(html)
+
+    def count_nodes(self, count=1):
+        """Count nodes against max_nodes and check the deadline now and
+        then. Returns False once the rest should be left out."""
+        nodes = self.nodes + count
+        self.nodes = nodes
+        max_nodes = self.limits.max_nodes
+        if max_nodes is not None and nodes > max_nodes:
+            self.exceeded('max_nodes')
+            return False
+        if nodes // self.check_interval != (nodes - count) // self.check_interval and self.out_of_time():
+            self.exceeded('timeout')
+            return False
+        return True
+
+    def visit(self, visited):
+        """Check the budget for the visited-th node of a walk of the tree.
+        Returns False once the rest should be left out."""
+        if not self.parsed:
+            return self.count_nodes()
+        if not visited % self.check_interval and self.out_of_time():
+            self.exceeded('timeout')
+            return False
+        return True
+
+    def out_of_time(self):
+        return self.deadline is not None and time.time() > self.deadline
+
+    def fits(self, nodes, autolinks):
+        """Return True if a document with these counts is within the
+        limits. Used by the fast path which doesn't keep track as it goes."""
+        limits = self.limits
+        return ((limits.max_nodes is None or self.nodes + nodes <= limits.max_nodes)
+            and (limits.max_autolinks is None or self.autolinks + autolinks <= limits.max_autolinks))
+
+    def take_autolinks(self, count):
+        """Return how many of count more links can be made and count them."""
+        max_autolinks = self.limits.max_autolinks
+        if max_autolinks is None:
+            return count
+        if self.autolinks + count > max_autolinks:
+            self.exceeded('max_autolinks')
+            count = max_autolinks - self.autolinks
+        self.autolinks += count
+        return count
+
+def _cut(html, end):
+    """Return the first end characters of html, or bytes without splitting
+    a UTF-8 sequence."""
+    if isinstance(html, str):
+        while end > 0 and 0x80 <= ord(html[end]) < 0xc0:
+            end -= 1
+    return html[:end]
+
+class LimitedSoup(BeautifulSoup):
+    """BeautifulSoup that counts the nodes it makes against a Budget and
+    stops parsing when it runs out.
+
+    The depth of tags is counted like the scrubber does: only tags in
+    allowed_tags count, tags in kept_tags (disallowed but keeping their
+    contents) don't and the contents of other tags are ignored as they are
+    removed anyway. Stopping early also keeps deeply nested input from
+    taking quadratic time in BeautifulSoup.
+    """
+
+    def __init__(self, markup, budget, allowed_tags, kept_tags):
+        self.budget = budget
+        self.allowed_tags = allowed_tags
+        self.kept_tags = kept_tags
+        budget.parsed = True
+        BeautifulSoup.__init__(self, markup)
+
+    def reset(self):
+        # Depth of the open tags, None inside removed tags
+        self.depths = [0]
+        BeautifulSoup.reset(self)
+
+    def pushTag(self, tag):
+        if tag is not self:
+            budget = self.budget
+            if not budget.count_nodes():
+                raise StopParsing
+            depth = self.depths[-1]
+            if depth is not None:
+                if tag.name in self.allowed_tags:
+                    depth += 1
+                    max_depth = budget.limits.max_depth
+                    if max_depth is not None and depth > max_depth:
+                        budget.exceeded('max_depth')
+                        raise StopParsing
+                elif tag.name not in self.kept_tags:
+                    depth = None
+            self.depths.append(depth)
+        BeautifulSoup.pushTag(self, tag)
+
+    def popTag(self):
+        self.depths.pop()
+        return BeautifulSoup.popTag(self)
+
+    def endData(self, containerClass=NavigableString):
+        if self.currentData and not self.budget.count_nodes():
+            self.currentData = []
+            raise StopParsing
+        BeautifulSoup.endData(self, containerClass)
@@ -0,0 +1,272 @@
+"""
+Parser backends that build BeautifulSoup trees for the scrubber.
+
+Every backend returns a BeautifulSoup object so the scrubbing code and any
+_scrub_tag_<name> methods work the same whichever parser is used. Backends
+other than 'beautifulsoup' feed the events of another parser into the soup's
+tree builder, so BeautifulSoup's nesting rules are still applied.
+
+parse() takes a soup_factory that makes the (empty) BeautifulSoup object the
+tree is built in. The scrubber passes one making a LimitedSoup when it has
+limits, so the events are charged to its Budget as they are replayed and
+the tree stops growing when it runs out.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+from HTMLParser import HTMLParser, HTMLParseError
+from BeautifulSoup import BeautifulSoup, StopParsing, UnicodeDammit
+
+parser_backends = {}
+
+def register_parser_backend(name, backend_class):
+    """Make backend_class available as Scrubber(parser=name)."""
+    parser_backends[name] = backend_class
+
+_instances = {}
+
+def get_parser_backend(name):
+    """Return the shared backend registered as name.
+
+    Raises ValueError for an unknown name and ImportError if the library the
+    backend needs is not installed.
+    """
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+    try:
+        backend_class = parser_backends[name]
+    except KeyError:
+        raise ValueError("Unknown parser backend %r (available: %s)" % (name, ", ".join(sorted(parser_backends))))
+    backend = _instances[name] = backend_class()
+    return backend
+
+def _to_unicode(html):
+    if isinstance(html, unicode):
+        return html
+    return UnicodeDammit(html, isHTML=True).unicode or u''
+
+def _protect_entities(html):
+    """Escape every '&' so a parser that decodes entity references leaves
+    them as they were in the source, as BeautifulSoup's own parser does."""
+    return html.replace('&', '&amp;')
+
+def _unprotect_entities(text):
+    return text.replace('&amp;', '&')
+
+class ParserBackend(object):
+    """Base class for parser backends."""
+    name = None
+
+    def parse(self, html, soup_factory=BeautifulSoup):
+        """Return a BeautifulSoup tree for html, made by
+        soup_factory(markup)."""
+        raise NotImplementedError()
+
+class SoupBuilder(object):
+    """Builds a BeautifulSoup tree from parser events.
+
+    The soup can raise StopParsing from any event to leave out the rest of
+    the document. The backend stops feeding events then and calls
+    finish().
+    """
+
+    def __init__(self, soup_factory=BeautifulSoup):
+        self.soup = soup_factory(u'')
+
+    def start(self, name, attrs, self_closing=False):
+        self.soup.unknown_starttag(name, attrs, self_closing and 1 or 0)
+
+    def end(self, name):
+        self.soup.unknown_endtag(name)
+
+    def data(self, text):
+        self.soup.handle_data(text)
+
+    def comment(self, text):
+        self.soup.handle_comment(text)
+
+    def declaration(self, text):
+        self.soup.handle_decl(text)
+
+    def finish(self):
+        soup = self.soup
+        try:
+            soup.endData()
+        except StopParsing:
+            pass
+        while soup.currentTag.name != soup.ROOT_TAG_NAME:
+            soup.popTag()
+        return soup
+
+class BeautifulSoupBackend(ParserBackend):
+    """BeautifulSoup's own sgmllib based parser (the default)."""
+    name = 'beautifulsoup'
+
+    def parse(self, html, soup_factory=BeautifulSoup):
+        return soup_factory(html)
+
+class _EventParser(HTMLParser):
+    def __init__(self, builder):
+        HTMLParser.__init__(self)
+        self.builder = builder
+
+    def handle_starttag(self, name, attrs):
+        self.builder.start(name, [(k, v if v is not None else k) for k, v in attrs])
+
+    def handle_startendtag(self, name, attrs):
+        self.builder.start(name, [(k, v if v is not None else k) for k, v in attrs], True)
+
+    def handle_endtag(self, name):
+        self.builder.end(name)
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+    def handle_entityref(self, name):
+        self.builder.data('&%s;' % name)
+
+    def handle_charref(self, name):
+        self.builder.data('&#%s;' % name)
+
+    def handle_comment(self, data):
+        self.builder.comment(data)
+
+    def handle_decl(self, decl):
+        self.builder.declaration(decl)
+
+class HTMLParserBackend(ParserBackend):
+    """The standard library's HTMLParser.
+
+    Entity references are kept as they were in the source, as with the
+    default parser. Anything after markup HTMLParser can't handle is dropped.
+    """
+    name = 'htmlparser'
+
+    def parse(self, html, soup_factory=BeautifulSoup):
+        builder = SoupBuilder(soup_factory)
+        parser = _EventParser(builder)
+        try:
+            parser.feed(_to_unicode(html))
+            parser.close()
+        except (HTMLParseError, StopParsing):
+            pass
+        return builder.finish()
+
+class _ElementTreeBackend(ParserBackend):
+    """Feeds an ElementTree style tree (tag, attrib, text, tail) to a
+    SoupBuilder.
+
+    The source is parsed with every '&' escaped so text and attributes come
+    out with their entity references intact. The contents of comments and
+    of raw_text_tags aren't decoded by the parser and are unescaped here.
+    """
+
+    comment_tags = ()
+    raw_text_tags = frozenset(('script', 'style'))
+
+    def build(self, elements, text=None, soup_factory=BeautifulSoup):
+        builder = SoupBuilder(soup_factory)
+        try:
+            self._replay(builder, elements, text)
+        except StopParsing:
+            pass
+        return builder.finish()
+
+    def _replay(self, builder, elements, text):
+        if text:
+            builder.data(text)
+        # Stack of (element, children iterator)
+        stack = [(None, iter(elements))]
+        while stack:
+            parent, children = stack[-1]
+            for el in children:
+                break
+            else:
+                stack.pop()
+                if parent is not None:
+                    builder.end(parent.tag)
+                    if parent.tail:
+                        builder.data(parent.tail)
+                continue
+
+            if el.tag in self.comment_tags:
+                builder.comment(_unprotect_entities(el.text or ''))
+                if el.tail:
+                    builder.data(el.tail)
+                continue
+            if not isinstance(el.tag, basestring):
+                # Processing instructions and entities
+                if el.tail:
+                    builder.data(el.tail)
+                continue
+
+            builder.start(el.tag, el.attrib.items())
+            if el.text:
+                if el.tag in self.raw_text_tags:
+                    builder.data(_unprotect_entities(el.text))
+                else:
+                    builder.data(el.text)
+            stack.append((el, iter(el)))
+
+class LxmlBackend(_ElementTreeBackend):
+    """libxml2's HTML parser through lxml. Requires lxml."""
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree
+        self.etree = etree
+        self.parser = etree.HTMLParser(remove_blank_text=False)
+        self.comment_tags = (etree.Comment,)
+
+    def parse(self, html, soup_factory=BeautifulSoup):
+        html = _to_unicode(html)
+        if not html.strip():
+            return SoupBuilder(soup_factory).finish()
+        # Wrapping in body keeps leading scripts and such from being moved
+        # into a head element.
+        root = self.etree.fromstring(u'<html><body>%s</body></html>' % _protect_entities(html), self.parser)
+        body = root.find('body')
+        if body is None:
+            return SoupBuilder(soup_factory).finish()
+        return self.build(body, body.text, soup_factory)
+
+class Html5libBackend(_ElementTreeBackend):
+    """html5lib's browser compatible parser. Requires html5lib.
+
+    html5lib's lxml tree builder is used when lxml is installed as it's the
+    only one that keeps attributes in source order.
+    """
+    name = 'html5lib'
+    raw_text_tags = frozenset(('script', 'style', 'xmp', 'iframe', 'noembed', 'noframes', 'plaintext'))
+
+    def __init__(self):
+        import html5lib
+        self.html5lib = html5lib
+        try:
+            from lxml import etree
+        except ImportError:
+            from xml.etree import ElementTree
+            self.treebuilder = 'etree'
+            self.comment_tags = (ElementTree.Comment,)
+        else:
+            self.treebuilder = 'lxml'
+            self.comment_tags = (etree.Comment,)
+
+    def parse(self, html, soup_factory=BeautifulSoup):
+        fragment = self.html5lib.parseFragment(_protect_entities(_to_unicode(html)),
+            treebuilder=self.treebuilder, namespaceHTMLElements=False)
+        if self.treebuilder == 'etree':
+            return self.build(fragment, fragment.text, soup_factory)
+        # The lxml tree builder returns a list with any leading text first
+        text = None
+        if fragment and isinstance(fragment[0], basestring):
+            text = fragment.pop(0)
+        return self.build(fragment, text, soup_factory)
+
+for backend_class in (BeautifulSoupBackend, HTMLParserBackend, LxmlBackend, Html5libBackend):
+    register_parser_backend(backend_class.name, backend_class)
+del backend_class
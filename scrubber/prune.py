@@ -0,0 +1,89 @@
+"""
+Pruning what the scrubber removes while parsing.
+
+PruningSoup leaves the subtrees of disallowed tags that don't keep their
+contents, comments (when the scrubber removes them) and attributes that
+aren't allowed out of the tree as it is built, so big inline scripts,
+styles and payloads in junk attributes are never turned into nodes only
+to be thrown away. Pruned tags are still put on the parser's stack so
+the tags after them nest exactly like in a full tree, they just aren't
+added to it and their contents are dropped. Tags allowed by the policy
+or that have a _scrub_tag_<name> method (like script for
+SelectiveScriptScrubber) are always kept for the scrubber to decide.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+from BeautifulSoup import BeautifulSoup, Tag
+
+class PruningSoup(BeautifulSoup):
+    """BeautifulSoup that builds only the parts of the tree that scrubbing
+    keeps, following the whitelists of scrubber."""
+
+    def __init__(self, markup, scrubber):
+        self.allowed_tags = scrubber.allowed_tags
+        self.kept_tags = scrubber.disallowed_tags_save_content
+        self.tag_hooks = scrubber.policy.tag_hooks
+        self.allowed_attributes = scrubber.allowed_attributes
+        self.ignore_empty_attr = scrubber.ignore_empty_attr
+        self.remove_comments = scrubber.remove_comments
+        BeautifulSoup.__init__(self, markup)
+
+    def reset(self):
+        # Outermost pruned tag on the stack, None when building the tree
+        self.pruned = None
+        BeautifulSoup.reset(self)
+
+    def prunes(self, name):
+        """Return True if a tag called name is left out with its
+        contents."""
+        return not (name in self.allowed_tags or name in self.kept_tags or name in self.tag_hooks)
+
+    def _filter_attributes(self, attrs):
+        allowed_attributes = self.allowed_attributes
+        ignore_empty_attr = self.ignore_empty_attr
+        return [(k, v) for k, v in attrs
+            if (v or not ignore_empty_attr) and (k in allowed_attributes or k.lower() in allowed_attributes)]
+
+    def unknown_starttag(self, name, attrs, selfClosing=0):
+        if self.quoteStack:
+            # Text of a script or style, dropped when it is pruned
+            return BeautifulSoup.unknown_starttag(self, name, attrs, selfClosing)
+        if self.pruned is None and not self.prunes(name):
+            return BeautifulSoup.unknown_starttag(self, name, self._filter_attributes(attrs), selfClosing)
+        self.endData()
+        if not self.isSelfClosingTag(name) and not selfClosing:
+            self._smartPop(name)
+        if self.pruned is None and not self.prunes(name):
+            # Closing tags left the pruned subtree
+            return BeautifulSoup.unknown_starttag(self, name, self._filter_attributes(attrs), selfClosing)
+        tag = Tag(self, name, [], self.currentTag)
+        if self.pruned is None:
+            self.pruned = tag
+        self.tagStack.append(tag)
+        self.currentTag = tag
+        if selfClosing or self.isSelfClosingTag(name):
+            self.popTag()
+        if name in self.QUOTE_TAGS:
+            self.quoteStack.append(name)
+            self.literal = 1
+        return tag
+
+    def popTag(self):
+        if self.tagStack[-1] is self.pruned:
+            self.pruned = None
+        return BeautifulSoup.popTag(self)
+
+    def handle_data(self, data):
+        if self.pruned is None:
+            self.currentData.append(data)
+
+    def handle_comment(self, text):
+        if self.remove_comments or self.pruned is not None:
+            # Keep the text around it in separate nodes like a removed
+            # comment does
+            self.endData()
+            return
+        BeautifulSoup.handle_comment(self, text)
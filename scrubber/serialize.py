@@ -0,0 +1,120 @@
+"""
+Serializer for scrubbed BeautifulSoup trees.
+
+serialize() writes the same markup as unicode(tree) does with BeautifulSoup
+3.1 and newer in a single loop over the tree, without the intermediate
+string BeautifulSoup builds for every tag, so it also handles trees too
+deep for BeautifulSoup's recursive rendering. Text is always escaped,
+which older versions of BeautifulSoup don't do. The output can be encoded
+and written to a file-like object as it goes, and optionally have its
+whitespace collapsed.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+from BeautifulSoup import CData, Comment, Declaration, NavigableString, Tag
+
+from scrubber import AutolinkedString, _collapse_whitespace, _escape_markup as _escape, _preserve_whitespace_tags
+
+# Pieces collected before they are written to a file-like object
+write_interval = 1024
+
+def _render_attrs(tag, encoding):
+    attrs = []
+    for key, val in tag.attrs:
+        fmt = u'%s="%s"'
+        if isinstance(val, basestring):
+            if tag.containsSubstitutions and '%SOUP-ENCODING%' in val:
+                val = tag.substituteEncoding(val, encoding)
+            if '"' in val:
+                fmt = u"%s='%s'"
+                if "'" in val:
+                    val = val.replace("'", "&squot;")
+            val = _escape(val)
+        attrs.append(fmt % (key, val))
+    return u' ' + u' '.join(attrs)
+
+def _render_string(node, encoding):
+    cls = node.__class__
+    if cls is NavigableString:
+        return _escape(node)
+    if cls is AutolinkedString:
+        return node
+    # Concatenated as formatting them with % would call their __unicode__
+    if cls is Comment:
+        return u'<!--' + _escape(node) + u'-->'
+    if cls is CData:
+        return u'<![CDATA[' + _escape(node) + u']]>'
+    if cls is Declaration:
+        return u'<!' + _escape(node) + u'>'
+    # Some other kind of string (like processing instructions, which
+    # BeautifulSoup wraps twice), let it render itself
+    return node.__str__(None)
+
+def serialize(node, out=None, encoding=None, minify=False):
+    """Render a tree (or any tag or string in it) as html.
+
+    Returns unicode or, if encoding is given, a byte string in that
+    encoding. Characters the encoding can't represent become character
+    references. If out is given the html is written to its write() method
+    in chunks instead and None is returned.
+
+    With minify, runs of whitespace in text outside of pre, textarea and
+    script tags are collapsed to a single space. Whitespace
+    made significant by a CSS white-space property is collapsed too.
+    """
+    pieces = []
+    append = pieces.append
+    # Depth inside tags whose text is left alone when minifying
+    preserving = 0
+    # Items are nodes, closing tags in a tuple or None for leaving a tag
+    # whose whitespace is preserved
+    stack = [node]
+    pop = stack.pop
+    while stack:
+        node = pop()
+        cls = node.__class__
+        if cls is tuple:
+            append(node[0])
+        elif node is None:
+            preserving -= 1
+        elif isinstance(node, NavigableString):
+            text = _render_string(node, encoding)
+            if minify and not preserving and (cls is NavigableString or cls is AutolinkedString):
+                text = _collapse_whitespace(text)
+            if text:
+                append(text)
+        elif isinstance(node, Tag):
+            if not node.hidden:
+                name = node.name
+                attrs = node.attrs and _render_attrs(node, encoding) or u''
+                if node.isSelfClosing:
+                    append(u'<%s%s />' % (name, attrs))
+                else:
+                    append(u'<%s%s>' % (name, attrs))
+                    stack.append((u'</%s>' % name,))
+                if minify and name in _preserve_whitespace_tags:
+                    preserving += 1
+                    stack.append(None)
+            contents = node.contents
+            if contents:
+                stack.extend(reversed(contents))
+        if out is not None and len(pieces) >= write_interval:
+            _write(out, pieces, encoding)
+            del pieces[:]
+    if out is not None:
+        if pieces:
+            _write(out, pieces, encoding)
+        return None
+    html = u''.join(pieces)
+    if encoding:
+        return html.encode(encoding, 'xmlcharrefreplace')
+    return html
+
+def _write(out, pieces, encoding):
+    chunk = u''.join(pieces)
+    if encoding:
+        chunk = chunk.encode(encoding, 'xmlcharrefreplace')
+    out.write(chunk)
@@ -0,0 +1,278 @@
+"""
+Streaming scrubber that sanitizes a token stream without building a tree.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import codecs
+from HTMLParser import HTMLParser, HTMLParseError
+from BeautifulSoup import BeautifulSoup, Tag
+
+from scrubber import get_urlizer
+from scrubber.serialize import serialize
+
+# Tags that never have contents (rendered as <br />)
+VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'frame', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'spacer', 'wbr',
+))
+
+# Opening one of these implicitly closes an open tag from the first set
+# unless one of the tags in the second set is opened in between.
+IMPLICIT_CLOSE = {
+    'p': (('p',), ('table', 'td', 'th', 'li', 'div', 'blockquote', 'object')),
+    'li': (('li',), ('ul', 'ol')),
+    'dt': (('dt', 'dd'), ('dl',)),
+    'dd': (('dt', 'dd'), ('dl',)),
+    'tr': (('tr', 'td', 'th'), ('table', 'tbody', 'thead')),
+    'td': (('td', 'th'), ('tr', 'table')),
+    'th': (('td', 'th'), ('tr', 'table')),
+    'thead': (('thead', 'tbody', 'tr', 'td', 'th'), ('table',)),
+    'tbody': (('thead', 'tbody', 'tr', 'td', 'th'), ('table',)),
+}
+
+def _escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def _escape_attr(value):
+    return _escape_text(value).replace('"', '&quot;')
+
+class StreamScrubber(HTMLParser):
+    """Apply a Scrubber's whitelist to a stream of parser events.
+
+    Output is produced as soon as it is known to be safe. Tags listed in
+    the scrubber's stream_buffered_tags are collected whole and run
+    through the regular tree based scrubber, which lets _scrub_tag_<name>
+    methods that look at the contents of a tag (e.g. inline scripts) work.
+    All other _scrub_tag_<name> methods see a childless tag holding only
+    the attributes.
+
+    Declarations and processing instructions are always dropped.
+    """
+
+    def __init__(self, scrubber, encoding='utf-8'):
+        HTMLParser.__init__(self)
+        self.scrubber = scrubber
+        self.encoding = encoding
+        self.urlizer = scrubber.autolink and get_urlizer(nofollow=scrubber.nofollow, markup=True)
+        self.soup = BeautifulSoup()
+        self.out = []
+        self.text = []
+        # Open tags as (name, emitted name or None when only the contents
+        # are being kept)
+        self.stack = []
+        self.anchors = 0
+        # Name and nesting depth of a dropped or buffered tag
+        self.skip_name = None
+        self.skip_depth = 0
+        self.buffer = None
+        self.failed = False
+
+    def scrub(self, chunks):
+        """Generate sanitized chunks of html from chunks."""
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = decoder.decode(chunk)
+            self.feed_chunk(chunk)
+            self.flush_text(partial=True)
+            if self.out:
+                yield self.pop_output()
+
+        self.feed_chunk(decoder.decode('', True))
+        if not self.failed:
+            self.close()
+        self.flush_text()
+        for name, emitted in reversed(self.stack):
+            if emitted:
+                self.out.append('</%s>' % emitted)
+        self.stack = []
+        if self.out:
+            yield self.pop_output()
+
+    def feed_chunk(self, chunk):
+        if self.failed or not chunk:
+            return
+        try:
+            self.feed(chunk)
+        except HTMLParseError:
+            # Drop everything after markup the parser can't handle
+            self.failed = True
+
+    def pop_output(self):
+        out = u''.join(self.out)
+        self.out = []
+        return out
+
+    def flush_text(self, partial=False):
+        """Autolink and write out pending text.
+
+        When partial is True text after the last whitespace is kept back
+        as the word may continue in the next chunk.
+        """
+        if not self.text:
+            return
+        text = u''.join(self.text)
+        self.text = []
+        if partial:
+            idx = max(text.rfind(c) for c in u' \t\r\n\xa0')
+            if idx < len(text) - 1:
+                self.text = [text[idx+1:]]
+                text = text[:idx+1]
+            if not text:
+                return
+        if self.urlizer and not self.anchors:
+            text = self.urlizer(text)
+        self.out.append(text)
+
+    # Dropped and buffered tags
+
+    def _skipping(self, event, name=None):
+        """Handle an event inside a dropped or buffered tag. Returns False
+        if not currently skipping."""
+        if self.skip_name is None:
+            return False
+        if name == self.skip_name:
+            if event == 'start':
+                self.skip_depth += 1
+            elif event == 'end':
+                self.skip_depth -= 1
+        if self.buffer is not None:
+            if event == 'start':
+                self.buffer.append(self.get_starttag_text())
+            elif event == 'end':
+                self.buffer.append('</%s>' % name)
+        if not self.skip_depth:
+            self.skip_name = None
+            if self.buffer is not None:
+                self.scrub_buffer()
+        return True
+
+    def scrub_buffer(self):
+        html = u''.join(self.buffer)
+        self.buffer = None
+        soup = self.scrubber._parse(html)
+        self.scrubber._scrub_soup(soup)
+        self.out.append(serialize(soup))
+
+    # Tags
+
+    def _close_implicit(self, name):
+        closes, boundaries = IMPLICIT_CLOSE[name]
+        for i in range(len(self.stack)-1, -1, -1):
+            open_name = self.stack[i][0]
+            if open_name in closes:
+                self._pop_to(i)
+                return
+            if open_name in boundaries:
+                return
+
+    def _pop_to(self, idx):
+        for name, emitted in reversed(self.stack[idx:]):
+            if emitted:
+                self.out.append('</%s>' % emitted)
+            if name == 'a':
+                self.anchors -= 1
+        del self.stack[idx:]
+
+    def handle_starttag(self, name, attrs):
+        if self._skipping('start', name):
+            return
+        self.flush_text()
+
+        scrubber = self.scrubber
+        if name in IMPLICIT_CLOSE:
+            self._close_implicit(name)
+
+        void = name in VOID_TAGS
+        if name not in scrubber.allowed_tags:
+            if name in scrubber.disallowed_tags_save_content:
+                if not void:
+                    self.stack.append((name, None))
+            elif not void:
+                self.skip_name, self.skip_depth = name, 1
+            return
+
+        attrs = scrubber._filter_attributes([(k, v if v is not None else k) for k, v in attrs])
+        if name in scrubber.stream_buffered_tags and not void:
+            self.skip_name, self.skip_depth = name, 1
+            self.buffer = [self.get_starttag_text()]
+            return
+
+        keep_tag = True
+        hook = scrubber.policy.tag_hooks.get(name)
+        if hook is not None:
+            container = Tag(self.soup, '[stream]')
+            tag = Tag(self.soup, name, attrs, container)
+            container.contents.append(tag)
+            remove = hook(scrubber, tag)
+            if remove or tag.parent is None:
+                if remove != "keep_contents":
+                    if not void:
+                        self.skip_name, self.skip_depth = name, 1
+                    return
+                keep_tag = False
+            attrs = tag.attrs
+
+        emitted = None
+        if keep_tag:
+            emitted = scrubber.normalized_tag_replacements.get(name, name)
+            attrs = ''.join(' %s="%s"' % (k, _escape_attr(v)) for k, v in attrs)
+            self.out.append('<%s%s%s>' % (emitted, attrs, void and ' /' or ''))
+        if not void:
+            self.stack.append((name, emitted))
+            if name == 'a':
+                self.anchors += 1
+
+    def handle_endtag(self, name):
+        if self._skipping('end', name):
+            return
+        self.flush_text()
+        for i in range(len(self.stack)-1, -1, -1):
+            if self.stack[i][0] == name:
+                self._pop_to(i)
+                break
+
+    # Text
+
+    def handle_data(self, data):
+        if self.skip_name is not None:
+            if self.buffer is not None:
+                self.buffer.append(data)
+        elif self.cdata_elem is not None:
+            self.flush_text()
+            self.out.append(data)
+        else:
+            self.text.append(_escape_text(data))
+
+    def handle_entityref(self, name):
+        self.handle_ref('&%s;' % name)
+
+    def handle_charref(self, name):
+        self.handle_ref('&#%s;' % name)
+
+    def handle_ref(self, ref):
+        if self.skip_name is not None:
+            if self.buffer is not None:
+                self.buffer.append(ref)
+        else:
+            self.text.append(ref)
+
+    def handle_comment(self, data):
+        if self.skip_name is not None:
+            if self.buffer is not None:
+                self.buffer.append('<!--%s-->' % data)
+        elif not self.scrubber.remove_comments:
+            self.flush_text()
+            self.out.append('<!--%s-->' % data)
+
+    def handle_decl(self, decl):
+        pass
+
+    def handle_pi(self, data):
+        pass
+
+    def unknown_decl(self, data):
+        pass
@@ -0,0 +1,423 @@
+"""
+A compact document tree for the scrubber.
+
+BeautifulSoup builds a Tag or NavigableString with an instance dict and
+parent, sibling and document order links for every node, which is most of
+the memory a large document takes to scrub. The tree here has Elements with
+just a name, a list of (name, value) attributes and a list of contents.
+Text is plain unicode and comments, declarations and such are unicode
+subclasses without instance dicts. Tag and attribute names are interned.
+
+CompactParser is BeautifulSoup's own parser with the same nesting rules,
+so the tree has the same shape as the soup would. scrub_tree() scrubs it in
+a single walk like Scrubber._scrub_soup_single_pass and serialize_tree()
+renders it the same as the soup would be. _scrub_tag_<name> methods that
+need the BeautifulSoup API get their tag converted with to_soup() and back
+with from_soup().
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import re
+from BeautifulSoup import BeautifulSoup, CData, Comment, Declaration, NavigableString, ProcessingInstruction, Tag
+
+from scrubber import AutolinkedString, Scrubber, _collapse_whitespace, _preserve_whitespace_tags, get_urlizer
+from scrubber.serialize import _escape
+
+# Names seen by the parser, so every tag and attribute name is stored once.
+# Bounded as the names in a document are up to whoever wrote it.
+_names = {}
+max_names = 4096
+
+def _intern(name):
+    try:
+        return _names[name]
+    except KeyError:
+        if len(_names) < max_names:
+            _names[name] = name
+        return name
+
+class Element(object):
+    """A tag in the compact tree.
+
+    Supports the parts of the Tag API the built-in _scrub_tag_<name>
+    methods use: get(), has_key() and getting, setting and deleting
+    attributes by subscript.
+    """
+    __slots__ = ('name', 'attrs', 'contents')
+
+    # BeautifulSoup's nesting rules read it
+    parent = None
+
+    def __init__(self, name, attrs=None, contents=None):
+        self.name = name
+        self.attrs = attrs if attrs is not None else []
+        self.contents = contents if contents is not None else []
+
+    def __repr__(self):
+        return '<Element %s>' % self.name
+
+    def get(self, key, default=None):
+        # The last of repeated attributes wins, as with Tag
+        value = default
+        for k, v in self.attrs:
+            if k == key:
+                value = v
+        return value
+
+    def has_key(self, key):
+        return any(k == key for k, v in self.attrs)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        attrs = self.attrs
+        found = False
+        for i in range(len(attrs)):
+            if attrs[i][0] == key:
+                attrs[i] = (key, value)
+                found = True
+        if not found:
+            attrs.append((key, value))
+
+    def __delitem__(self, key):
+        # Removes while iterating, exactly like Tag.__delitem__
+        for item in self.attrs:
+            if item[0] == key:
+                self.attrs.remove(item)
+
+class RawHtml(unicode):
+    """Markup written out as it is, like AutolinkedString."""
+    __slots__ = ()
+
+class CommentNode(unicode):
+    __slots__ = ()
+
+class DeclarationNode(unicode):
+    __slots__ = ()
+
+class CDataNode(unicode):
+    __slots__ = ()
+
+class ProcessingInstructionNode(unicode):
+    __slots__ = ()
+
+# BeautifulSoup string classes and the compact ones, both ways
+_compact_strings = {
+    NavigableString: unicode,
+    AutolinkedString: RawHtml,
+    Comment: CommentNode,
+    Declaration: DeclarationNode,
+    CData: CDataNode,
+    ProcessingInstruction: ProcessingInstructionNode,
+}
+_soup_strings = dict((v, k) for k, v in _compact_strings.items())
+
+# Same as Tag.__init__ does to attribute values: character references are
+# decoded, entity references are left alone
+_attr_entity_re = re.compile(r'&(#\d+|#x[0-9a-fA-F]+|\w+);')
+
+def _convert_attr_entity(match):
+    x = match.group(1)
+    if x[0] != '#':
+        return match.group(0)
+    if x[1] == 'x':
+        return unichr(int(x[2:], 16))
+    return unichr(int(x[1:]))
+
+class CompactParser(BeautifulSoup):
+    """BeautifulSoup's parser building a compact tree. The root Element
+    of the document is in its root attribute."""
+
+    def __init__(self, html):
+        BeautifulSoup.__init__(self, html)
+        self.root = Element(self.ROOT_TAG_NAME, [], self.contents)
+        self.contents = []
+
+    # BeautifulSoup only sets these for byte strings and otherwise gets
+    # None from looking for a tag by that name, which Elements can't do
+    originalEncoding = None
+    declaredHTMLEncoding = None
+
+    def __getattr__(self, name):
+        # Not a search of the tree like Tag.__getattr__
+        raise AttributeError(name)
+
+    def unknown_starttag(self, name, attrs, selfClosing=0):
+        if self.quoteStack:
+            # Text, not a tag
+            BeautifulSoup.unknown_starttag(self, name, attrs, selfClosing)
+            return None
+        self.endData()
+        selfClosing = selfClosing or self.isSelfClosingTag(name)
+        if not selfClosing:
+            self._smartPop(name)
+        name = _intern(name)
+        attrs = [(_intern(k), '&' in v and _attr_entity_re.sub(_convert_attr_entity, v) or v) for k, v in attrs]
+        self.pushTag(Element(name, attrs))
+        if selfClosing:
+            self.popTag()
+        if name in self.QUOTE_TAGS:
+            self.quoteStack.append(name)
+            self.literal = 1
+        # start_meta would mark a returned tag for encoding substitution,
+        # Elements don't do that (see Scrubber._compact_tree_safe)
+        return None
+
+    def endData(self, containerClass=NavigableString):
+        if self.currentData:
+            data = u''.join(self.currentData)
+            self.currentData = []
+            if not data.translate(self.STRIP_ASCII_SPACES) and \
+                    not self.PRESERVE_WHITESPACE_TAGS.intersection([tag.name for tag in self.tagStack]):
+                data = '\n' in data and u'\n' or u' '
+            cls = _compact_strings.get(containerClass, containerClass)
+            self.currentTag.contents.append(cls(data))
+
+def parse(html):
+    """Return the root Element of a compact tree for html."""
+    return CompactParser(html).root
+
+def to_soup(node):
+    """Return a BeautifulSoup tree with a copy of node, or of its contents
+    if it's the root of a document."""
+    soup = BeautifulSoup()
+    if node.__class__ is Element and node.name == soup.ROOT_TAG_NAME:
+        children = node.contents
+    else:
+        children = [node]
+    stack = [(soup, child) for child in reversed(children)]
+    while stack:
+        parent, node = stack.pop()
+        cls = node.__class__
+        if cls is Element:
+            copy = Tag(soup, node.name)
+            # Set after creating the tag, which would decode them again
+            copy.attrs = list(node.attrs)
+            stack.extend((copy, child) for child in reversed(node.contents))
+        else:
+            copy = _soup_strings.get(cls, cls)(node)
+        copy.parent = parent
+        if parent.contents:
+            previous = parent.contents[-1]
+            previous.nextSibling = copy
+            copy.previousSibling = previous
+        parent.contents.append(copy)
+
+    # Document order links
+    previous = soup
+    stack = list(reversed(soup.contents))
+    while stack:
+        node = stack.pop()
+        previous.next = node
+        node.previous = previous
+        previous = node
+        if isinstance(node, Tag):
+            stack.extend(reversed(node.contents))
+    previous.next = None
+    return soup
+
+def _compact_string(node):
+    cls = node.__class__
+    # Concatenated as unicode() would render comments and such as markup
+    return _compact_strings.get(cls, cls)(u'' + node)
+
+def from_soup(node):
+    """Return a compact copy of a BeautifulSoup tree or of any tag or
+    string in it. A BeautifulSoup becomes a document root Element."""
+    if not isinstance(node, Tag):
+        return _compact_string(node)
+    root = Element(node.name, list(node.attrs))
+    stack = [(root, node)]
+    while stack:
+        copy, node = stack.pop()
+        contents = copy.contents
+        for child in node.contents:
+            if isinstance(child, Tag):
+                element = Element(child.name, list(child.attrs))
+                contents.append(element)
+                stack.append((element, child))
+            else:
+                contents.append(_compact_string(child))
+    return root
+
+# _scrub_tag_<name> methods that only use the Element API
+_element_hooks = frozenset(getattr(Scrubber, name).im_func for name in ('_scrub_tag_a', '_scrub_tag_img', '_scrub_tag_font'))
+
+def _soup_hook(hook):
+    """Wrap a _scrub_tag_<name> function to run it on a BeautifulSoup copy
+    of the element, copying the result back."""
+    def _hook(scrubber, node):
+        soup = to_soup(node)
+        tag = soup.contents[0]
+        remove = hook(scrubber, tag)
+        if tag.parent is None:
+            # extract()ed
+            return remove or True
+        if not remove or remove == "keep_contents":
+            copy = from_soup(tag)
+            node.name, node.attrs, node.contents = copy.name, copy.attrs, copy.contents
+        return remove
+    return _hook
+
+def _tag_hooks(scrubber):
+    element_hooks = _element_hooks
+    if scrubber.__class__._clean_path.im_func is not Scrubber._clean_path.im_func:
+        element_hooks = ()
+    hooks = {}
+    for name, hook in scrubber.policy.tag_hooks.items():
+        hooks[name] = hook if hook in element_hooks else _soup_hook(hook)
+    return hooks
+
+def scrub_tree(scrubber, root):
+    """Scrub a compact tree in place the way scrubber scrubs a soup.
+
+    Like the single pass scrub, attributes are filtered and text autolinked
+    on the way down and the _scrub_tag_<name> methods and normalization
+    run on the way back up. The contents of each element are rebuilt on
+    the way up too, without the nodes removed from it, so a
+    _scrub_tag_<name> method sees the contents already scrubbed.
+    """
+    allowed_tags = scrubber.allowed_tags
+    save_content = scrubber.disallowed_tags_save_content
+    replacements = scrubber.normalized_tag_replacements
+    remove_comments = scrubber.remove_comments
+    filter_attributes = scrubber._filter_attributes
+    urlizer = scrubber.autolink and get_urlizer(nofollow=scrubber.nofollow, markup=True)
+    hooks = _tag_hooks(scrubber)
+    # id() of removed elements to whether their contents are kept
+    removed = {}
+    # Entries are (element, inside_anchor, leaving)
+    stack = [(root, False, False)]
+    while stack:
+        node, in_anchor, leaving = stack.pop()
+
+        if leaving:
+            if id(node) not in removed:
+                name = node.name
+                hook = hooks.get(name)
+                if hook is not None:
+                    remove = hook(scrubber, node)
+                    if remove:
+                        removed[id(node)] = remove == "keep_contents"
+                if name in replacements:
+                    node.name = replacements[name]
+            contents = node.contents
+            kept = None
+            for i, child in enumerate(contents):
+                cls = child.__class__
+                if cls is Element:
+                    keep_contents = removed.get(id(child))
+                    if keep_contents is None:
+                        if kept is not None:
+                            kept.append(child)
+                        continue
+                    if kept is None:
+                        kept = contents[:i]
+                    if keep_contents:
+                        kept.extend(child.contents)
+                elif cls is CommentNode and remove_comments:
+                    if kept is None:
+                        kept = contents[:i]
+                elif kept is not None:
+                    kept.append(child)
+            if kept is not None:
+                node.contents = kept
+            continue
+
+        if node is not root:
+            name = node.name
+            if name not in allowed_tags:
+                keep_contents = name in save_content
+                removed[id(node)] = keep_contents
+                if not keep_contents:
+                    continue
+            else:
+                if node.attrs:
+                    node.attrs = filter_attributes(node.attrs)
+                in_anchor = in_anchor or name == "a"
+
+        stack.append((node, in_anchor, True))
+        contents = node.contents
+        if urlizer and not in_anchor:
+            for i, child in enumerate(contents):
+                cls = child.__class__
+                # Like the soup scrub, this autolinks any kind of string
+                # that is kept, comments included
+                if cls is Element or cls is RawHtml or (cls is CommentNode and remove_comments):
+                    continue
+                text = urlizer(child)
+                if text != child:
+                    contents[i] = RawHtml(text)
+        stack.extend((child, in_anchor, False) for child in reversed(contents) if child.__class__ is Element)
+
+def _render_attrs(attrs):
+    rendered = []
+    for key, val in attrs:
+        fmt = u'%s="%s"'
+        if '"' in val:
+            fmt = u"%s='%s'"
+            if "'" in val:
+                val = val.replace("'", "&squot;")
+        rendered.append(fmt % (key, _escape(val)))
+    return u' ' + u' '.join(rendered)
+
+def serialize_tree(node, minify=False):
+    """Render a compact tree (or an Element or string in it) as unicode,
+    the same as serialize() renders the soup."""
+    self_closing = BeautifulSoup.SELF_CLOSING_TAGS
+    pieces = []
+    append = pieces.append
+    preserving = 0
+    # Items are nodes, closing tags in a tuple or None for leaving a tag
+    # whose whitespace is preserved
+    stack = [node]
+    pop = stack.pop
+    while stack:
+        node = pop()
+        cls = node.__class__
+        if cls is Element:
+            name = node.name
+            if name != BeautifulSoup.ROOT_TAG_NAME:
+                attrs = node.attrs and _render_attrs(node.attrs) or u''
+                if name in self_closing:
+                    append(u'<%s%s />' % (name, attrs))
+                else:
+                    append(u'<%s%s>' % (name, attrs))
+                    stack.append((u'</%s>' % name,))
+                if minify and name in _preserve_whitespace_tags:
+                    preserving += 1
+                    stack.append(None)
+            if node.contents:
+                stack.extend(reversed(node.contents))
+        elif cls is unicode or cls is RawHtml:
+            text = cls is unicode and _escape(node) or node
+            if minify and not preserving:
+                text = _collapse_whitespace(text)
+            if text:
+                append(text)
+        elif cls is tuple:
+            append(node[0])
+        elif node is None:
+            preserving -= 1
+        elif cls is CommentNode:
+            append(u'<!--' + _escape(node) + u'-->')
+        elif cls is CDataNode:
+            append(u'<![CDATA[' + _escape(node) + u']]>')
+        elif cls is DeclarationNode:
+            append(u'<!' + _escape(node) + u'>')
+        else:
+            append(_soup_strings.get(cls, cls)(node).__str__(None))
+    return u''.join(pieces)
+
+def scrub_compact(scrubber, html):
+    """Parse, scrub and serialize html using a compact tree."""
+    root = parse(html)
+    scrub_tree(scrubber, root)
+    return serialize_tree(root, scrubber.minify)
@@ -0,0 +1,183 @@
+"""
+Scrubbing the start of a document for previews and feed excerpts.
+
+TruncatingSoup counts the visible text while parsing and stops as soon as
+there is more of it than fits, so the rest of the document is never
+parsed, walked or autolinked. Text in tags that are removed with their
+contents, in script and style and in comments doesn't count. Character
+references count as a single character and runs of whitespace as one.
+The last text is cut at a word boundary when it has one and the ellipsis
+is added after it. A word that doesn't fit is only cut when it couldn't
+be autolinked, otherwise the link would point somewhere else, and left
+out with what follows it when it could. Anything after that, like tags opened after the last
+text that fit, is left out and the tags still open are closed when the
+tree is serialized.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import re
+from BeautifulSoup import NavigableString, StopParsing
+
+from scrubber.limits import Budget, Limits, LimitedSoup
+
+# Tags whose text isn't shown
+_invisible_tags = frozenset(('script', 'style'))
+
+_reference_re = re.compile(r'&(?:#\d+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+_space_re = re.compile(r'\s+')
+_token_re = re.compile(r'&(?:#\d+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);|[^&]+|&')
+_word_re = re.compile(r'\s+|\S+')
+
+def _visible_length(text):
+    """Return the number of characters text shows as."""
+    if '&' in text:
+        text = _reference_re.sub(u'x', text)
+    return len(_space_re.sub(u' ', text))
+
+def _cut(text, size):
+    """Return the start of text that shows as at most size characters,
+    ending at a word boundary when there is one. Words the autolinker could
+    link are never cut."""
+    used = 0
+    boundary = 0
+    for m in _word_re.finditer(text):
+        start = m.start()
+        word = m.group()
+        if word.isspace():
+            if used + 1 > size:
+                return text[:start].rstrip()
+            boundary = start
+            used += 1
+            continue
+        size_left = size - used
+        used += _visible_length(word)
+        if used > size:
+            if boundary or '.' in word or '@' in word or ':' in word:
+                return text[:boundary].rstrip()
+            return text[:start] + _cut_word(word, size_left)
+    return text
+
+def _cut_word(word, size):
+    """Return the start of word that shows as at most size characters,
+    without splitting a character reference."""
+    used = 0
+    for m in _token_re.finditer(word):
+        token = m.group()
+        if token[0] == '&':
+            if used + 1 > size:
+                return word[:m.start()]
+            used += 1
+        else:
+            if used + len(token) > size:
+                return word[:m.start() + size - used]
+            used += len(token)
+    return word
+
+class _AnyTag(object):
+    """Allows every tag, for parsing output that was already scrubbed."""
+
+    def __contains__(self, name):
+        return True
+
+class TruncatingSoup(LimitedSoup):
+    """LimitedSoup that stops parsing once the visible text is longer than
+    max_chars, adding ellipsis after the text it keeps. truncated is True
+    if anything was left out."""
+
+    def __init__(self, markup, budget, allowed_tags, kept_tags, max_chars, ellipsis):
+        self.chars_left = max_chars
+        self.ellipsis = ellipsis
+        self.truncated = False
+        # The last text counted, the ellipsis goes after it when the text
+        # that doesn't fit has nothing to keep
+        self.last_text = None
+        LimitedSoup.__init__(self, markup, budget, allowed_tags, kept_tags)
+
+    def reset(self):
+        # Whether text in the open tags is shown
+        self.visible = [True]
+        LimitedSoup.reset(self)
+
+    def pushTag(self, tag):
+        if tag is not self:
+            self.visible.append(self.visible[-1] and tag.name not in _invisible_tags)
+        LimitedSoup.pushTag(self, tag)
+        if tag is not self and self.depths[-1] is None:
+            self.visible[-1] = False
+
+    def popTag(self):
+        self.visible.pop()
+        return LimitedSoup.popTag(self)
+
+    def endData(self, containerClass=NavigableString):
+        if not (self.currentData and containerClass is NavigableString and self.visible[-1]):
+            LimitedSoup.endData(self, containerClass)
+            return
+        text = u''.join(self.currentData)
+        if not text.translate(self.STRIP_ASCII_SPACES):
+            LimitedSoup.endData(self, containerClass)
+            return
+        size = _visible_length(text)
+        if size <= self.chars_left:
+            self.chars_left -= size
+            LimitedSoup.endData(self, containerClass)
+            self.last_text = self.currentTag.contents[-1]
+            return
+        self.truncated = True
+        text = _cut(text, self.chars_left)
+        self.currentData = []
+        if text:
+            self.currentData = [text]
+            LimitedSoup.endData(self)
+            self.last_text = self.currentTag.contents[-1]
+        last = self.last_text
+        if self.ellipsis:
+            last = self._add_ellipsis(last)
+        if last is not None:
+            _remove_after(last)
+        raise StopParsing
+
+    def _add_ellipsis(self, last):
+        """Add the ellipsis after last, or where parsing stopped if there is
+        no text before it, and return it."""
+        if last is None:
+            self.currentData = [self.ellipsis]
+            LimitedSoup.endData(self)
+            return self.currentTag.contents[-1]
+        ellipsis = NavigableString(self.ellipsis)
+        parent = last.parent
+        parent.insert(_index(parent, last) + 1, ellipsis)
+        return ellipsis
+
+def _index(parent, node):
+    for i in xrange(len(parent.contents) - 1, -1, -1):
+        if parent.contents[i] is node:
+            return i
+
+def _remove_after(node):
+    """Remove everything after node in the tree, like the tags opened
+    after the last text that fit."""
+    while node.parent is not None:
+        parent = node.parent
+        for child in parent.contents[_index(parent, node) + 1:]:
+            child.extract()
+        node = parent
+
+def scrub_truncated(scrubber, html, max_chars, ellipsis):
+    """Return (html, truncated) for the scrubbed start of html. See
+    Scrubber.scrub_truncated()."""
+    soup = scrubber._parse(html)
+    if isinstance(soup, TruncatingSoup):
+        scrubber._scrub_soup(soup)
+        return scrubber._serialize(soup), soup.truncated
+    # Another parser or a _parse method of a subclass: scrub everything and
+    # cut the result
+    scrubber._scrub_soup(soup)
+    output = scrubber._serialize(soup)
+    soup = TruncatingSoup(output, Budget(Limits()), _AnyTag(), (), max_chars, ellipsis)
+    if not soup.truncated:
+        return output, False
+    return scrubber._serialize(soup), True
@@ -0,0 +1,91 @@
+"""
+Normalization of link and image urls.
+
+UrlNormalizer makes urls absolute, quotes them for links and drops any
+with a scheme that isn't allowed, all in one call. The same links and
+image paths repeat throughout a page and across pages, so the results
+are memoized for each (base_url, url) pair.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import re
+from urllib import quote as urlquote
+from urlparse import urljoin
+
+from scrubber.attributes import _ignored_re
+
+_scheme_re = re.compile(r'([a-zA-Z][a-zA-Z0-9+.\-]*):')
+
+class UrlNormalizer(object):
+    """Normalizes urls, allowing only the schemes in allowed_schemes.
+
+    Urls with "://" or starting with "mailto:" are absolute and are
+    dropped unless their scheme is allowed. Relative urls not starting
+    with "/" or "." are taken to be missing "http://", other relative urls
+    are joined to base_url when there is one.
+
+    Results are memoized, up to max_cache_entries of them. hits and misses
+    count the lookups.
+    """
+    max_cache_entries = 4096
+
+    def __init__(self, allowed_schemes):
+        self.allowed_schemes = frozenset(s.lower() for s in allowed_schemes)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, url, base_url=None, safe=None):
+        """Return the normalized url, or None if it should be dropped. If
+        safe is not None the url is also quoted, leaving the characters in
+        safe alone."""
+        key = (base_url, url, safe)
+        try:
+            result = self.cache[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            return result
+        result = self.normalize(url, base_url, safe)
+        if len(self.cache) >= self.max_cache_entries:
+            self.cache.clear()
+        self.cache[key] = result
+        return result
+
+    def scheme(self, url):
+        """Return the lowercased scheme of url, or None if it has none.
+        Characters browsers skip in a scheme are ignored."""
+        m = _scheme_re.match(_ignored_re.sub(u'', url))
+        return m and m.group(1).lower() or None
+
+    def normalize(self, url, base_url=None, safe=None):
+        """Same as calling the normalizer but without the cache."""
+        if '://' in url or url.startswith('mailto:'):
+            scheme = self.scheme(url)
+            if scheme is not None and scheme not in self.allowed_schemes:
+                return None
+        elif url[:1] not in ('/', '.'):
+            url = "http://" + url
+        elif base_url:
+            url = urljoin(base_url, url)
+        if safe is not None:
+            url = urlquote(url, safe=safe)
+        return url
+
+    def stats(self):
+        """Return a dict of counters for the cache."""
+        return dict(hits=self.hits, misses=self.misses, entries=len(self.cache))
+
+_url_normalizers = {}
+
+def get_url_normalizer(allowed_schemes):
+    """Return a shared UrlNormalizer for a frozenset of scheme names."""
+    try:
+        return _url_normalizers[allowed_schemes]
+    except KeyError:
+        normalizer = _url_normalizers[allowed_schemes] = UrlNormalizer(allowed_schemes)
+        return normalizer
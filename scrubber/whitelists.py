@@ -0,0 +1,209 @@
+"""
+Indexed whitelists for matching urls and lines of script.
+
+Both classes are frozensets of their entries so they can be used as policy
+values like any other set, with a match() method that doesn't have to try
+the entries one by one. union() and difference() return updated copies
+that reuse the index of the original instead of building a new one.
+
+Copyright (c) 2009-2010 Lefora <samuel@lefora.com>
+
+See LICENSE for license details.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+
+class PrefixSet(frozenset):
+    """A set of string prefixes.
+
+    Keeps the prefixes sorted, leaving out any that start with a shorter
+    one in the set. A string can then only start with the last prefix that
+    sorts before it, which is found by bisection.
+    """
+    __slots__ = ('_all', '_minimal')
+
+    def __new__(cls, prefixes=()):
+        self = frozenset.__new__(cls, prefixes)
+        self._all = sorted(self)
+        self._minimal = []
+        for prefix in self._all:
+            if not self._minimal or not prefix.startswith(self._minimal[-1]):
+                self._minimal.append(prefix)
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def match(self, text):
+        """Return the prefix text starts with or None."""
+        minimal = self._minimal
+        i = bisect_right(minimal, text)
+        if i and text.startswith(minimal[i-1]):
+            return minimal[i-1]
+        return None
+
+    def _copy(self, members, all_sorted, minimal):
+        new = frozenset.__new__(self.__class__, members)
+        new._all = all_sorted
+        new._minimal = minimal
+        return new
+
+    @staticmethod
+    def _insert(minimal, prefix):
+        """Add prefix to the sorted minimal list in place."""
+        i = bisect_right(minimal, prefix)
+        if i and prefix.startswith(minimal[i-1]):
+            return
+        j = i
+        while j < len(minimal) and minimal[j].startswith(prefix):
+            j += 1
+        minimal[i:j] = [prefix]
+
+    def union(self, *others):
+        new = set()
+        for other in others:
+            new.update(p for p in other if p not in self)
+        if not new:
+            return self
+        all_sorted = list(self._all)
+        minimal = list(self._minimal)
+        for prefix in sorted(new):
+            all_sorted.insert(bisect_left(all_sorted, prefix), prefix)
+            self._insert(minimal, prefix)
+        return self._copy(all_sorted, all_sorted, minimal)
+
+    def difference(self, *others):
+        removed = set()
+        for other in others:
+            removed.update(p for p in other if p in self)
+        if not removed:
+            return self
+        all_sorted = [p for p in self._all if p not in removed]
+        minimal = list(self._minimal)
+        for prefix in sorted(removed):
+            i = bisect_left(minimal, prefix)
+            if i == len(minimal) or minimal[i] != prefix:
+                # Was covered by a shorter prefix
+                continue
+            del minimal[i]
+            # Bring back the entries it covered
+            j = bisect_left(all_sorted, prefix)
+            while j < len(all_sorted) and all_sorted[j].startswith(prefix):
+                self._insert(minimal, all_sorted[j])
+                j += 1
+        return self._copy(all_sorted, all_sorted, minimal)
+
+    __or__ = union
+    __sub__ = difference
+
+class RegexSet(frozenset):
+    """A set of compiled regular expressions.
+
+    match() is true if any of them matches at the start of the string. The
+    expressions are combined into alternations of up to chunk_size of them
+    (and less than the limit of 100 groups) so a string is matched by a few
+    regex calls. Expressions with backreferences, named groups,
+    conditionals, inline flags or verbose syntax can't be combined safely
+    and are kept on their own.
+
+    Strings are compiled when added. union() and difference() compare
+    expressions by pattern and flags, so passing the same string again
+    removes one.
+    """
+    __slots__ = ('_chunks',)
+
+    chunk_size = 64
+    max_groups = 90
+
+    _unsafe_re = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[iLmsux]+\)')
+
+    def __new__(cls, patterns=()):
+        patterns = [re.compile(p) if isinstance(p, basestring) else p for p in patterns]
+        self = frozenset.__new__(cls, patterns)
+        self._chunks = self._build(sorted(self, key=self._key))
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def match(self, text):
+        """Return the match object of the first expression that matches at
+        the start of text or None."""
+        for members, regex in self._chunks:
+            m = regex.match(text)
+            if m is not None:
+                return m
+        return None
+
+    def _can_combine(self, regex):
+        return not (regex.flags & re.VERBOSE or self._unsafe_re.search(regex.pattern))
+
+    def _compile_chunk(self, members):
+        if len(members) == 1:
+            return (members, members[0])
+        return (members, re.compile('|'.join('(?:%s)' % r.pattern for r in members), members[0].flags))
+
+    def _build(self, regexes):
+        """Return a list of (members, compiled) chunks for regexes."""
+        chunks = []
+        members, groups = [], 0
+        for regex in regexes:
+            if not self._can_combine(regex):
+                chunks.append(((regex,), regex))
+                continue
+            if members and (len(members) >= self.chunk_size or groups + regex.groups > self.max_groups
+                    or members[0].flags != regex.flags):
+                chunks.append(self._compile_chunk(tuple(members)))
+                members, groups = [], 0
+            members.append(regex)
+            groups += regex.groups
+        if members:
+            chunks.append(self._compile_chunk(tuple(members)))
+        return chunks
+
+    def _copy(self, members, chunks):
+        new = frozenset.__new__(self.__class__, members)
+        new._chunks = chunks
+        return new
+
+    @staticmethod
+    def _key(regex):
+        return (regex.flags, regex.pattern)
+
+    def _compiled(self, others):
+        """Return a dict of key -> compiled regex for the patterns in others."""
+        regexes = {}
+        for other in others:
+            for p in other:
+                if isinstance(p, basestring):
+                    p = re.compile(p)
+                regexes[self._key(p)] = p
+        return regexes
+
+    def union(self, *others):
+        new = self._compiled(others)
+        for regex in self:
+            new.pop(self._key(regex), None)
+        if not new:
+            return self
+        # Only the new expressions are compiled
+        chunks = self._chunks + self._build([new[k] for k in sorted(new)])
+        return self._copy(set(self) | set(new.values()), chunks)
+
+    def difference(self, *others):
+        removed = set(self._compiled(others))
+        members = set(r for r in self if self._key(r) not in removed)
+        if len(members) == len(self):
+            return self
+        # Only the chunks that lost members are compiled again
+        chunks = []
+        for chunk in self._chunks:
+            if all(r in members for r in chunk[0]):
+                chunks.append(chunk)
+            else:
+                chunks.extend(self._build([r for r in chunk[0] if r in members]))
+        return self._copy(members, chunks)
+
+    __or__ = union
+    __sub__ = difference
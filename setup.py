@@ -1,16 +1,11 @@
 #!/usr/bin/env python
 
+import re
 from setuptools import setup
 
-# Get the version, but make sure to create a fake BeautifulSoup module just
-# in case it isn't installed.
-import imp
-import sys
-mod = imp.new_module("BeautifulSoup")
-mod.BeautifulSoup = None
-mod.Comment = None
-sys.modules["BeautifulSoup"] = mod
-from scrubber import __version__ as version
+# Get the version without importing scrubber as BeautifulSoup may not be
+# installed yet.
+version = re.search(r'^__version__ = "([^"]+)"', open("scrubber/__init__.py").read(), re.M).group(1)
 
 try:
     long_description = open("README.rst").read()
@@ -27,6 +22,9 @@ setup(
     url = 'http://github.com/samuel/python-scrubber/tree/master',
     install_requires = ["BeautifulSoup"],
     packages = ['scrubber'],
+    entry_points = {
+        'console_scripts': ['scrubber = scrubber.cli:main'],
+    },
     license = "BSD",
     classifiers = [
         'Intended Audience :: Developers',
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import re
 import unittest
 import BeautifulSoup
 
-from scrubber import Scrubber, SelectiveScriptScrubber
+from scrubber import LimitExceeded, Limits, Policy, ScrubObserver, Scrubber, SelectiveScriptScrubber, Urlizer, scrub_many, urlize
+from scrubber.whitelists import PrefixSet, RegexSet
 
 class ScrubberTestCase(unittest.TestCase):
     tests = (
@@ -150,5 +152,942 @@ class SelectiveScriptScrubberTestCase(unittest.TestCase):
                 expected = html
             self.failUnlessEqual(self.scrubber.scrub(html), expected)
 
+class UrlizerTestCase(unittest.TestCase):
+    def testNoCandidates(self):
+        text = u"Nothing to see here. Move along"
+        self.failUnless(Urlizer()(text) is text)
+
+    def testWrapper(self):
+        text = u"see www.example.com, http://example.org/a b@example.com"
+        self.failUnlessEqual(urlize(text, nofollow=True), Urlizer(nofollow=True)(text))
+
+    def testTlds(self):
+        self.failUnlessEqual(Urlizer()(u"example.io"), u"example.io")
+        self.failUnlessEqual(Urlizer(tlds=['.io'])(u"example.io"), u'<a href="http://example.io">example.io</a>')
+
+    def testAutoescape(self):
+        self.failUnlessEqual(Urlizer(autoescape=True)(u"<b> & www.a.com"),
+            u'&lt;b&gt; &amp; <a href="http://www.a.com">www.a.com</a>')
+
+    def testMarkup(self):
+        self.failUnlessEqual(Urlizer(markup=True)(u"<b> &amp; & www.a.com"),
+            u'&lt;b&gt; &amp; &amp; <a href="http://www.a.com">www.a.com</a>')
+        self.failUnlessEqual(Urlizer()(u'x"onmouseover="alert(1)"@y.com'),
+            u'<a href="mailto:x&quot;onmouseover=&quot;alert(1)&quot;@y.com">x"onmouseover="alert(1)"@y.com</a>')
+
+    def testEscapedOutput(self):
+        tests = (
+            ('www.a.com <<blink></blink>img src=x onerror=alert(1)//<b>x</b>',
+                u'<a href="http://www.a.com" rel="nofollow">www.a.com</a> &lt;img src=x onerror=alert(1)//<strong>x</strong>'),
+            ('x"onmouseover="alert(1)"@y.com',
+                u'<a href="mailto:x&quot;onmouseover=&quot;alert(1)&quot;@y.com">x"onmouseover="alert(1)"@y.com</a>'),
+        )
+        for kwargs in ({}, dict(fast_path=False, prune=False), dict(single_pass=False), dict(compact_tree=True), dict(parser='htmlparser')):
+            for html, expected in tests:
+                self.failUnlessEqual(Scrubber(**kwargs).scrub(html), expected)
+        self.failUnlessEqual(u''.join(Scrubber().scrub_stream([tests[1][0]])), tests[1][1])
+
+class StreamTestCase(unittest.TestCase):
+    def scrub_stream(self, scrubber, html, size=7):
+        return u''.join(scrubber.scrub_stream(html[i:i+size] for i in range(0, len(html), size)))
+
+    def testMatchesScrub(self):
+        scrubber = Scrubber()
+        for html, expected in ScrubberTestCase.tests[1:11] + ScrubberTestCase.tests[13:]:
+            self.failUnlessEqual(self.scrub_stream(scrubber, html), expected)
+
+    def testSelectiveScripts(self):
+        scrubber = SelectiveScriptScrubber()
+        for html, expected in SelectiveScriptScrubberTestCase.tests:
+            if expected is True:
+                expected = html
+            self.failUnlessEqual(self.scrub_stream(scrubber, html), expected)
+
+        self.scrub_stream(scrubber, '<script src="http://www.example.com/evil.js"></script>')
+        self.failUnlessEqual([w.src for w in scrubber.warnings], ["http://www.example.com/evil.js"])
+
+    def testEscapedLinks(self):
+        scrubber = Scrubber()
+        html = 'mail x"onmouseover="alert(1)"@y.com or http://a.com/?q=<x & more'
+        expected = u'mail <a href="mailto:x&quot;onmouseover=&quot;alert(1)&quot;@y.com">x"onmouseover="alert(1)"@y.com</a> or '
+        for size in (1, 5, len(html)):
+            result = self.scrub_stream(scrubber, html, size)
+            self.failUnless(result.startswith(expected), result)
+            self.failIf('<x' in result)
+
+    def testChunks(self):
+        scrubber = Scrubber()
+        html = "<p>Visit www.example.com<script>alert('<p>x</p>')</script> <b>now</b></p><p>bye"
+        expected = u'<p>Visit <a href="http://www.example.com" rel="nofollow">www.example.com</a> <strong>now</strong></p><p>bye</p>'
+        for size in (1, 3, 10, len(html)):
+            self.failUnlessEqual(self.scrub_stream(scrubber, html, size), expected)
+
+class ParserBackendTestCase(unittest.TestCase):
+    def backends(self):
+        from scrubber.parsers import parser_backends, get_parser_backend
+        for name in sorted(parser_backends):
+            try:
+                get_parser_backend(name)
+            except ImportError:
+                continue
+            yield name
+
+    def testBackends(self):
+        for parser in self.backends():
+            for cls, case in ((Scrubber, ScrubberTestCase), (SelectiveScriptScrubber, SelectiveScriptScrubberTestCase)):
+                scrubber = cls(parser=parser)
+                for html, expected in case.tests:
+                    if html.startswith('<img src=""'):
+                        # The evil code case depends on how sgmllib finds
+                        # the end of a tag. Others leave the rest as text.
+                        continue
+                    if expected is True:
+                        expected = html
+                    self.failUnlessEqual(scrubber.scrub(html), expected, "%s: %r" % (parser, html))
+
+    def testUnknownBackend(self):
+        self.failUnlessRaises(ValueError, Scrubber, parser='nosuchparser')
+
+class CacheTestCase(unittest.TestCase):
+    def testWarningsRestored(self):
+        from scrubber.cache import ScrubCache
+        scrubber = SelectiveScriptScrubber(cache=ScrubCache())
+        html = '<script src="http://www.example.com/evil.js"></script>Hi'
+        self.failUnlessEqual(scrubber.scrub(html), "Hi")
+        self.failUnlessEqual(scrubber.scrub(html), "Hi")
+        self.failUnlessEqual([w.src for w in scrubber.warnings], ["http://www.example.com/evil.js"])
+        self.failUnlessEqual(scrubber.cache.stats()['hits'], 1)
+
+    def testPolicyFingerprint(self):
+        from scrubber.cache import ScrubCache
+        cache = ScrubCache()
+        html = "www.example.com"
+        self.failUnlessEqual(Scrubber(cache=cache).scrub(html), Scrubber().scrub(html))
+        self.failUnlessEqual(Scrubber(nofollow=False, cache=cache).scrub(html), Scrubber(nofollow=False).scrub(html))
+        self.failUnlessEqual(cache.stats()['misses'], 2)
+
+    def testEviction(self):
+        from scrubber.cache import ScrubCache
+        cache = ScrubCache(max_entries=2)
+        scrubber = Scrubber(cache=cache)
+        for html in ("a", "b", "c", "a"):
+            scrubber.scrub(html)
+        stats = cache.stats()
+        self.failUnlessEqual((stats['entries'], stats['evictions'], stats['hits']), (2, 2, 0))
+
+        cache = ScrubCache(max_entries=None, max_bytes=1000)
+        scrubber = Scrubber(cache=cache)
+        for i in range(100):
+            scrubber.scrub("<p>%d</p>" % i)
+        self.failUnless(0 < cache.stats()['bytes'] <= 1000)
+
+    def testDBMBackend(self):
+        import os, shutil, tempfile
+        from scrubber.cache import ScrubCache, DBMBackend
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "cache")
+            backend = DBMBackend(path)
+            Scrubber(cache=ScrubCache(backend=backend)).scrub("<b>x</b>")
+            backend.close()
+            cache = ScrubCache(backend=DBMBackend(path))
+            self.failUnlessEqual(Scrubber(cache=cache).scrub("<b>x</b>"), "<strong>x</strong>")
+            self.failUnlessEqual(cache.stats()['hits'], 1)
+            cache.backend.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+class PolicyTestCase(unittest.TestCase):
+    def testShared(self):
+        a, b = SelectiveScriptScrubber(), SelectiveScriptScrubber()
+        self.failUnless(a.policy is b.policy)
+        self.failUnless(a.allowed_script_line_res is b.allowed_script_line_res)
+        self.failIfEqual(a.policy, Scrubber().policy)
+
+    def testDirect(self):
+        hooks = dict(a=Scrubber.get_policy().tag_hooks['a'])
+        policy = Policy(allowed_tags=['p', 'a'], disallowed_tags_save_content=['span'], allowed_attributes=['HREF'],
+            normalized_tag_replacements={'p': 'div'}, allowed_url_schemes=['http'], tag_hooks=hooks)
+        scrubber = Scrubber(policy=policy, nofollow=False)
+        self.failUnlessEqual(scrubber.scrub('<p title="t"><span>a</span><a href="http://x.com/">b</a><b>c</b></p>'),
+            '<div>a<a href="http://x.com/" class="external">b</a></div>')
+        self.failUnlessEqual(scrubber.scrub('<a href="ftp://x.com/">b</a>'), '<a class="external">b</a>')
+        self.failUnlessEqual(policy, Policy(allowed_tags=['a', 'p'], disallowed_tags_save_content=['span'],
+            allowed_attributes=['href'], normalized_tag_replacements={'p': 'div'}, allowed_url_schemes=['HTTP'], tag_hooks=hooks))
+
+    def testRuntimeClasses(self):
+        import gc, weakref
+        class RuntimeScrubber(Scrubber):
+            allowed_tags = set(['p'])
+            def _scrub_tag_p(self, p):
+                pass
+        self.failUnlessEqual(RuntimeScrubber().scrub('<p>a</p><b>b</b>'), '<p>a</p>')
+        ref = weakref.ref(RuntimeScrubber)
+        del RuntimeScrubber
+        gc.collect()
+        self.failUnless(ref() is None)
+
+    def testImmutable(self):
+        policy = Scrubber.get_policy()
+        self.failUnlessRaises(AttributeError, setattr, policy, 'allowed_tags', frozenset())
+        self.failIf(hasattr(policy.allowed_tags, 'add'))
+        self.failUnlessRaises(TypeError, policy.normalized_tag_replacements.pop, 'b')
+
+    def testHashable(self):
+        policy = Scrubber.compile_policy()
+        self.failUnlessEqual(policy, Scrubber.get_policy())
+        self.failUnlessEqual(len(set([policy, Scrubber.get_policy()])), 1)
+
+    def testReplace(self):
+        policy = Scrubber.get_policy()
+        policy = policy.replace(normalized_tag_replacements={}, allowed_tags=policy.allowed_tags - set(['em']))
+        scrubber = Scrubber(policy=policy)
+        self.failUnlessEqual(scrubber.scrub("<b>x</b><em>y</em>"), "<b>x</b>")
+        self.failIfEqual(scrubber.policy_fingerprint(), Scrubber().policy_fingerprint())
+
+    def testFingerprintCached(self):
+        scrubber = Scrubber()
+        fingerprint = scrubber.policy_fingerprint()
+        self.failUnless(scrubber.policy_fingerprint() is fingerprint)
+        scrubber.nofollow = False
+        self.failIfEqual(scrubber.policy_fingerprint(), fingerprint)
+        scrubber.nofollow = True
+        self.failUnlessEqual(scrubber.policy_fingerprint(), fingerprint)
+        scrubber.allowed_tags = scrubber.allowed_tags - set(['em'])
+        self.failIfEqual(scrubber.policy_fingerprint(), fingerprint)
+
+class WhitelistTestCase(unittest.TestCase):
+    def testPrefixSet(self):
+        prefixes = ["http://a.com/", "http://a.com/x/", "http://b.com/js", "http://b.com/", "http://c.org/w.js"]
+        urls = ["http://a.com/x/y.js", "http://a.co", "http://b.com/j", "http://c.org/w.jsx", "http://c.org/", "", "z"]
+        def check(index, prefixes):
+            for url in urls:
+                self.failUnlessEqual(index.match(url) is not None, any(url.startswith(p) for p in prefixes), url)
+        index = PrefixSet(prefixes)
+        check(index, prefixes)
+        check(index.difference(["http://b.com/", "http://a.com/x/"]), ["http://a.com/", "http://b.com/js", "http://c.org/w.js"])
+        check(index.difference(["http://a.com/"]).union(["http://c.org/"]), prefixes[1:] + ["http://c.org/"])
+        check(index.union(["http://a.co"]) - ["http://a.com/"], prefixes[1:] + ["http://a.co"])
+
+    def testRegexSet(self):
+        patterns = [r"^(a)(b)?$", r"^c+$", r"(?i)^d$", r"^(e)\1$"] + [r"^f%d$" % i for i in range(200)]
+        regexes = RegexSet(patterns)
+        for text in ("ab", "a", "cc", "D", "ee", "f150", "f", "abc"):
+            self.failUnlessEqual(regexes.match(text) is not None, any(re.match(p, text) for p in patterns), text)
+        self.failUnless(len(regexes._chunks) < 10)
+        smaller = regexes - [r"^c+$", r"^f150$"]
+        self.failUnlessEqual(len(smaller), len(regexes) - 2)
+        self.failIf(smaller.match("cc") or smaller.match("f150"))
+        self.failUnless(smaller.match("f149") and (smaller | [r"^c+$"]).match("cc"))
+
+    def testRegexSetGroups(self):
+        patterns = [r"^(?P<id>\d+)$", r"^x(?P<id>\d+)$", r"^(<)?y(?(1)>)$", r"^z$"]
+        regexes = RegexSet(patterns)
+        for text in ("12", "x3", "<y>", "y", "<y", "z", "x"):
+            self.failUnlessEqual(regexes.match(text) is not None, any(re.match(p, text) for p in patterns), text)
+        scrubber = SelectiveScriptScrubber()
+        scrubber.update_whitelists(add=dict(allowed_iframe_srcs=[r"^http://a\.example\.com/(?P<id>\d+)$", r"^http://b\.example\.com/(?P<id>\d+)$"]))
+        html = '<iframe src="http://b.example.com/7"></iframe>'
+        self.failUnlessEqual(scrubber.scrub(html), html)
+
+    def testUpdate(self):
+        scrubber = SelectiveScriptScrubber()
+        html = '<script src="http://widgets.example.com/w.js"></script><iframe src="http://maps.example.com/"></iframe>'
+        self.failUnlessEqual(scrubber.scrub(html), "")
+        fingerprint = scrubber.policy_fingerprint()
+        scrubber.update_whitelists(add=dict(allowed_script_srcs=["http://widgets.example.com/"],
+            allowed_iframe_srcs=[r"^http://maps\.example\.com/"]))
+        self.failUnlessEqual(scrubber.scrub(html), html)
+        self.failIfEqual(scrubber.policy_fingerprint(), fingerprint)
+        self.failUnlessEqual(SelectiveScriptScrubber().scrub(html), "")
+        scrubber.update_whitelists(remove=dict(allowed_script_srcs=["http://widgets.example.com/"]))
+        self.failUnlessEqual(scrubber.scrub(html), '<iframe src="http://maps.example.com/"></iframe>')
+
+class FailingScrubber(Scrubber):
+    def _scrub_tag_blockquote(self, node):
+        raise ValueError("bad document")
+
+class BatchTestCase(unittest.TestCase):
+    documents = ["<b>%d</b>" % i for i in range(50)] + ["<blockquote>x</blockquote>"] + ["www.example.com"]
+
+    def check(self, results):
+        self.failUnlessEqual([r.index for r in results], range(len(self.documents)))
+        scrubber = Scrubber()
+        for result in results[:50] + results[51:]:
+            self.failUnlessEqual(result.html, scrubber.scrub(self.documents[result.index]))
+            self.failUnlessEqual(result.error, None)
+        self.failUnlessEqual(results[50].html, None)
+        self.failUnless("bad document" in results[50].error)
+
+    def testInProcess(self):
+        self.check(list(scrub_many(self.documents, FailingScrubber, workers=1)))
+
+    def testPool(self):
+        self.check(list(scrub_many(self.documents, FailingScrubber, workers=2, chunksize=4)))
+        results = list(scrub_many(self.documents, FailingScrubber, workers=2, chunksize=4, ordered=False))
+        self.check(sorted(results, key=lambda r: r.index))
+
+    def testWarnings(self):
+        html = '<script src="http://www.example.com/evil.js"></script>'
+        result, = scrub_many([html], SelectiveScriptScrubber, workers=2)
+        self.failUnlessEqual([w.src for w in result.warnings], ["http://www.example.com/evil.js"])
+
+class ReentrantTestCase(unittest.TestCase):
+    def testResult(self):
+        scrubber = SelectiveScriptScrubber()
+        html, warnings, stats = scrubber.scrub_ex('<script src="http://www.example.com/evil.js"></script><b>x</b>')
+        self.failUnlessEqual(html, "<strong>x</strong>")
+        self.failUnlessEqual([w.src for w in warnings], ["http://www.example.com/evil.js"])
+        self.failUnlessEqual(scrubber.warnings, [])
+        self.failUnlessEqual(stats['bytes_out'], len(html))
+
+    def testThreads(self):
+        import threading
+        scrubber = SelectiveScriptScrubber()
+        errors = []
+        def run(n):
+            src = "http://www.example.com/%d.js" % n
+            for i in range(50):
+                result = scrubber.scrub_ex('<p>%d</p><script src="%s"></script>' % (i, src))
+                if result.html != "<p>%d</p>" % i or [w.src for w in result.warnings] != [src]:
+                    errors.append(result)
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.failUnlessEqual(errors, [])
+
+class RecordingObserver(ScrubObserver):
+    def __init__(self):
+        self.phases = []
+        self.stats = []
+
+    def phase_finished(self, scrubber, phase, seconds):
+        self.phases.append(phase)
+
+    def scrub_finished(self, scrubber, stats):
+        self.stats.append(stats)
+
+class ObserverTestCase(unittest.TestCase):
+    html = '<p onclick="x()" title="t">www.example.com <b>x</b><img src="/i.png"></p><script>x</script><!-- c -->'
+
+    def testSinglePass(self):
+        observer = RecordingObserver()
+        scrubber = Scrubber(observer=observer)
+        html, warnings, stats = scrubber.scrub_ex(self.html)
+        self.failUnlessEqual(html, Scrubber().scrub(self.html))
+        self.failUnlessEqual(observer.phases, ['pre', 'fast_path', 'parse', 'strip', 'autolink', 'tag_scrubbers', 'remove', 'serialize', 'post'])
+        self.failUnlessEqual(observer.stats, [stats])
+        self.failUnlessEqual((stats['nodes_visited'], stats['nodes_removed'], stats['attributes_dropped'], stats['text_autolinked']), (7, 2, 1, 1))
+        self.failUnless(all(t >= 0 for t in stats['timings'].values()))
+
+    def testMultiPass(self):
+        observer = RecordingObserver()
+        Scrubber(single_pass=False, observer=observer).scrub(self.html)
+        self.failUnlessEqual(observer.phases, ['pre', 'fast_path', 'parse', 'strip', 'autolink', 'tag_scrubbers', 'remove', 'normalize', 'serialize', 'post'])
+
+    def testDisabled(self):
+        stats = Scrubber().scrub_ex(self.html).stats
+        self.failIf('timings' in stats)
+
+class AttributeTestCase(unittest.TestCase):
+    tests = (
+        ('<a href="java&#x09;script:alert(1)">x</a>', '<a rel="nofollow" class="external">x</a>'),
+        ('<a href="javascript&colon;alert(1)">x</a>', '<a rel="nofollow" class="external">x</a>'),
+        ('<a href=" JaVa\nScRiPt:alert(1)">x</a>', '<a rel="nofollow" class="external">x</a>'),
+        ('<a href="http://example.com/javascript">x</a>', '<a href="http://example.com/javascript" rel="nofollow" class="external">x</a>'),
+        ('<p title="vbscript :x">x</p>', '<p>x</p>'),
+        ('<span style="color: red; position: absolute; background: url(javascript:x)">x</span>', '<span style="color: red">x</span>'),
+        ('<span style="background: url(http://example.com/a.png); COLOR:blue">x</span>', '<span style="background: url(http://example.com/a.png); COLOR:blue">x</span>'),
+        ('<span style="COLOR:blue;z-index:1">x</span>', '<span style="color: blue">x</span>'),
+        ('<span style="width: expr/**/ession(alert(1))">x</span>', '<span>x</span>'),
+        ('<span style="w\\idth: 1px; color: re\\64">x</span>', '<span style="width: 1px; color: red">x</span>'),
+        ('<span style="-moz-binding: url(x.xml#x); behavior: url(x.htc)">x</span>', '<span>x</span>'),
+        ("<span style=\"font-family: 'Arial'; color:#fff\">x</span>", "<span style=\"font-family: 'Arial'; color:#fff\">x</span>"),
+        ('<span style="color: red; {}">x</span>', '<span style="color: red">x</span>'),
+    )
+
+    def testAttributes(self):
+        scrubber = Scrubber()
+        for html, expected in self.tests:
+            self.failUnlessEqual(scrubber.scrub(html), expected)
+
+    def testMemoized(self):
+        from scrubber.attributes import get_style_sanitizer
+        sanitizer = get_style_sanitizer(Scrubber.get_policy().allowed_css_properties)
+        Scrubber().scrub('<p style="color: green; z-index: 9">x</p>')
+        self.failUnlessEqual(sanitizer.cache['color: green; z-index: 9'], 'color: green')
+
+    def testPolicy(self):
+        policy = Scrubber.get_policy().replace(allowed_css_properties=['z-index'])
+        self.failUnlessEqual(Scrubber(policy=policy).scrub('<p style="color: green; z-index: 9">x</p>'), '<p style="z-index: 9">x</p>')
+
+class RemoveNodesTestCase(unittest.TestCase):
+    def testLayered(self):
+        scrubber = Scrubber(fast_path=False)
+        html = '<p>a<blink>b<font>c<blink>d<x>e</x>f</blink></font>g</blink>h</p><font><font>i</font></font>'
+        self.failUnlessEqual(scrubber.scrub(html), "<p>abcdfgh</p>i")
+
+    def testLinks(self):
+        soup = BeautifulSoup.BeautifulSoup('<div>a<blink>b<blink>c</blink><x>d</x>e</blink><!-- f -->g</div>')
+        Scrubber()._scrub_soup(soup)
+        div = soup.div
+        self.failUnlessEqual(div.contents, [u"a", u"b", u"c", u"e", u"g"])
+        node, chain = soup, []
+        while node is not None:
+            chain.append(node)
+            node = node.next
+        self.failUnlessEqual(chain, [soup, div] + div.contents)
+        self.failUnless(all(node.parent is div for node in div.contents))
+        self.failUnlessEqual([node.nextSibling for node in div.contents], div.contents[1:] + [None])
+        self.failUnlessEqual([node.previousSibling for node in div.contents], [None] + div.contents[:-1])
+
+    def testManySiblings(self):
+        html = "".join('<font><blink>w%d</blink></font>' % i for i in range(2000))
+        self.failUnlessEqual(Scrubber().scrub(html), "".join("w%d" % i for i in range(2000)))
+
+class FastPathTestCase(unittest.TestCase):
+    tests = (
+        ("Nice post, www.example.com", True),
+        (u"caf\xe9 &amp; <b>bar</b><br/>\n<ul>\n<li>a</li> </ul>", True),
+        ('<p class="x">one<div>two</div></p>', True),
+        ("<pre>  </pre>  <p>x", True),
+        ("<p>one<p>two", False),
+        ("<li>a<li>b", True),
+        ("<ul><li>a<li>b</ul>", False),
+        ("   ", False),
+        ('<a href="x">y</a>', False),
+        ('<p onclick="x()">y</p>', False),
+        ("a > b & c", False),
+        ("<!-- x --> y", False),
+        ("caf\xe9", False),
+    )
+
+    def testSameOutput(self):
+        for cls in (Scrubber, SelectiveScriptScrubber):
+            fast, full = cls(), cls(fast_path=False)
+            for html, expected in ScrubberTestCase.tests + self.tests:
+                result = fast.scrub_ex(html)
+                self.failUnlessEqual(result.html, full.scrub(html))
+
+    def testTaken(self):
+        scrubber = Scrubber()
+        for html, taken in self.tests:
+            self.failUnlessEqual(scrubber.scrub_ex(html).stats['fast_path'], taken, html)
+        taken = len([t for html, t in self.tests if t])
+        self.failUnlessEqual(scrubber.fast_path_stats(), dict(taken=taken, skipped=len(self.tests) - taken))
+        scrubber.scrub_fragments([html for html, t in self.tests])
+        self.failUnlessEqual(scrubber.fast_path_stats(), dict(taken=taken * 2, skipped=(len(self.tests) - taken) * 2))
+        self.failUnlessEqual(Scrubber(fast_path=False).fast_path_stats(), dict(taken=0, skipped=0))
+
+    def testSubclass(self):
+        class CustomScrubber(Scrubber):
+            def _scrub_soup(self, soup):
+                pass
+        self.failIf(CustomScrubber().fast_path)
+        self.failIf(CustomScrubber().prune)
+        self.failIf(Scrubber(parser='htmlparser').fast_path)
+        # Checked once per class
+        from scrubber import _class_keeps_methods
+        self.failUnlessEqual(_class_keeps_methods[CustomScrubber][Scrubber._fast_path_methods], False)
+        self.failUnless(Scrubber().fast_path and Scrubber().prune)
+
+class IncrementalTestCase(unittest.TestCase):
+    tests = (
+        ("<p>one</p>\n<p>two http://example.com</p><br>tail", 3),
+        ("<p>one<p>two</p>", 1),
+        ("<div>a</div> &amp <div>b</div>", 1),
+        ("<div>a</div><!-- c --><blink>b</blink> <script>x</script><p>c</p>", 2),
+        ("<p>a</p><b>b</b><p>c<>d</p>", 1),
+        ("<P CLASS=x>a</P><i>b</i>", 2),
+        ("plain text", 1),
+        ("", 1),
+    )
+
+    def testSameOutput(self):
+        for cls in (Scrubber, SelectiveScriptScrubber):
+            scrubber = cls()
+            for html, expected in ScrubberTestCase.tests + SelectiveScriptScrubberTestCase.tests + self.tests:
+                self.failUnlessEqual(scrubber.scrub_incremental(html).html, scrubber.scrub(html))
+
+    def testBlocks(self):
+        scrubber = Scrubber()
+        for html, blocks in self.tests:
+            self.failUnlessEqual(scrubber.scrub_incremental(html).stats['blocks'], blocks, html)
+
+    def testReuse(self):
+        scrubber = SelectiveScriptScrubber()
+        html = '<p>one</p><iframe src="x"></iframe><p>two</p>'
+        result = scrubber.scrub_incremental(html)
+        self.failUnlessEqual(result.stats, dict(blocks=3, blocks_reused=0))
+        edited = html.replace('two', 'three') + '<script src="http://evil.com/x.js"></script>'
+        result = scrubber.scrub_incremental(edited, result.state)
+        self.failUnlessEqual(result.stats, dict(blocks=3, blocks_reused=2))
+        self.failUnlessEqual(result.html, scrubber.scrub(edited))
+        self.failUnlessEqual([w.src for w in result.warnings], ["http://evil.com/x.js"])
+        # State of a scrubber with a different policy is ignored
+        result = Scrubber(autolink=False).scrub_incremental(edited, result.state)
+        self.failUnlessEqual(result.stats['blocks_reused'], 0)
+
+    def testWholeDocumentHooks(self):
+        class CustomScrubber(Scrubber):
+            def _scrub_html_post(self, html):
+                return html.strip()
+        scrubber = CustomScrubber()
+        html = "<p>one</p> <p>two</p> "
+        result = scrubber.scrub_incremental(html)
+        self.failUnlessEqual(result.stats['blocks'], 1)
+        self.failUnlessEqual(result.html, scrubber.scrub(html))
+
+class LimitsTestCase(unittest.TestCase):
+    html = '<p>a http://x.com b http://y.com</p><div><p><b>deep</b></p></div><p>c</p><p>d</p>'
+    tests = (
+        (dict(max_bytes=20), '<p>a <a href="http://x.com" rel="nofollow">http://x.com</a> b </p>'),
+        (dict(max_nodes=3), '<p>a <a href="http://x.com" rel="nofollow">http://x.com</a> b <a href="http://y.com" rel="nofollow">http://y.com</a></p><div></div>'),
+        (dict(max_depth=2), '<p>a <a href="http://x.com" rel="nofollow">http://x.com</a> b <a href="http://y.com" rel="nofollow">http://y.com</a></p><div><p></p></div>'),
+        (dict(max_autolinks=1), '<p>a <a href="http://x.com" rel="nofollow">http://x.com</a> b http://y.com</p><div><p><strong>deep</strong></p></div><p>c</p><p>d</p>'),
+    )
+
+    def testTruncate(self):
+        for kwargs, expected in self.tests:
+            for extra in (dict(), dict(fast_path=False), dict(single_pass=False), dict(parser='htmlparser')):
+                limits = Limits(on_exceeded='truncate', **kwargs)
+                result = Scrubber(limits=limits, **extra).scrub_ex(self.html)
+                self.failUnlessEqual(result.html, expected)
+                self.failUnlessEqual([(w.limit, w.value) for w in result.warnings], kwargs.items())
+                self.failUnlessEqual(result.stats['limits_reached'], kwargs.keys())
+
+    def testRaise(self):
+        for kwargs, expected in self.tests:
+            scrubber = Scrubber(limits=Limits(**kwargs))
+            try:
+                scrubber.scrub(self.html)
+            except LimitExceeded, e:
+                self.failUnlessEqual((e.limit, e.value), kwargs.items()[0])
+            else:
+                self.fail("LimitExceeded not raised")
+
+    def testAutolinks(self):
+        html = 'www.a.com www.b.com &amp; www.c.com <p>www.d.com</p>'
+        expected = ('<a href="http://www.a.com" rel="nofollow">www.a.com</a> '
+            '<a href="http://www.b.com" rel="nofollow">www.b.com</a> &amp; www.c.com <p>www.d.com</p>')
+        for extra in (dict(), dict(fast_path=False), dict(single_pass=False), dict(observer=ScrubObserver())):
+            result = Scrubber(limits=Limits(max_autolinks=2, on_exceeded='truncate'), **extra).scrub_ex(html)
+            self.failUnlessEqual(result.html, expected)
+            self.failUnlessEqual(result.stats['limits_reached'], ['max_autolinks'])
+        self.failUnlessEqual(Urlizer(markup=True)('a www.a.com <b> www.b.com', 1), 'a <a href="http://www.a.com">www.a.com</a> &lt;b&gt; www.b.com')
+
+    def testEscape(self):
+        limits = Limits(max_nodes=4, max_depth=1, on_exceeded={'max_nodes': 'escape', 'max_depth': 'truncate'})
+        self.failUnlessEqual(Scrubber(limits=limits).scrub('<p>a</p><p><b>b</b></p>'), '<p>a</p><p></p>')
+        self.failUnlessEqual(Scrubber(limits=limits).scrub('<p>a</p><p>b</p><br>'), '&lt;p&gt;a&lt;/p&gt;&lt;p&gt;b&lt;/p&gt;&lt;br&gt;')
+        # Escaped input is cut to max_bytes too
+        limits = Limits(max_bytes=12, on_exceeded='escape')
+        self.failUnlessEqual(Scrubber(limits=limits).scrub('<p>a</p><p>b</p>' * 1000), '&lt;p&gt;a&lt;/p&gt;&lt;p&gt;b')
+        limits = Limits(max_bytes=2, on_exceeded='escape')
+        self.failUnlessEqual(Scrubber(limits=limits).scrub('\xc3\xa9\xc3\xa9'), u'\xe9')
+        self.failUnlessRaises(ValueError, Limits, on_exceeded='ignore')
+        self.failUnlessRaises(ValueError, Limits, on_exceeded={'max_size': 'raise'})
+
+    def testWithinLimits(self):
+        limits = Limits(max_bytes=1000, max_nodes=100, max_depth=10, max_autolinks=10, timeout=60)
+        for html, expected in ScrubberTestCase.tests:
+            self.failUnlessEqual(Scrubber(limits=limits).scrub(html), expected)
+
+    def testTimeout(self):
+        from scrubber.cache import ScrubCache
+        scrubber = Scrubber(limits=Limits(timeout=0, on_exceeded='truncate'), cache=ScrubCache())
+        html = "<p>x</p>" * 1000
+        result = scrubber.scrub_ex(html)
+        self.failUnless(len(result.html) < len(html))
+        self.failUnlessEqual(result.stats['limits_reached'], ['timeout'])
+        # Results cut short by the deadline aren't cached
+        self.failUnlessEqual(scrubber.cache.stats()['entries'], 0)
+
+    def testDeepNesting(self):
+        result = Scrubber(limits=Limits(max_depth=100, on_exceeded='truncate')).scrub_ex("<div>" * 10000)
+        self.failUnlessEqual(result.html, "<div>" * 100 + "</div>" * 100)
+
+    def testParserBackends(self):
+        from scrubber.parsers import get_parser_backend
+        for parser in ('htmlparser', 'lxml', 'html5lib'):
+            try:
+                get_parser_backend(parser)
+            except ImportError:
+                continue
+            limits = Limits(max_depth=50, on_exceeded='truncate')
+            result = Scrubber(parser=parser, limits=limits).scrub_ex("<div>" * 4000)
+            self.failUnlessEqual(result.html, "<div>" * 50 + "</div>" * 50)
+            scrubber = Scrubber(parser=parser, fast_path=False, limits=Limits(max_nodes=1000))
+            self.failUnlessRaises(LimitExceeded, scrubber.scrub, "<p>x</p>" * 4000)
+
+class SerializeTestCase(unittest.TestCase):
+    html = u"""<p title='say "hi"' class="a&b">caf\xe9 &amp; a&b <!-- c --></p><?php x ?><br /><pre>  x  </pre>"""
+
+    def testMatchesBeautifulSoup(self):
+        from scrubber.serialize import serialize
+        soup = BeautifulSoup.BeautifulSoup(self.html)
+        self.failUnlessEqual(serialize(soup), unicode(soup))
+        for html, expected in ScrubberTestCase.tests:
+            soup = BeautifulSoup.BeautifulSoup(html)
+            self.failUnlessEqual(serialize(soup), unicode(soup))
+
+    def testEncoding(self):
+        from StringIO import StringIO
+        from scrubber.serialize import serialize
+        soup = BeautifulSoup.BeautifulSoup(u"<p>caf\xe9 €</p>")
+        self.failUnlessEqual(serialize(soup, encoding='utf-8'), "<p>caf\xc3\xa9 \xe2\x82\xac</p>")
+        self.failUnlessEqual(serialize(soup, encoding='latin-1'), "<p>caf\xe9 &#8364;</p>")
+        out = StringIO()
+        self.failUnlessEqual(serialize(soup, out, encoding='ascii'), None)
+        self.failUnlessEqual(out.getvalue(), "<p>caf&#233; &#8364;</p>")
+        self.failUnlessEqual(Scrubber().scrub(u"<b>caf\xe9</b>", encoding='utf-8'), "<strong>caf\xc3\xa9</strong>")
+
+    def testMinify(self):
+        html = "<p>a   b\n\n c <b> d </b></p>\n\n<pre>  x\n  y</pre>  http://x.com  "
+        expected = '<p>a b c <strong> d </strong></p> <pre>  x\n  y</pre> <a href="http://x.com" rel="nofollow">http://x.com</a> '
+        for fast_path in (True, False):
+            self.failUnlessEqual(Scrubber(minify=True, fast_path=fast_path).scrub(html), expected)
+        self.failUnlessEqual(Scrubber(minify=True).scrub("a  \n b"), "a b")
+
+    def testDeepTree(self):
+        # Deeper than BeautifulSoup's recursive rendering can go
+        html = "<div>" * 2000 + "x"
+        self.failUnlessEqual(Scrubber(fast_path=False).scrub(html), "<div>" * 2000 + "x" + "</div>" * 2000)
+
+class FragmentsTestCase(unittest.TestCase):
+    def testMatchesScrubEx(self):
+        for cls, case in ((Scrubber, ScrubberTestCase), (SelectiveScriptScrubber, SelectiveScriptScrubberTestCase)):
+            for kwargs in (dict(), dict(fast_path=False), dict(single_pass=False)):
+                scrubber = cls(**kwargs)
+                fragments = [html for html, expected in case.tests]
+                for result, html in zip(scrubber.scrub_fragments(fragments), fragments):
+                    expected = scrubber.scrub_ex(html)
+                    self.failUnlessEqual(result.html, expected.html)
+                    self.failUnlessEqual([w.__class__ for w in result.warnings], [w.__class__ for w in expected.warnings])
+
+    def testIsolation(self):
+        fragments = ['<b>bold', 'plain<span>', '<script>x', '</b></span>after', '<!-- open', '<p>a</[fragment]>b', '<>']
+        results = Scrubber(fast_path=False).scrub_fragments(fragments)
+        self.failUnlessEqual([r.html for r in results], ['<strong>bold</strong>', 'plain<span></span>', '', 'after', '', '<p>ab</p>', ''])
+        self.failUnless(all(r.stats['batched'] for r in results))
+
+    def testWarnings(self):
+        fragments = ['<script src="http://evil.example.com/a.js"></script>', 'fine', '<p><script src="http://evil.example.com/b.js"></script></p>']
+        results = SelectiveScriptScrubber().scrub_fragments(fragments)
+        self.failUnlessEqual([len(r.warnings) for r in results], [1, 0, 1])
+        self.failUnlessEqual(results[2].warnings[0].src, "http://evil.example.com/b.js")
+        self.failUnlessEqual(results[0].warnings[0].src, "http://evil.example.com/a.js")
+
+class UrlTestCase(unittest.TestCase):
+    tests = (
+        ('<a href="../b/c">x</a>', '<a href="http://example.com/b/c" rel="nofollow" class="external">x</a>'),
+        ('<a href="example.org/x">x</a>', '<a href="http://example.org/x" rel="nofollow" class="external">x</a>'),
+        ('<a href="mailto:a@example.com">x</a>', '<a href="mailto:a@example.com" rel="nofollow" class="external">x</a>'),
+        ('<a href="FTP://example.com/f">x</a>', '<a href="FTP://example.com/f" rel="nofollow" class="external">x</a>'),
+        ('<a href="news://example.com/g">x</a>', '<a rel="nofollow" class="external">x</a>'),
+        ('<img src="/i.png" />', '<img src="http://example.com/i.png" alt="" />'),
+        ('<img src="example.org/i.png" />', '<img src="http://example.org/i.png" alt="" />'),
+        ('<img src="gopher://example.com/i.png" />', ''),
+    )
+
+    def testNormalize(self):
+        scrubber = Scrubber(base_url="http://example.com/a/")
+        for html, expected in self.tests:
+            self.failUnlessEqual(scrubber.scrub(html), expected)
+
+    def testCache(self):
+        from scrubber.urls import UrlNormalizer
+        normalizer = UrlNormalizer(['http'])
+        self.failUnlessEqual(normalizer('/a b', 'http://example.com/', safe='/:'), 'http://example.com/a%20b')
+        self.failUnlessEqual(normalizer('/a b', 'http://example.com/', safe='/:'), 'http://example.com/a%20b')
+        self.failUnlessEqual(normalizer(' HT\tTPS://example.com/'), None)
+        self.failUnlessEqual(normalizer.stats(), dict(hits=1, misses=2, entries=2))
+
+    def testPolicy(self):
+        policy = Scrubber.get_policy().replace(allowed_url_schemes=['https'])
+        scrubber = Scrubber(policy=policy)
+        self.failUnlessEqual(scrubber.scrub('<a href="http://example.com/">x</a>'), '<a rel="nofollow" class="external">x</a>')
+        self.failUnlessEqual(scrubber.scrub('<a href="HTTPS://example.com/">x</a>'), '<a href="HTTPS://example.com/" rel="nofollow" class="external">x</a>')
+        self.failIfEqual(policy.fingerprint, Scrubber.get_policy().fingerprint)
+
+class CountingScrubber(Scrubber):
+    def _filter_attributes(self, node_attrs):
+        self.filtered = getattr(self, 'filtered', 0) + 1
+        return Scrubber._filter_attributes(self, node_attrs)
+
+class AuditTestCase(unittest.TestCase):
+    def testFindings(self):
+        html = '<p onclick="x" title="t" style="color: red; z-index: 1">a<!-- c --><blink>k</blink><script>x</script></p><font size="+0">f</font>'
+        result = Scrubber().audit(html)
+        self.failIf(result.safe)
+        self.failUnlessEqual([tuple(f) for f in result.findings], [
+            ('attribute', 'p', 'onclick', 'x'),
+            ('attribute', 'p', 'style', 'color: red; z-index: 1'),
+            ('comment', None, None, ' c '),
+            ('tag', 'blink', None, None),
+            ('tag', 'script', None, None),
+            ('hook', 'font', None, None),
+        ])
+
+    def testSafe(self):
+        scrubber = Scrubber()
+        for html in ('plain www.example.com', '<p>a <b>b</b> <a href="/x">x</a> <img src="y.png"></p>'):
+            self.failUnless(scrubber.is_safe(html))
+            self.failUnlessEqual(scrubber.audit(html), (True, [], []))
+        self.failIf(scrubber.is_safe('<a href="news://example.com/">x</a>'))
+
+    def testStopsEarly(self):
+        scrubber = CountingScrubber()
+        self.failIf(scrubber.is_safe('<blink>x</blink>' + '<p title="t">x</p>' * 10))
+        self.failIf(hasattr(scrubber, 'filtered'))
+        self.failUnlessEqual(len(scrubber.audit('<blink>x</blink>' + '<p title="t">x</p>' * 10).findings), 1)
+        self.failUnlessEqual(scrubber.filtered, 10)
+
+    def testHooks(self):
+        html = '<p><script src="http://evil.example.com/a.js"></script>after</p><iframe src="http://example.com/"></iframe>'
+        result = SelectiveScriptScrubber().audit(html)
+        self.failUnlessEqual([(f.rule, f.tag) for f in result.findings], [('hook', 'script'), ('hook', 'iframe')])
+        self.failUnlessEqual([w.src for w in result.warnings], ["http://evil.example.com/a.js"])
+        self.failUnless(SelectiveScriptScrubber().is_safe('<script src="http://www.statcounter.com/counter/counter_xhtml.js"></script>'))
+
+    def testTreeUnchanged(self):
+        from scrubber.audit import _copy_tag
+        soup = BeautifulSoup.BeautifulSoup('<p>a<script>b</script>c</p>')
+        script = soup.find('script')
+        before = [unicode(node) for node in soup.recursiveChildGenerator()]
+        _copy_tag(script, script.attrs).extract()
+        self.failUnlessEqual([unicode(node) for node in soup.recursiveChildGenerator()], before)
+
+class CompactTreeTestCase(unittest.TestCase):
+    def testMatchesSoup(self):
+        for cls, case in ((Scrubber, ScrubberTestCase), (SelectiveScriptScrubber, SelectiveScriptScrubberTestCase)):
+            for kwargs in (dict(), dict(remove_comments=False), dict(minify=True)):
+                soup_scrubber = cls(fast_path=False, **kwargs)
+                compact_scrubber = cls(fast_path=False, compact_tree=True, **kwargs)
+                self.failUnless(compact_scrubber.compact_tree)
+                for html, expected in case.tests:
+                    expected = soup_scrubber.scrub_ex(html)
+                    result = compact_scrubber.scrub_ex(html)
+                    self.failUnlessEqual(result.html, expected.html)
+                    self.failUnlessEqual([w.__class__ for w in result.warnings], [w.__class__ for w in expected.warnings])
+
+    def testCompact(self):
+        from scrubber.tree import parse
+        root = parse('<p class="x">a<!-- b --><br></p>')
+        p = root.contents[0]
+        self.failIf(hasattr(p, '__dict__') or any(hasattr(node, '__dict__') for node in p.contents))
+        self.failUnlessEqual((p.name, p.attrs, p.get('class'), p.contents[0]), ('p', [('class', 'x')], 'x', 'a'))
+        self.failUnless(p.name is parse('<p>').contents[0].name)
+
+    def testMeta(self):
+        from scrubber.tree import CompactParser
+        soup_scrubber = Scrubber(fast_path=False)
+        compact_scrubber = Scrubber(fast_path=False, compact_tree=True)
+        for html in (u'<meta http-equiv="Content-Type" content="text/html; charset=utf-8"><p>x\xe9</p>',
+                '<meta http-equiv="Content-Type" content="text/html; charset=latin-1"><p>x\xe9</p>'):
+            self.failUnlessEqual(compact_scrubber.scrub(html), soup_scrubber.scrub(html))
+        self.failUnlessRaises(AttributeError, getattr, CompactParser('<p>'), 'p')
+
+    def testSoupConversion(self):
+        from scrubber.tree import from_soup, parse, serialize_tree, to_soup
+        html = '<div title="&amp;&#65;"><p>a &amp; b<!-- c --></p><br /><![CDATA[d]]></div>'
+        soup = to_soup(parse(html))
+        self.failUnlessEqual(unicode(soup), unicode(BeautifulSoup.BeautifulSoup(html)))
+        self.failUnlessEqual(soup.find('br').previous, soup.find('p').contents[-1])
+        self.failUnlessEqual(serialize_tree(from_soup(soup)), unicode(soup))
+
+    def testUnsafe(self):
+        self.failIf(Scrubber(compact_tree=True, observer=ScrubObserver()).compact_tree)
+        self.failIf(Scrubber(compact_tree=True, limits=Limits(max_nodes=10)).compact_tree)
+        self.failIf(Scrubber(compact_tree=True, parser='htmlparser').compact_tree)
+
+class BlockCacheTestCase(unittest.TestCase):
+    signature = '<div class="sig"><p>-- <a href="http://example.com/">my site</a></p><script src="http://evil.example.com/a.js"></script></div>'
+
+    def testReuse(self):
+        from scrubber.cache import ScrubCache
+        cache = ScrubCache()
+        scrubber = SelectiveScriptScrubber(block_cache=cache)
+        plain = SelectiveScriptScrubber()
+        for i in range(3):
+            html = '<p>reply %d www.example.com</p>%s' % (i, self.signature)
+            result = scrubber.scrub_ex(html)
+            expected = plain.scrub_ex(html)
+            self.failUnlessEqual(result.html, expected.html)
+            self.failUnlessEqual([w.src for w in result.warnings], [w.src for w in expected.warnings])
+            self.failUnlessEqual((result.stats['blocks'], result.stats['blocks_reused']), (2, i and 1 or 0))
+        self.failUnlessEqual(cache.stats()['hits'], 2)
+
+    def testObserver(self):
+        from scrubber.cache import ScrubCache
+        observer = RecordingObserver()
+        scrubber = SelectiveScriptScrubber(block_cache=ScrubCache(), observer=observer)
+        stats = scrubber.scrub_ex('<p>reply www.example.com</p>' + self.signature).stats
+        self.failUnlessEqual(observer.phases, ['pre', 'fast_path', 'blocks', 'post'])
+        self.failUnless(stats['timings']['blocks'] >= 0)
+
+    def testBounded(self):
+        from scrubber.cache import ScrubCache
+        scrubber = Scrubber(block_cache=ScrubCache(max_entries=2))
+        for i in range(5):
+            scrubber.scrub('<p><a href="/">%s</a></p><p>%s</p>' % ('a' * 70, str(i) * 70))
+        self.failUnlessEqual(scrubber.block_cache.stats()['entries'], 2)
+
+    def testSmallBlocks(self):
+        from scrubber.cache import ScrubCache
+        scrubber = Scrubber(block_cache=ScrubCache())
+        result = scrubber.scrub_ex('<p>a</p><b>b</b> www.example.com')
+        self.failIf('blocks' in result.stats)
+        self.failUnlessEqual(result.html, Scrubber().scrub('<p>a</p><b>b</b> www.example.com'))
+
+class TruncateTestCase(unittest.TestCase):
+    html = '<p>Hello <b>world</b> www.example.com</p><script>a long script</script><p>more text</p>'
+
+    def testTruncated(self):
+        tests = (
+            (5, u'<p>Hello...</p>'),
+            (8, u'<p>Hello <strong>wo...</strong></p>'),
+            (11, u'<p>Hello <strong>world...</strong></p>'),
+            (30, u'<p>Hello <strong>world</strong> <a href="http://www.example.com" rel="nofollow">www.example.com</a></p><p>mor...</p>'),
+        )
+        for max_chars, expected in tests:
+            result = Scrubber().scrub_truncated(self.html, max_chars)
+            self.failUnlessEqual(result.html, expected)
+            self.failUnlessEqual(result.stats['truncated'], True)
+
+    def testFits(self):
+        result = Scrubber().scrub_truncated(self.html, 38)
+        self.failUnlessEqual(result.html, Scrubber().scrub(self.html))
+        self.failUnlessEqual(result.stats['truncated'], False)
+
+    def testCounting(self):
+        scrubber = Scrubber()
+        self.failUnlessEqual(scrubber.scrub_truncated('<p>a &amp;   b<!-- comment --></p>c', 5).html, u'<p>a &amp;   b...</p>')
+        self.failUnlessEqual(scrubber.scrub_truncated('Supercalifragilistic', 5, ellipsis=u'&hellip;<').html, u'Super&hellip;&lt;')
+
+    def testUrls(self):
+        # Cutting a url would link somewhere else
+        scrubber = Scrubber()
+        html = 'see http://example.com/a/very/long/path/here and more'
+        self.failUnlessEqual(scrubber.scrub_truncated(html, 20).html, u'see...')
+        self.failUnlessEqual(scrubber.scrub_truncated(html[4:], 20).html, u'...')
+        self.failUnlessEqual(scrubber.scrub_truncated('ab&amp;cd www.x.com', 4).html, u'ab&amp;c...')
+        self.failUnlessEqual(Scrubber(parser='htmlparser').scrub_truncated(html, 20).html, u'see ...')
+
+    def testNothingAfterEllipsis(self):
+        result = Scrubber().scrub_truncated('<ul><li>one</li><li><img src="/a.png"> two</li></ul>', 3)
+        self.failUnlessEqual(result.html, u'<ul><li>one...</li></ul>')
+
+    def testOtherParser(self):
+        result = Scrubber(parser='htmlparser').scrub_truncated(self.html, 11)
+        self.failUnlessEqual(result.html, u'<p>Hello <strong>world...</strong></p>')
+
+class PruneTestCase(unittest.TestCase):
+    html = '<p onclick="x()" class="a">one<!-- c --> two</p><script>if (a<b) document.write("<p>x</p>")</script><form><p>three</p></form><blink title="t">four</blink>'
+
+    def testTree(self):
+        from scrubber.prune import PruningSoup
+        soup = PruningSoup(self.html, Scrubber())
+        self.failUnlessEqual(unicode(soup), u'<p class="a">one two</p><blink title="t">four</blink>')
+        self.failUnlessEqual([unicode(s) for s in soup.p.contents], [u'one', u' two'])
+
+    def testSameOutput(self):
+        for cls in (Scrubber, SelectiveScriptScrubber):
+            for kwargs in ({}, dict(remove_comments=False), dict(single_pass=False)):
+                self.failUnlessEqual(cls(**kwargs).scrub(self.html), cls(prune=False, **kwargs).scrub(self.html))
+
+    def testHooksKeepTags(self):
+        from scrubber.prune import PruningSoup
+        html = '<script src="http://www.statcounter.com/counter/counter_xhtml.js"></script><script src="http://evil.example.com/a.js"></script>'
+        soup = PruningSoup(html, SelectiveScriptScrubber())
+        self.failUnlessEqual(len(soup.findAll('script')), 2)
+        self.failUnlessEqual(SelectiveScriptScrubber().scrub(html), '<script src="http://www.statcounter.com/counter/counter_xhtml.js"></script>')
+
+    def testDisabled(self):
+        self.failIf(Scrubber(observer=ScrubObserver()).prune)
+        self.failIf(Scrubber(parser='htmlparser').prune)
+
+class CommandLineTestCase(unittest.TestCase):
+    records = [
+        '{"id":1,"post":{"body":"<b>hi</b> www.example.com<script>x</script>"}}\n',
+        '{"id":2,"post":{"body":null}}\n',
+        '\n',
+        '{"id":3}\n',
+        'not json\n',
+        '{"id":4,"post":{"body":5}}\n',
+    ]
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        import os
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as fp:
+            fp.write(data)
+        return path
+
+    def run_main(self, args):
+        from StringIO import StringIO
+        from scrubber.cli import main
+        stdout, stderr = StringIO(), StringIO()
+        status = main(args, stdout, stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def testJsonl(self):
+        path = self.write("in.jsonl", "".join(self.records))
+        for args in ([], ["-j", "2", "--chunksize", "1"], ["--mmap"]):
+            status, out, err = self.run_main(["-l", "-f", "post.body", path] + args)
+            self.failUnlessEqual(status, 1)
+            self.failUnlessEqual(out.splitlines(), [
+                '{"id":1,"post":{"body":"<strong>hi</strong> <a href=\\"http://www.example.com\\" rel=\\"nofollow\\">www.example.com</a>"}}',
+                '{"id":2,"post":{"body":null}}',
+                '{"id":3}',
+            ])
+            self.failUnless("in.jsonl:5: ValueError" in err)
+            self.failUnless("in.jsonl:6: post.body is not a string" in err)
+            self.failUnless("5 records" in err and "2 errors" in err)
+
+    def testDocuments(self):
+        import json
+        paths = [self.write("a.html", "<p onclick='x()'>a</p>"), self.write("b.html", '<script src="http://www.example.com/evil.js"></script><a href="/x">x</a>')]
+        status, out, err = self.run_main(["-q", "-w", "--no-nofollow", "-b", "http://example.com/", "-c", "scrubber.SelectiveScriptScrubber"] + paths)
+        self.failUnlessEqual((status, err), (0, ""))
+        self.failUnlessEqual([json.loads(line) for line in out.splitlines()], [
+            {"path": paths[0], "html": "<p>a</p>"},
+            {"path": paths[1], "html": '<a href="http://example.com/x" class="external">x</a>', "scrubber_warnings": ["UnapprovedJavascript"]},
+        ])
+
+class BenchTestCase(unittest.TestCase):
+    def testRun(self):
+        from scrubber import bench
+        self.failUnlessEqual(bench.generate('blog_posts', 3, seed=1), bench.generate('blog_posts', 3, seed=1))
+        report = bench.run(['short_comments', 'script_embeds'], count=5, fork=False)
+        for name in ('short_comments', 'script_embeds'):
+            result = report['results'][name]
+            self.failUnlessEqual(result['docs'], 5)
+            self.failUnlessEqual(sorted(result['phases']), ['total'])
+            self.failUnless(result['peak_rss_kb'] > 0 and result['rss_growth_kb'] >= 0)
+        self.failUnless("vs base" in bench.format_results(report, report))
+        report = bench.run(['blog_posts'], count=2, fork=False, phases=True)
+        phases = report['results']['blog_posts']['phases']
+        self.failUnless(set(['parse', 'serialize', 'total']) <= set(phases) <= set(bench.PHASES))
+        self.failUnless("serialize" in bench.format_results(report))
+        self.failUnless("without pruning" in bench.format_results(report))
+
+class SinglePassTestCase(unittest.TestCase):
+    def testMatchesMultiPass(self):
+        for cls, case in ((Scrubber, ScrubberTestCase), (SelectiveScriptScrubber, SelectiveScriptScrubberTestCase)):
+            single, multi = cls(single_pass=True), cls(single_pass=False)
+            for html, expected in case.tests:
+                self.failUnlessEqual(single.scrub(html), multi.scrub(html))
+
 if __name__ == '__main__':
     unittest.main()